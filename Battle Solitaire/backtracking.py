@@ -1,5 +1,13 @@
 from csp import Constraint, Variable, CSP
 from constraints import *
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from profiling import timed
+from collections import deque, OrderedDict
+import heapq
+import math
 import random
 
 class UnassignedVars:
@@ -8,15 +16,38 @@ class UnassignedVars:
        initialized by passing a select_criteria (to determine the
        order variables are extracted) and the CSP object.
 
-       select_criteria = ['random', 'fixed', 'mrv'] with
-       'random' == select a random unassigned variable
-       'fixed'  == follow the ordering of the CSP variables (i.e.,
-                   csp.variables()[0] before csp.variables()[1]
-       'mrv'    == select the variable with minimum values in its current domain
-                   break ties by the ordering in the CSP variables.
+       select_criteria = ['random', 'fixed', 'mrv', 'domwdeg', 'impact'] with
+       'random'  == select a random unassigned variable
+       'fixed'   == follow the ordering of the CSP variables (i.e.,
+                    csp.variables()[0] before csp.variables()[1]
+       'mrv'     == select the variable with minimum values in its current domain
+                    break ties by the ordering in the CSP variables.
+       'domwdeg' == select the variable with the least current domain size
+                    divided by its weighted degree, the sum of the weights of
+                    its constraints. A constraint's weight is bumped each time
+                    it wipes out a domain (see Constraint.bumpWeight), so
+                    variables in constraints that keep failing come first.
+       'impact'  == select the variable whose current values have the least
+                    total (1 - impact), where the impact of var=val is the
+                    share of the search space (product of domain sizes) that
+                    assigning it and propagating removed, averaged over the
+                    times it was tried (see observe). Values never tried
+                    count as impact 0.
+
+       The last three keep the variables in a heap on their key. Ties go
+       to the variable returned to the unassigned set longest ago (CSP
+       order to begin with), which is the order the original list-based
+       mrv broke them in. The heap is lazy: while the object is the
+       Variable.domainListener, every prune (and weight bump) pushes the
+       variable again with its new, smaller key; extract drops entries
+       of assigned variables and re-pushes entries whose key has grown
+       since (values restored on backtracking), so it costs O(log n)
+       per entry popped.
     '''
+    heuristics = ['random', 'fixed', 'mrv', 'domwdeg', 'impact']
+
     def __init__(self, select_criteria, csp):
-        if select_criteria not in ['random', 'fixed', 'mrv']:
+        if select_criteria not in UnassignedVars.heuristics:
             pass #print "Error UnassignedVars given an illegal selection criteria {}. Must be one of 'random', 'stack', 'queue', or 'mrv'".format(select_criteria)
         self.unassigned = list(csp.variables())
         self.csp = csp
@@ -24,11 +55,79 @@ class UnassignedVars:
         if select_criteria == 'fixed':
             #reverse unassigned list so that we can add and extract from the back
             self.unassigned.reverse()
+        self._heaped = select_criteria in ['mrv', 'domwdeg', 'impact']
+        if self._heaped:
+            self._key = {'mrv': self._mrvKey, 'domwdeg': self._domWdegKey, 'impact': self._impactKey}[select_criteria]
+            self._isUnassigned = [True] * len(csp.variables())
+            self._count = len(csp.variables())
+            #_seq[id] orders unassigned variables by when they were inserted
+            self._seq = list(range(len(csp.variables())))
+            self._nextSeq = len(csp.variables())
+            self._impacts = dict()         #(var id, val) -> [average impact, times tried]
+            self._heap = [(self._key(v), v._id, v._id) for v in csp.variables()]
+            heapq.heapify(self._heap)
+
+    def _mrvKey(self, var):
+        return var.curDomainSize()
+
+    def _domWdegKey(self, var):
+        wdeg = 0
+        for cnstr in self.csp.constraintsOf(var):
+            if cnstr.numUnassigned() > 1:   #only constraints on future variables
+                wdeg += cnstr._weight
+        return var.curDomainSize() / wdeg if wdeg else var.curDomainSize()
+
+    def _impactKey(self, var):
+        key = 0.0
+        impacts = self._impacts
+        for val in var.curDomain():
+            key += 1.0 - impacts.get((var._id, val), (0.0, 0))[0]
+        return key
+
+    def notify(self, var):
+        '''var's key may have dropped: push it again if it is unassigned'''
+        if self._isUnassigned[var._id]:
+            heapq.heappush(self._heap, (self._key(var), self._seq[var._id], var._id))
 
+    def observe(self, var, val, mark, dwo):
+        '''record the impact of var=val, just propagated with the trail
+           at mark beforehand; dwo is True if propagation failed'''
+        if self._select != 'impact':
+            return
+        if dwo:
+            impact = 1.0
+        else:
+            #log of (product of domain sizes before / after)
+            pruned = dict()
+            for (v, bit) in Variable.trail[mark:]:
+                pruned[v] = pruned.get(v, 0) + 1
+            reduction = math.log(var._cursize)
+            for v, k in pruned.items():
+                reduction += math.log((v._cursize + k) / v._cursize)
+            impact = 1.0 - math.exp(-reduction)
+        entry = self._impacts.setdefault((var._id, val), [0.0, 0])
+        entry[1] += 1
+        entry[0] += (impact - entry[0]) / entry[1]
+
+    @timed('battle.UnassignedVars.extract')
     def extract(self):
-        if not self.unassigned:
+        if self.empty():
             pass #print "Warning, extracting from empty unassigned list"
             return None
+        if self._heaped:
+            heap = self._heap
+            while True:
+                key, seq, i = heapq.heappop(heap)
+                if not self._isUnassigned[i] or seq != self._seq[i]:
+                    continue
+                var = self.csp.variables()[i]
+                current = self._key(var)
+                if current != key:
+                    heapq.heappush(heap, (current, seq, i))
+                    continue
+                self._isUnassigned[i] = False
+                self._count -= 1
+                return var
         if self._select == 'random':
             i = random.randint(0,len(self.unassigned)-1)
             nxtvar = self.unassigned[i]
@@ -37,318 +136,711 @@ class UnassignedVars:
             return nxtvar
         if self._select == 'fixed':
             return self.unassigned.pop()
-        if self._select == 'mrv':
-            nxtvar = min(self.unassigned, key=lambda v: v.curDomainSize())
-            self.unassigned.remove(nxtvar)
-            return nxtvar
 
     def empty(self):
+        if self._heaped:
+            return self._count == 0
         return len(self.unassigned) == 0
 
     def insert(self, var):
-        if not var in self.csp.variables():
+        i = var._id
+        if i is None or i >= len(self.csp.variables()) or self.csp.variables()[i] is not var:
             pass #print "Error, trying to insert variable {} in unassigned that is not in the CSP problem".format(var.name())
+        elif self._heaped:
+            self._isUnassigned[i] = True
+            self._count += 1
+            self._seq[i] = self._nextSeq
+            self._nextSeq += 1
+            heapq.heappush(self._heap, (self._key(var), self._seq[i], i))
+            if len(self._heap) > 4 * len(self._isUnassigned) + 64:
+                #drop the stale entries before the heap grows without bound
+                self._heap = [(self._key(v), self._seq[v._id], v._id) for v in self.csp.variables() if self._isUnassigned[v._id]]
+                heapq.heapify(self._heap)
         else:
             self.unassigned.append(var)
 
-def bt_search(algo, csp, variableHeuristic, allSolutions, trace, size, ship_cons, board, specified):
+def bt_search(algo, csp, variableHeuristic, allSolutions, trace, size, ship_cons, board, specified,
+              valueHeuristic='fixed', nodeLimit=None, backjump=False):
     '''Main interface routine for calling different forms of backtracking search
        algorithm is one of ['BT', 'FC', 'GAC']
        csp is a CSP object specifying the csp problem to solve
-       variableHeuristic is one of ['random', 'fixed', 'mrv']
+       variableHeuristic is one of ['random', 'fixed', 'mrv', 'domwdeg', 'impact']
+                   (see UnassignedVars)
        allSolutions True or False. True means we want to find all solutions.
        trace True of False. True means turn on tracing of the algorithm
+       valueHeuristic is one of ['fixed', 'random', 'lcv']
+       'fixed'  == try values in the order of the variable's domain
+       'random' == try them in a random order (seed the random module
+                   for repeatable runs)
+       'lcv'    == least constraining value first: each value is tried
+                   with GAC propagation, and values are ordered by how
+                   few values that pruned (wipe-outs last). GAC only;
+                   BT tries the values in domain order.
+       nodeLimit, if not None, stops the search once it has explored
+       that many nodes. It then returns no solutions and sets
+       bt_search.limitReached, so the caller can tell a search that gave
+       up from one that proved there is no solution.
+       backjump True makes GAC jump back over assignments that play no
+       part in a failure and learn nogoods (see ConflictAnalysis);
+       bt_search.backjumps and bt_search.nogoodPrunes count how often.
 
        bt_search returns a list of solutions. Each solution is itself a list
        of pairs (var, value). Where var is a Variable object, and value is
-       a value from its domain.
+       a value from its domain. To go through the solutions one at a
+       time without collecting them, use bt_solutions.
+
+       size, ship_cons, board and specified describe a Battle Solitaire
+       board modelled with one variable per cell (see battle.py); GAC then
+       also checks the fleet. Pass None for all four to solve any other
+       CSP with plain GAC.
     '''
-    varHeuristics = ['random', 'fixed', 'mrv']
+    solutions = []
+    for soln in bt_solutions(algo, csp, variableHeuristic, trace, size, ship_cons, board, specified,
+                             valueHeuristic, nodeLimit, backjump=backjump):
+        solutions.append(soln)
+        if not allSolutions:
+            break
+    return solutions, bt_search.nodesExplored
+
+def bt_solutions(algo, csp, variableHeuristic, trace, size, ship_cons, board, specified,
+                 valueHeuristic='fixed', nodeLimit=None, materialize=True, backjump=False):
+    '''Generate the solutions of csp one at a time, as the search finds
+       them. The arguments are those of bt_search (there is no
+       allSolutions: stop iterating when you have enough). Statistics
+       go to bt_search.nodesExplored and bt_search.limitReached, as for
+       bt_search.
+
+       The search runs on a SearchEngine, which is suspended between
+       solutions, so taking the first k solutions explores only the
+       nodes needed for them.
+       With materialize False, True is generated for each solution
+       instead of its list of (var, value) pairs, which is all a count
+       needs.
+    '''
+    varHeuristics = UnassignedVars.heuristics
+    valHeuristics = ['fixed', 'random', 'lcv']
     algorithms = ['BT', 'GAC']
 
     #statistics
     bt_search.nodesExplored = 0
+    bt_search.limitReached = False
+    bt_search.backjumps = 0
+    bt_search.nogoodPrunes = 0
 
     if variableHeuristic not in varHeuristics:
         pass #print "Error. Unknown variable heursitics {}. Must be one of {}.".format(
             #variableHeuristic, varHeuristics)
+    if valueHeuristic not in valHeuristics:
+        print("Error: unknown value heuristic {}. Must be one of {}.".format(valueHeuristic, valHeuristics))
     if algo not in algorithms:
         pass #print "Error. Unknown algorithm heursitics {}. Must be one of {}.".format(
             #algo, algorithms)
 
-    uv = UnassignedVars(variableHeuristic,csp)
-    Variable.clearUndoDict()
+    Variable.clearTrail()
     for v in csp.variables():
         v.reset()
-    if algo == 'BT':
-         solutions = BT(uv, csp, allSolutions, trace)
-    elif algo == 'GAC':
-        GacEnforce(csp.constraints(), csp, None, None) #GAC at the root
-        solutions = GAC(uv, csp, board, size, ship_cons, specified)
+    uv = UnassignedVars(variableHeuristic,csp)
+    if uv._heaped:
+        Variable.domainListener = uv.notify
+    engine = None
+    try:
+        if algo == 'BT':
+            engine = SearchEngine('BT', uv, csp, trace, valueHeuristic, materialize=materialize)
+        elif algo == 'GAC':
+            GacEnforce(csp.constraints(), csp, None, None) #GAC at the root
+            fleet = FleetTracker(size, ship_cons, specified) if ship_cons is not None else None
+            cbj = ConflictAnalysis(csp) if backjump else None
+            engine = SearchEngine('GAC', uv, csp, trace, valueHeuristic, board, size, ship_cons, fleet,
+                                  materialize, cbj)
+        else:
+            return
+        while True:
+            remaining = None if nodeLimit is None else nodeLimit - bt_search.nodesExplored
+            status = engine.run(remaining)
+            if status == SearchEngine.SOLUTION:
+                yield engine.solution
+            else:
+                bt_search.limitReached = status == SearchEngine.PAUSED
+                return
+    finally:
+        if engine is not None:
+            engine.close()
+        Variable.domainListener = None
 
-    return solutions, bt_search.nodesExplored
+def count_solutions(algo, csp, variableHeuristic, size, ship_cons, board, specified,
+                    valueHeuristic='fixed', limit=None, backjump=False):
+    '''return the number of solutions of csp (arguments as bt_search),
+       stopping at limit if it is not None: limit=2 is enough to tell
+       whether a solution is unique'''
+    count = 0
+    for found in bt_solutions(algo, csp, variableHeuristic, False, size, ship_cons, board, specified,
+                              valueHeuristic, materialize=False, backjump=backjump):
+        count += 1
+        if limit is not None and count >= limit:
+            break
+    return count
+
+def ordered_values(var, valueHeuristic, csp=None):
+    '''the values of var's current domain in the order to try them.
+       'lcv' needs the csp to propagate each value in.'''
+    values = var.curDomain()
+    if valueHeuristic == 'random':
+        random.shuffle(values)
+    elif valueHeuristic == 'lcv' and len(values) > 1:
+        pruned = dict()
+        for val in values:
+            var.setValue(val)
+            mark = Variable.trailMark()
+            if GacEnforce(csp.constraintsOf(var), csp, var, val) == "DWO":
+                pruned[val] = float('inf')
+            else:
+                pruned[val] = len(Variable.trail) - mark
+            Variable.undoTo(mark)
+        var.unAssign()
+        values.sort(key=lambda val: pruned[val])
+    return values
 
-def BT(unAssignedVars, csp, allSolutions, trace):
-    '''Backtracking Search. unAssignedVars is the current set of
-       unassigned variables.  csp is the csp problem, allSolutions is
-       True if you want all solutionss trace if you want some tracing
-       of variable assignments tried and constraints failed. Returns
-       the set of solutions found.
+class _Frame:
+    '''one node of the search on SearchEngine's stack: the variable
+       assigned there, its values and how far through them it is'''
+    __slots__ = ('var', 'values', 'index', 'mark', 'emark', 'level', 'conflicts')
 
-      To handle finding 'allSolutions', at every stage we collect
-      up the solutions returned by the recursive  calls, and
-      then return a list of all of them.
 
-      If we are only looking for one solution we stop trying
-      further values of the variable currently being tried as
-      soon as one of the recursive calls returns some solutions.
+#what SearchEngine.run does next
+_ENTER, _NEXT, _RETURN, _RESOLVE = range(4)
+
+class SearchEngine:
+    '''Backtracking search (algo 'BT' or 'GAC') on an explicit stack of
+       frames instead of Python recursion, so board size is not limited
+       by the recursion limit, and the search can stop anywhere and carry
+       on later.
+
+       run() searches until the next solution, which it leaves in
+       self.solution, and returns SOLUTION; the next call goes on from
+       there. It returns DONE when the tree is exhausted. Given a node
+       budget it returns PAUSED once that many nodes have been explored;
+       calling it again resumes where it stopped. close() abandons the
+       search and unassigns every variable it assigned.
+
+       BT tries each value of the chosen variable against the
+       constraints it completes. GAC propagates each value with
+       GacEnforce and, for the cell model of battle.py (fleet not None),
+       keeps fleet up to date and checks the complete boards' ships. With
+       cbj (a ConflictAnalysis), a value's failure is explained by a
+       conflict set of levels and a node whose level is not in the
+       conflict set of its subtree is jumped over (see ConflictAnalysis).
+
+       Frames are kept for reuse once popped, so a search allocates one
+       per level of its deepest branch. Nodes are counted in
+       bt_search.nodesExplored.
     '''
-    if unAssignedVars.empty():
-        if trace: pass #print "{} Solution Found".format(csp.name())
-        soln = []
-        for v in csp.variables():
-            soln.append((v, v.getValue()))
-        return [soln]  #each call returns a list of solutions found
-    bt_search.nodesExplored += 1
-    solns = []         #so far we have no solutions recursive calls
-    nxtvar = unAssignedVars.extract()
-    if trace: pass #print "==>Trying {}".format(nxtvar.name())
-    for val in nxtvar.domain():
-        if trace: pass #print "==> {} = {}".format(nxtvar.name(), val)
-        nxtvar.setValue(val)
-        constraintsOK = True
-        for cnstr in csp.constraintsOf(nxtvar):
-            if cnstr.numUnassigned() == 0:
-                if not cnstr.check():
-                    constraintsOK = False
-                    if trace: pass #print "<==falsified constraint\n"
-                    break
-        if constraintsOK:
-            new_solns = BT(unAssignedVars, csp, allSolutions, trace)
-            if new_solns:
-                solns.extend(new_solns)
-            if len(solns) > 0 and not allSolutions:
-                break  #don't bother with other values of nxtvar
-                       #as we found a soln.
-    nxtvar.unAssign()
-    unAssignedVars.insert(nxtvar)
-    return solns
-
-
-def GacEnforce(cons, csp, var_assign, val_assign):
-    cons = csp.constraints()
-    while len(cons) != 0:
-        cnstr = cons.pop()
-        for var in cnstr.scope():
-            for val in var.curDomain():
-                if not cnstr.hasSupport(var,val):
-                    var.pruneValue(val,var_assign, val_assign)
-                    if var.curDomainSize() == 0:
-                        return "DWO"
-                    for recheck in csp.constraintsOf(var):
-                        if recheck != cnstr and recheck not in cons:
-                            cons.append(recheck)
-    return "OK"
+    SOLUTION, PAUSED, DONE = 'solution', 'paused', 'done'
 
+    def __init__(self, algo, unAssignedVars, csp, trace=False, valueHeuristic='fixed',
+                 board=None, size=None, ship_cons=None, fleet=None, materialize=True, cbj=None):
+        self._gac = algo == 'GAC'
+        self._uv = unAssignedVars
+        self._csp = csp
+        self._trace = trace
+        self._valueHeuristic = valueHeuristic
+        self._board = board
+        self._size = size
+        self._ship_cons = ship_cons
+        self._fleet = fleet
+        self._materialize = materialize
+        self._cbj = cbj
+        self._frames = []
+        self._depth = 0              #frames in use
+        self._action = _ENTER
+        self._conflict = None        #for _RETURN and _RESOLVE
+        self.solution = None
 
-def GAC(unAssignedVars,csp, board, size, ship_cons, specified):
-    if unAssignedVars.empty():
+    def _leaf(self):
+        '''every variable is assigned: return the solution, or None if the
+           cell model's board fails its fleet check'''
+        csp = self._csp
+        ship_cons = self._ship_cons
+        if not self._gac:
+            if self._trace: pass #print "{} Solution Found".format(csp.name())
+            return [(v, v.getValue()) for v in csp.variables()] if self._materialize else True
+        if not self._materialize and ship_cons is None:
+            return True
         soln = []
         for var in csp.variables():
-            if int(var._name) > 0:
+            if ship_cons is None or int(var._name) > 0:
                 soln.append((var,var.getValue()))
-        return [soln]
-    bt_search.nodesExplored += 1
-    solns = []
-    next_var = unAssignedVars.extract()
-    for val in next_var.curDomain():
-        next_var.setValue(val)
-        noDWO = True
-        if GacEnforce(csp.constraintsOf(next_var), csp, next_var, val) == "DWO":
-            noDWO = False
-        if noDWO and not check_pruned(csp, ship_cons, size) and not check_placement(csp, size, specified):
-            new_solns = GAC(unAssignedVars, csp, board, size, ship_cons, specified)
-            if new_solns:
-                carr, battle, cruise, dest, sub, var_dict = count_ships(new_solns[0], size)
-                if sub == int(ship_cons[0]) and dest == int(ship_cons[1]) and cruise == int(ship_cons[2]) and battle == int(ship_cons[3]) and carr == int(ship_cons[4]):
-                    match = board_check(board, var_dict, size)
-                    if (match):
-                        solns.extend(new_solns)
-                        if len(solns) > 0:
-                            break
-        next_var.restoreValues(next_var,val)
-    next_var.unAssign()
-    unAssignedVars.insert(next_var)
-    return solns
-
-
-def check_pruned(csp, ship_cons, size):
-    solutions = []
-    for var in csp.variables():
-        if int(var._name) > 0:
-            solutions.append((var,var.getValue()))
-    
-    num_carr, num_battle, num_cruise, num_dest, num_sub, new_var_dict = ship_number_check(solutions, size)
-    if num_sub > int(ship_cons[0]) or num_dest > int(ship_cons[1]) or  num_cruise > int(ship_cons[2]) or num_battle > int(ship_cons[3]) or num_carr > int(ship_cons[4]):
+        if ship_cons is not None:
+            #find all solutions and check which one has right ship #'s
+            carr, battle, cruise, dest, sub, var_dict = count_ships(soln, self._size)
+            if not (sub == int(ship_cons[0]) and dest == int(ship_cons[1]) and cruise == int(ship_cons[2]) and battle == int(ship_cons[3]) and carr == int(ship_cons[4])) \
+               or not board_check(self._board, var_dict, self._size):
+                return None
+        return soln if self._materialize else True
+
+    def _push(self):
+        '''make a node for the next unassigned variable'''
+        if self._depth == len(self._frames):
+            self._frames.append(_Frame())
+        frame = self._frames[self._depth]
+        self._depth += 1
+        frame.var = var = self._uv.extract()
+        if self._trace: pass #print "==>Trying {}".format(var.name())
+        if self._gac:
+            frame.values = ordered_values(var, self._valueHeuristic, self._csp)
+        else:
+            frame.values = var.domain()
+            if self._valueHeuristic == 'random':
+                random.shuffle(frame.values)
+        frame.index = 0
+        if self._cbj is not None:
+            frame.level = self._cbj.enter(var)
+            frame.conflicts = 0
+
+    def _pop(self):
+        '''leave the top node, returning its variable to the unassigned set'''
+        self._depth -= 1
+        frame = self._frames[self._depth]
+        var = frame.var
+        var.unAssign()
+        if self._fleet is not None:
+            self._fleet.unassign(var)
+        self._uv.insert(var)
+        if self._cbj is not None:
+            self._cbj.leave()
+        frame.var = frame.values = None
+
+    def _tryValue(self, frame, val):
+        '''assign val at frame. Returns True if the search should go
+           below it; otherwise the value failed, with self._conflict its
+           conflict set if cbj is used.'''
+        var = frame.var
+        csp = self._csp
+        if self._trace: pass #print "==> {} = {}".format(var.name(), val)
+        var.setValue(val)
+        if not self._gac:
+            for cnstr in csp.constraintsOf(var):
+                if cnstr.numUnassigned() == 0:
+                    if not cnstr.check():
+                        if self._trace: pass #print "<==falsified constraint\n"
+                        return False
+            return True
+        cbj = self._cbj
+        if cbj is not None:
+            cbj.setValue(frame.level, val)
+            self._conflict = cbj.nogoodFor(var, val)
+            if self._conflict is not None:
+                return False
+        if self._fleet is not None:
+            self._fleet.assign(var, val)
+            if self._fleet.violated():
+                self._conflict = cbj.allLevels() if cbj is not None else None
+                return False
+        frame.mark = Variable.trailMark()
+        frame.emark = cbj.mark() if cbj is not None else None
+        dwo = GacEnforce(csp.constraintsOf(var), csp, var, val, cbj) == "DWO"
+        self._uv.observe(var, val, frame.mark, dwo)
+        if dwo:
+            self._conflict = cbj.conflict if cbj is not None else None
+            self._undo(frame)
+            return False
         return True
-    return False
 
-def ship_number_check(solution, size):
-    num_carr = 0
-    num_battle = 0
-    num_cruise = 0
-    num_dest = 0
-    num_sub = 0
-    var_dict = {}
-    for (var, val) in solution:
-        var_dict[int(var.name())] = val
-    for i in range(1, size-1):
-        for j in range(1, size-1):
-            down = None
-            up = None
-            right = None
-            left = None
-            if (i < (size - 5) and var_dict[(i*size+j)] == "S" and var_dict[((i+1)*size+j)] == "S" and var_dict[((i+2)*size+j)] == "S" and var_dict[((i+3)*size+j)] == "S" and var_dict[((i+4)*size+j)] == "S"):
-                num_carr += 1
-            elif (i < (size - 4) and var_dict[(i*size+j)] == "S" and var_dict[((i+1)*size+j)] == "S" and var_dict[((i+2)*size+j)] == "S" and var_dict[((i+3)*size+j)] == "S"):
-                if i != size - 5:
-                    down = var_dict[((i+4)*size+j)]
-                if i != 1:
-                    up = var_dict[((i-1)*size+j)]
-                if down == "." and up == ".":
-                    num_battle += 1
-            elif (i < (size - 3) and var_dict[(i*size+j)] == "S" and var_dict[((i+1)*size+j)] == "S" and var_dict[((i+2)*size+j)] == "S"):
-                if i != size - 4:
-                    down = var_dict[((i+3)*size+j)]
-                if i != 1:
-                    up = var_dict[((i-1)*size+j)]
-                if down == "." and up == ".":
-                    num_cruise += 1
-            elif (i < (size - 2) and var_dict[(i*size+j)] == "S" and var_dict[((i+1)*size+j)] == "S"):
-                if i != size - 3:
-                    down = var_dict[((i+2)*size+j)]
-                if i != 1:
-                    up = var_dict[((i-1)*size+j)]
-                if down == "." and up == ".":
-                    num_dest += 1
-            if (j < (size - 5) and var_dict[(i*size+j)] == "S" and var_dict[(i*size+j+1)] == "S" and var_dict[(i*size+j+2)] == "S" and var_dict[(i*size+j+3)] == "S" and  var_dict[(i*size+j+4)] == "S"):
-                num_carr += 1
-            if (j < (size - 4) and var_dict[(i*size+j)] == "S" and var_dict[(i*size+j+1)] == "S" and var_dict[(i*size+j+2)] == "S" and var_dict[(i*size+j+3)] == "S"):
-                if j != size - 5:
-                    right = var_dict[(i*size+j+4)] 
-                if j != 1:
-                    left = var_dict[(i*size+j-1)]
-                if right == "." and left == ".":
-                    num_battle += 1
-            elif (j < (size - 3) and var_dict[(i*size+j)] == "S" and var_dict[(i*size+j+1)] == "S" and var_dict[(i*size+j+2)] == "S"):
-                if j != size - 4:
-                    right = var_dict[(i*size+j+3)] 
-                if j != 1:
-                    left = var_dict[(i*size+j-1)]
-                if right == "." and left == ".":
-                    num_cruise += 1
-            elif (j < (size - 2) and var_dict[(i*size+j)] == "S" and var_dict[(i*size+j+1)] == "S"):
-                if j != size - 3:
-                    right = var_dict[(i*size+j+2)] 
-                if j != 1:
-                    left = var_dict[(i*size+j-1)]
-                if right == "." and left == ".":
-                    num_dest += 1
-            
-    down = None
-    up = None
-    right = None
-    left = None
-    for i in range(1, size-1):
-        for j in range(1, size-1):
-            single = False
-            if var_dict[(i*size+j)] == "S":
-                if i == 1 and j == 1:
-                    right = var_dict[((i)*size+j+1)]
-                    down = var_dict[((i+1)*size+j)]
-                    if down == "." and right == ".":
-                        single = True
-                elif i == 1 and j == size-2:
-                    left = var_dict[((i)*size+j-1)]
-                    down = var_dict[((i+1)*size+j)]
-                    if down == "." and left == ".":
-                        single = True
-                elif i == size - 2 and j == 1:
-                    up = var_dict[((i-1)*size+j)]
-                    right = var_dict[((i)*size+j+1)]
-                    if up == "." and right == ".":
-                        single = True
-                elif i == size - 2 and j == size - 2:
-                    up = var_dict[((i-1)*size+j)]
-                    left = var_dict[((i)*size+j-1)]
-                    if up == "." and left == ".":
-                        single = True
-                elif i == 1:
-                    down = var_dict[((i+1)*size+j)]
-                    left = var_dict[((i)*size+j-1)]
-                    right = var_dict[((i)*size+j+1)]
-                    if down == "." and left == "." and right == ".":
-                        single = True
-                elif j == 1:
-                    up = var_dict[((i-1)*size+j)]
-                    down = var_dict[((i+1)*size+j)]
-                    right = var_dict[((i)*size+j+1)]
-                    if up == "." and down == "." and right == ".":
-                        single = True
-                elif i == size - 2:
-                    up = var_dict[((i-1)*size+j)]
-                    left = var_dict[((i)*size+j-1)]
-                    right = var_dict[((i)*size+j+1)]
-                    if up == "." and left == "." and right == ".":
-                        single = True
-                elif j == size - 2:
-                    up = var_dict[((i-1)*size+j)]
-                    left = var_dict[((i)*size+j-1)]
-                    down = var_dict[((i+1)*size+j)]
-                    if up == "." and left == "." and down == ".":
-                        single = True
+    def _undo(self, frame):
+        Variable.undoTo(frame.mark)
+        if self._cbj is not None:
+            self._cbj.undo(frame.emark)
+
+    def run(self, maxNodes=None):
+        '''search on until the next solution (SOLUTION, found in
+           self.solution), the end of the tree (DONE), or, if maxNodes is
+           given, until that many more nodes have been explored (PAUSED)'''
+        stop = None if maxNodes is None else bt_search.nodesExplored + maxNodes
+        cbj = self._cbj
+        frames = self._frames
+        while True:
+            action = self._action
+            if action == _ENTER:
+                if self._uv.empty():
+                    soln = self._leaf()
+                    #after a solution every level counts: jumping could skip others
+                    self._conflict = cbj.allLevels() if cbj is not None else None
+                    self._action = _RETURN
+                    if soln is not None:
+                        self.solution = soln
+                        return SearchEngine.SOLUTION
+                    continue
+                if stop is not None and bt_search.nodesExplored >= stop:
+                    return SearchEngine.PAUSED
+                bt_search.nodesExplored += 1
+                self._push()
+                self._action = _NEXT
+            elif action == _NEXT:
+                frame = frames[self._depth - 1]
+                if frame.index == len(frame.values):
+                    #every value failed
+                    if cbj is not None:
+                        self._conflict = frame.conflicts | cbj.expl[frame.var._id]
+                    self._pop()
+                    self._action = _RETURN
+                    continue
+                val = frame.values[frame.index]
+                frame.index += 1
+                if self._tryValue(frame, val):
+                    self._action = _ENTER
+                elif cbj is not None:
+                    self._action = _RESOLVE
+            elif action == _RETURN:
+                #the node above the current one is done with
+                if self._depth == 0:
+                    self._action = None
+                    return SearchEngine.DONE
+                if self._gac:
+                    self._undo(frames[self._depth - 1])
+                self._action = _RESOLVE if cbj is not None else _NEXT
+            elif action == _RESOLVE:
+                frame = frames[self._depth - 1]
+                conflict = self._conflict
+                levelBit = 1 << frame.level
+                if not conflict & levelBit:
+                    #this assignment played no part: jump back past it
+                    bt_search.backjumps += 1
+                    self._pop()
+                    self._action = _RETURN
+                    continue
+                cbj.learn(conflict)
+                frame.conflicts |= conflict & ~levelBit
+                self._action = _NEXT
+            else:
+                return SearchEngine.DONE
+
+    def close(self):
+        '''abandon the search, unassigning the variables it assigned'''
+        while self._depth:
+            self._pop()
+        self._action = None
+
+
+#marks a queued constraint whose every variable must be revised
+ALL_VARS = None
+
+@timed('battle.GacEnforce')
+def GacEnforce(cons, csp, var_assign, val_assign, explain=None):
+    '''Make the constraints in cons, and every constraint reached by the
+       prunings this causes, generalized arc consistent (GAC3).
+
+       The queue holds constraints. queued[c.id()] is False when c is
+       not queued, otherwise it is the only variable of c whose domain
+       changed since c was queued, or ALL_VARS if several did. Values of
+       that one variable cannot have lost support on c, so they are not
+       rechecked. Constraints cache the supports they find (residues),
+       so most rechecks are a few domain lookups.
+
+       var_assign is the variable just assigned (None at the root);
+       cons should be csp.constraintsOf(var_assign) in that case.
+       Returns "DWO" if some variable has no supported value left,
+       "OK" otherwise.
+
+       explain, if given, is the ConflictAnalysis of the search; it is
+       told the constraint behind every pruning and wipe-out.'''
+    queue = deque()
+    queued = [False] * len(csp.constraints())
+    trigger = var_assign if var_assign is not None else ALL_VARS
+    for cnstr in cons:
+        if queued[cnstr._id] is False:
+            queued[cnstr._id] = trigger
+            queue.append(cnstr)
+
+    while queue:
+        cnstr = queue.popleft()
+        skip = queued[cnstr._id]
+        queued[cnstr._id] = False
+        for var, val in cnstr.unsupportedValues(skip):
+            if var.isAssigned():
+                cnstr.bumpWeight()
+                if explain is not None:
+                    explain.wipeout(var, cnstr)
+                return "DWO"
+            var.pruneValue(val)
+            if explain is not None:
+                explain.pruned(var, cnstr)
+            if var.curDomainSize() == 0:
+                cnstr.bumpWeight()
+                if explain is not None:
+                    explain.wipeout(var, cnstr)
+                return "DWO"
+            for recheck in csp.constraintsOf(var):
+                state = queued[recheck._id]
+                if state is False:
+                    queued[recheck._id] = var
+                    queue.append(recheck)
+                elif state is not var:
+                    queued[recheck._id] = ALL_VARS
+    return "OK"
+
+
+class ConflictAnalysis:
+    '''Explanations of failures for conflict-directed backjumping and
+       nogood learning in GAC.
+
+       The assignments of the current branch are numbered by decision
+       level from 0, and a set of levels is an int bitmask. expl[v] is
+       the set of levels behind the values missing from variable v's
+       current domain: when GacEnforce prunes v on constraint c, the
+       levels of c's assigned variables and the explanations of its
+       other unassigned variables are added (a value loses its support
+       only because of those). expl changes are kept on a trail and
+       undone on backtracking together with the prunings.
+
+       A failure is explained by a conflict set of levels: a wipe-out
+       by the explanation of the wiped-out variable and the
+       constraint's reason, a failed fleet check by every level (it
+       gives no finer reason). When a level is not in the conflict set
+       of its subtree, no other value there can help, so GAC jumps back
+       to the deepest level that is.
+
+       Conflict sets of at most NOGOOD_MAX_SIZE levels are also stored
+       as nogoods, sets of (variable, value) assignments that lead to no
+       solution, in an LRU store of NOGOOD_CAPACITY entries. They are
+       indexed by each of their assignments, and every assignment is
+       checked against the nogoods that contain it.
+    '''
+    NOGOOD_CAPACITY = 10000
+    NOGOOD_MAX_SIZE = 8
+
+    def __init__(self, csp):
+        self._vars = csp.variables()
+        self.expl = [0] * len(self._vars)
+        self._etrail = []                  #(var id, previous expl)
+        self._levelOf = [None] * len(self._vars)
+        self._stack = []                   #level -> [var, value]
+        self.conflict = 0                  #set by wipeout
+        self._nogoods = OrderedDict()      #frozenset of (var id, value) -> True, oldest first
+        self._watch = dict()               #(var id, value) -> set of nogoods containing it
+
+    def enter(self, var):
+        '''var is the next decision; return its level'''
+        level = len(self._stack)
+        self._levelOf[var._id] = level
+        self._stack.append([var, None])
+        return level
+
+    def setValue(self, level, val):
+        self._stack[level][1] = val
+
+    def leave(self):
+        var, val = self._stack.pop()
+        self._levelOf[var._id] = None
+
+    def allLevels(self):
+        return (1 << len(self._stack)) - 1
+
+    def mark(self):
+        return len(self._etrail)
+
+    def undo(self, mark):
+        etrail = self._etrail
+        expl = self.expl
+        while len(etrail) > mark:
+            i, old = etrail.pop()
+            expl[i] = old
+
+    def _reason(self, cnstr, var):
+        '''levels that cnstr's other variables depend on'''
+        levelOf = self._levelOf
+        expl = self.expl
+        reason = 0
+        for v in cnstr._scope:
+            if v is not var:
+                level = levelOf[v._id]
+                if level is not None:
+                    reason |= 1 << level
                 else:
-                    up = var_dict[((i-1)*size+j)]
-                    left = var_dict[((i)*size+j-1)]
-                    down = var_dict[((i+1)*size+j)]
-                    right = var_dict[((i)*size+j+1)]
-                    if up == "." and left == "." and down == "." and right == ".":
-                        single = True
-                if single:
-                    num_sub += 1
-    
-    return num_carr, num_battle, num_cruise, num_dest, num_sub, var_dict
-
-
-def check_placement(csp, size, specified):
-    soln_m = []
-    for var in csp.variables():
-        if int(var._name) > 0:
-            soln_m.append((var,var.getValue()))
+                    reason |= expl[v._id]
+        return reason
 
-    var_dict = {}
-    for (var, val) in soln_m:
-        var_dict[int(var.name())] = val
+    def pruned(self, var, cnstr):
+        i = var._id
+        old = self.expl[i]
+        new = old | self._reason(cnstr, var)
+        if new != old:
+            self._etrail.append((i, old))
+            self.expl[i] = new
 
-    for (i, j, coord) in specified:
-        if coord == "M":
-            if j == 1 and var_dict[int(i*size+j+1)] == "S":
-                return True
-            elif i == 1 and var_dict[int((i+1)*size+j)] == "S":
-                return True
-            elif j == size - 2 and var_dict[int(i*size+j-1)] == "S":
-                return True
-            elif i == size - 2 and var_dict[int((i-1)*size+j)] == "S":
-                return True
-        elif coord == "<" and var_dict[int(i*size+j-1)] == "S":
-            return True
-        elif coord == ">" and var_dict[int(i*size+j+1)] == "S":
-            return True
-        elif coord == "^" and var_dict[int((i-1)*size+j)] == "S":
-            return True
-        elif coord == "v" and var_dict[int((i+1)*size+j)] == "S":
-            return True
-    return False
+    def wipeout(self, var, cnstr):
+        conflict = self.expl[var._id] | self._reason(cnstr, var)
+        level = self._levelOf[var._id]
+        if level is not None:
+            conflict |= 1 << level
+        self.conflict = conflict
+
+    def learn(self, conflict):
+        '''store the assignments at the levels of conflict as a nogood'''
+        if not conflict or bin(conflict).count('1') > ConflictAnalysis.NOGOOD_MAX_SIZE:
+            return
+        nogood = []
+        level = 0
+        while conflict:
+            if conflict & 1:
+                var, val = self._stack[level]
+                nogood.append((var._id, val))
+            conflict >>= 1
+            level += 1
+        nogood = frozenset(nogood)
+        if nogood in self._nogoods:
+            self._nogoods.move_to_end(nogood)
+            return
+        self._nogoods[nogood] = True
+        for lit in nogood:
+            self._watch.setdefault(lit, set()).add(nogood)
+        if len(self._nogoods) > ConflictAnalysis.NOGOOD_CAPACITY:
+            old, _ = self._nogoods.popitem(last=False)
+            for lit in old:
+                self._watch[lit].discard(old)
+
+    def nogoodFor(self, var, val):
+        '''if var=val completes a stored nogood, return the levels of
+           its assignments, otherwise None'''
+        watching = self._watch.get((var._id, val))
+        if not watching:
+            return None
+        levelOf = self._levelOf
+        stack = self._stack
+        for nogood in watching:
+            conflict = 0
+            for (i, v) in nogood:
+                level = levelOf[i]
+                if level is None or stack[level][1] != v:
+                    break
+                conflict |= 1 << level
+            else:
+                self._nogoods.move_to_end(nogood)
+                bt_search.nogoodPrunes += 1
+                return conflict
+        return None
+
+
+#index of FleetTracker counts for runs of 'S' longer than any ship
+TOO_LONG = 6
+
+class FleetTracker:
+    '''Keeps track of the ships completed on the partially assigned
+       board of the cell model, so that GAC can reject an assignment
+       that gives the fleet too many ships of some length, or puts a
+       ship cell where a hint says the ship must end, without
+       rescanning the board.
+
+       Runs of two to four assigned 'S' cells in a row or column count
+       as a ship once both of their ends are water or the edge of the
+       board. Five 'S' cells in a row count as a carrier whatever lies
+       beyond them, and longer runs are counted as TOO_LONG, which no
+       fleet allows. An 'S' cell whose four neighbours are water or
+       edge is a submarine.
+
+       Setting a cell only changes the runs through it and its
+       neighbours, so assign and unassign rescan no further than one
+       ship length either way and keep the number of over-full ship
+       lengths up to date.'''
+    def __init__(self, size, ship_cons, specified):
+        self._size = size
+        #border cells read as water
+        self._inner = [0 < i < size-1 and 0 < j < size-1 for i in range(size) for j in range(size)]
+        self._cells = [None if inner else '.' for inner in self._inner]
+        #_limit[length] is the number of ships of that length in the fleet
+        self._limit = [0] * (TOO_LONG + 1)
+        for index, count in enumerate(ship_cons):
+            self._limit[index + 1] = int(count)
+        self._count = [0] * (TOO_LONG + 1)
+        self._over = 0
+
+        #cells that cannot be 'S' given the hints
+        self._forbidden = set()
+        for (i, j, coord) in specified:
+            if coord == "M":
+                if j == 1:
+                    self._forbidden.add(i*size+j+1)
+                if i == 1:
+                    self._forbidden.add((i+1)*size+j)
+                if j == size - 2:
+                    self._forbidden.add(i*size+j-1)
+                if i == size - 2:
+                    self._forbidden.add((i-1)*size+j)
+            elif coord == "<":
+                self._forbidden.add(i*size+j-1)
+            elif coord == ">":
+                self._forbidden.add(i*size+j+1)
+            elif coord == "^":
+                self._forbidden.add((i-1)*size+j)
+            elif coord == "v":
+                self._forbidden.add((i+1)*size+j)
+        self._misplaced = 0
+
+    def assign(self, var, val):
+        '''record that cell variable var was set to val ('S' or '.').
+           The 1/0 variables and the border cells are ignored.'''
+        cell = int(var._name)
+        if cell >= 0 and self._inner[cell]:
+            self._set(cell, val)
+
+    def unassign(self, var):
+        cell = int(var._name)
+        if cell >= 0 and self._inner[cell]:
+            self._set(cell, None)
+
+    def violated(self):
+        '''True if the assigned cells already hold more ships of some
+           length than the fleet has, or a hint is contradicted'''
+        return self._over > 0 or self._misplaced > 0
+
+    @timed('battle.FleetTracker.set')
+    def _set(self, cell, val):
+        cells = self._cells
+        old = cells[cell]
+        if old == val:
+            return
+        if cell in self._forbidden:
+            self._misplaced += (val == 'S') - (old == 'S')
+        self._countAround(cell, -1)
+        cells[cell] = val
+        self._countAround(cell, 1)
+
+    def _countAround(self, cell, sign):
+        '''add (sign 1) or remove (sign -1) the ships that cell
+           belongs to or that its neighbours belong to'''
+        cells = self._cells
+        size = self._size
+        for step in (1, size):
+            if cells[cell] == 'S':
+                self._countRun(cell, step, sign)
+            else:
+                if cells[cell-step] == 'S':
+                    self._countRun(cell-step, step, sign)
+                if cells[cell+step] == 'S':
+                    self._countRun(cell+step, step, sign)
+        for c in (cell, cell-1, cell+1, cell-size, cell+size):
+            if cells[c] == 'S' and cells[c-1] == '.' and cells[c+1] == '.' \
+               and cells[c-size] == '.' and cells[c+size] == '.':
+                self._add(1, sign)
+
+    def _countRun(self, cell, step, sign):
+        '''count the run of 'S' cells through cell along step (1 for
+           its row, size for its column)'''
+        cells = self._cells
+        first = cell
+        while cells[first-step] == 'S':
+            first -= step
+        last = cell
+        while cells[last+step] == 'S':
+            last += step
+        length = (last - first) // step + 1
+        if length > 5:
+            self._add(TOO_LONG, sign)
+        elif length == 5 or (length > 1 and cells[first-step] == '.' and cells[last+step] == '.'):
+            self._add(length, sign)
+
+    def _add(self, length, sign):
+        was_over = self._count[length] > self._limit[length]
+        self._count[length] += sign
+        self._over += (self._count[length] > self._limit[length]) - was_over
 
 
 def board_check(originalB, var_dict, size):
@@ -360,6 +852,7 @@ def board_check(originalB, var_dict, size):
                 return False
     return True
 
+@timed('battle.count_ships')
 def count_ships(solution, size):
     num_carr = 0
     num_battle = 0
@@ -0,0 +1,187 @@
+'''Solve many Battle Solitaire puzzles on a pool of worker processes.
+
+   A job is a (name, puzzle text) pair. read_jobs reads them from a
+   directory of puzzle files or from a JSON-lines stream with one
+   {"id": ..., "puzzle": ...} object per line; a line it cannot read
+   becomes a job whose text is the ValueError saying why, which is
+   reported as that job's error. Each worker imports the
+   solver once and then solves one job at a time, so a job costs only
+   its model building and search. A job that runs past its timeout has
+   its worker killed and replaced, and is reported as timed out.
+'''
+
+import json
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing.connection import wait
+
+
+def read_jobs(source):
+    '''generate the (name, puzzle text) jobs in source: a directory (one
+       job per file, by file name) or a JSON-lines file, '-' meaning
+       stdin. Lines without an "id" are named by their line number.
+       A line that is not a JSON object with a "puzzle" gives the job
+       (name, ValueError) instead of stopping the batch.'''
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if os.path.isfile(path):
+                with open(path) as f:
+                    yield name, f.read()
+        return
+    stream = sys.stdin if source == '-' else open(source)
+    try:
+        for lineno, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                yield str(lineno), ValueError('line {}: not JSON: {}'.format(lineno, e))
+                continue
+            if not isinstance(job, dict):
+                yield str(lineno), ValueError('line {}: not a JSON object'.format(lineno))
+                continue
+            name = str(job.get('id', lineno))
+            if not isinstance(job.get('puzzle'), str):
+                yield name, ValueError('line {}: no "puzzle" string'.format(lineno))
+                continue
+            yield name, job['puzzle']
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def _work(conn, model, engine='csp', variableHeuristic='mrv', valueHeuristic='fixed', backjump=False):
+    '''worker process: solve each (index, text) received on conn and send
+       back (index, result) until None is received'''
+    from battle import solve, bt_search
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        index, text = job
+        start = time.perf_counter()
+        try:
+            solution = solve(text, model, variableHeuristic, valueHeuristic, backjump=backjump, engine=engine)
+            result = {'solution': solution, 'nodes': bt_search.nodesExplored}
+        except Exception as e:
+            result = {'error': '{}: {}'.format(type(e).__name__, e)}
+        result['time'] = round(time.perf_counter() - start, 4)
+        conn.send((index, result))
+
+
+class _Worker:
+    '''one worker process, the parent's end of its pipe and the job it is
+       running (None if idle) with that job's deadline. The settings are
+       passed on to _work.'''
+    def __init__(self, *settings):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_work, args=(child,) + settings, daemon=True)
+        self.process.start()
+        child.close()
+        self.job = None
+        self.deadline = None
+
+    def start(self, index, name, text, timeout):
+        self.conn.send((index, text))
+        self.job = (index, name)
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+def solve_batch(jobs, model='cells', workers=None, timeout=None, ordered=True, engine='csp',
+                variableHeuristic='mrv', valueHeuristic='fixed', backjump=False):
+    '''solve jobs, an iterable of (name, puzzle text), on workers
+       processes (default: one per CPU) and generate a result dict per
+       job: its 'id' and either the 'solution' text (None if the puzzle
+       has none), 'nodes' and 'time', or an 'error'. A job still running
+       after timeout seconds is killed. With ordered results come in the
+       order of jobs, otherwise as soon as each job finishes. engine, the
+       heuristics and backjump are passed on to battle.solve. A job whose text is an exception (see
+       read_jobs) is not run; its result is that error.'''
+    workers = workers or os.cpu_count() or 1
+    jobs = enumerate(jobs)
+    settings = (model, engine, variableHeuristic, valueHeuristic, backjump)
+    pool = [_Worker(*settings) for i in range(workers)]
+    done = {}            #index -> result, held back until its turn if ordered
+    nextOut = 0
+    exhausted = False
+    try:
+        while True:
+            finished = []
+            for worker in pool:
+                while worker.job is None and not exhausted:
+                    job = next(jobs, None)
+                    if job is None:
+                        exhausted = True
+                    else:
+                        index, (name, text) = job
+                        if isinstance(text, Exception):
+                            finished.append((index, {'id': name, 'error': str(text)}))
+                        else:
+                            worker.start(index, name, text, timeout)
+            busy = [worker for worker in pool if worker.job is not None]
+            if busy:
+                deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+                wait_for = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+                ready = wait([worker.conn for worker in busy], wait_for)
+
+            for i, worker in enumerate(pool):
+                if worker.job is None:
+                    continue
+                index, name = worker.job
+                if worker.conn in ready:
+                    try:
+                        index, result = worker.conn.recv()
+                    except EOFError:
+                        result = {'error': 'worker exited with code {}'.format(worker.process.exitcode)}
+                        worker.kill()
+                        pool[i] = _Worker(*settings)
+                    worker.job = None
+                elif worker.deadline is not None and time.monotonic() >= worker.deadline:
+                    result = {'error': 'timed out after {}s'.format(timeout)}
+                    worker.kill()
+                    pool[i] = _Worker(*settings)
+                else:
+                    continue
+                result['id'] = name
+                finished.append((index, result))
+
+            for index, result in finished:
+                if not ordered:
+                    yield result
+                else:
+                    done[index] = result
+            while nextOut in done:
+                yield done.pop(nextOut)
+                nextOut += 1
+            if not busy:
+                break
+    finally:
+        for worker in pool:
+            worker.stop()
+
+
+def write_results(results, out):
+    '''write each result as one JSON line to out, flushing as they come'''
+    for result in results:
+        out.write(json.dumps(result, sort_keys=True) + '\n')
+        out.flush()
@@ -1,129 +1,226 @@
 from csp import Constraint, Variable, CSP
 from constraints import *
-from backtracking import bt_search
+from backtracking import bt_search, bt_solutions, count_solutions
+from shipmodel import build_ship_csp, ships_to_cells
+from bitsolver import BitPuzzle
+from satmodel import SatPuzzle
+from profiling import profile_call
 import sys
 import argparse
 
-parser = argparse.ArgumentParser()
-parser.add_argument(
-  "--inputfile",
-  type=str,
-  required=True,
-  help="The input file that contains the puzzles."
-)
-parser.add_argument(
-  "--outputfile",
-  type=str,
-  required=True,
-  help="The output file that contains the solution."
-)
-args = parser.parse_args()
-file = open(args.inputfile, 'r')
-b = file.read()
-b2 = b.split()
-size = len(b2[0])
-size = size + 2
-b3 = []
-b3 += ['0' + b2[0] + '0']
-b3 += ['0' + b2[1] + '0']
-b3 += [b2[2] + ('0' if len(b2[2]) == 3 else '')]
-b3 += ['0' * size]
-for i in range(3, len(b2)):
-  b3 += ['0' + b2[i] + '0']
-b3 += ['0' * size]
-row_cons = b2[0]
-col_cons = b2[1]
-for row_index, constraint in enumerate(row_cons):
-    if constraint == '0':
-        b3[row_index + 4] = b3[row_index + 4][0] + '.' * (size - 2) + b3[row_index + 4][-1]
-
-for col_index, constraint in enumerate(col_cons):
-    if constraint == '0':
-        for row_index in range(4, len(b3) - 1):
-            b3[row_index] = (b3[row_index][:col_index + 1] + '.' + b3[row_index][col_index + 2:])
-
-
-str_board = "\n".join(b3)
-ship_cons = b2[2]
-varlist = []
-varn = {}
-conslist = []
-specified = []
-board = str_board.split()[3:]
-#1/0 variables
-for i in range(0,size):
-  for j in range(0, size):
-    v = None
-    if i == 0 or i == size-1 or j == 0 or j == size-1:
-      v = Variable(str(-1-(i*size+j)), [0])
-    else:
-      coord = board[i][j]
-      if coord == '.':
-         v = Variable(str(-1-(i*size+j)), [0])
-      else:
-        v = Variable(str(-1-(i*size+j)), [0,1])
-      if coord != "0":
-        specified.append((i,j,coord))
-    varlist.append(v)
-    varn[str(-1-(i*size+j))] = v
-
-#make 1/0 variables match board info
-ii = 0
-for i in str_board.split()[3:]:
-  jj = 0
-  for j in i:
-    if j != '0' and j != '.':
-      conslist.append(TableConstraint('boolean_match', [varn[str(-1-(ii*size+jj))]], [[1]]))
-    elif j == '.':
-      conslist.append(TableConstraint('boolean_match', [varn[str(-1-(ii*size+jj))]], [[0]]))
-    jj += 1
-  ii += 1
-
-#row and column constraints on 1/0 variables
-row_constraint = []
-for i in str_board.split()[0]:
-  row_constraint += [int(i)]
-
-for row in range(0,size):
-  conslist.append(NValuesConstraint('row', [varn[str(-1-(row*size+col))] for col in range(0,size)], [1], row_constraint[row], row_constraint[row]))
-
-col_constraint = []
-for i in str_board.split()[1]:
-  col_constraint += [int(i)]
-
-for col in range(0,size):
-  conslist.append(NValuesConstraint('col', [varn[str(-1-(col+row*size))] for row in range(0,size)], [1], col_constraint[col], col_constraint[col]))
-
-#diagonal constraints on 1/0 variables
-for i in range(1, size-1):
-    for j in range(1, size-1):
-      for k in range(9):
-        conslist.append(NValuesConstraint('diag', [varn[str(-1-(i*size+j))], varn[str(-1-((i-1)*size+(j-1)))]], [1], 0, 1))
-        conslist.append(NValuesConstraint('diag', [varn[str(-1-(i*size+j))], varn[str(-1-((i-1)*size+(j+1)))]], [1], 0, 1))
-
-#./S/</>/v/^/M variables
-#these would be added to the csp as well, before searching,
-#along with other constraints
-for i in range(0, size):
-  for j in range(0, size):
-    if board[i][j] == '.':
-      v = Variable(str(i*size+j), ['.'])
+
+def parse_puzzle(board_text):
+    '''read a puzzle: the row counts, the column counts, the fleet
+       string and the rows of the grid, whitespace separated. Returns
+       (board, size, row_cons, col_cons, ship_cons) where board is the
+       grid padded with a border of '0' cells (size is its padded width)
+       and rows or columns whose count is 0 are already water.'''
+    b2 = board_text.split()
+    size = len(b2[0])
+    size = size + 2
+    b3 = []
+    b3 += ['0' + b2[0] + '0']
+    b3 += ['0' + b2[1] + '0']
+    b3 += [b2[2] + ('0' if len(b2[2]) == 3 else '')]
+    b3 += ['0' * size]
+    for i in range(3, len(b2)):
+      b3 += ['0' + b2[i] + '0']
+    b3 += ['0' * size]
+    row_cons = b2[0]
+    col_cons = b2[1]
+    for row_index, constraint in enumerate(row_cons):
+        if constraint == '0':
+            b3[row_index + 4] = b3[row_index + 4][0] + '.' * (size - 2) + b3[row_index + 4][-1]
+
+    for col_index, constraint in enumerate(col_cons):
+        if constraint == '0':
+            for row_index in range(4, len(b3) - 1):
+                b3[row_index] = (b3[row_index][:col_index + 1] + '.' + b3[row_index][col_index + 2:])
+
+    ship_cons = b2[2]
+    board = b3[3:]
+    return board, size, row_cons, col_cons, ship_cons
+
+
+def build_cell_csp(board, size, row_cons, col_cons):
+    '''build the CSP with a 1/0 and a ./S variable per cell of the
+       padded board. Returns the CSP and the list of (i, j, hint) for
+       the hinted cells, which the search needs to check the fleet.'''
+    varlist = []
+    varn = {}
+    conslist = []
+    specified = []
+    #1/0 variables
+    for i in range(0,size):
+      for j in range(0, size):
+        v = None
+        if i == 0 or i == size-1 or j == 0 or j == size-1:
+          v = Variable(str(-1-(i*size+j)), [0])
+        else:
+          coord = board[i][j]
+          if coord == '.':
+             v = Variable(str(-1-(i*size+j)), [0])
+          else:
+            v = Variable(str(-1-(i*size+j)), [0,1])
+          if coord != "0":
+            specified.append((i,j,coord))
+        varlist.append(v)
+        varn[str(-1-(i*size+j))] = v
+
+    #make 1/0 variables match board info
+    ii = 0
+    for i in board:
+      jj = 0
+      for j in i:
+        if j != '0' and j != '.':
+          conslist.append(TableConstraint('boolean_match', [varn[str(-1-(ii*size+jj))]], [[1]]))
+        elif j == '.':
+          conslist.append(TableConstraint('boolean_match', [varn[str(-1-(ii*size+jj))]], [[0]]))
+        jj += 1
+      ii += 1
+
+    #row and column constraints on 1/0 variables
+    row_constraint = []
+    for i in '0' + row_cons + '0':
+      row_constraint += [int(i)]
+
+    for row in range(0,size):
+      conslist.append(NValuesConstraint('row', [varn[str(-1-(row*size+col))] for col in range(0,size)], [1], row_constraint[row], row_constraint[row]))
+
+    col_constraint = []
+    for i in '0' + col_cons + '0':
+      col_constraint += [int(i)]
+
+    for col in range(0,size):
+      conslist.append(NValuesConstraint('col', [varn[str(-1-(col+row*size))] for row in range(0,size)], [1], col_constraint[col], col_constraint[col]))
+
+    #diagonal constraints on 1/0 variables
+    for i in range(1, size-1):
+        for j in range(1, size-1):
+          conslist.append(NValuesConstraint('diag', [varn[str(-1-(i*size+j))], varn[str(-1-((i-1)*size+(j-1)))]], [1], 0, 1))
+          conslist.append(NValuesConstraint('diag', [varn[str(-1-(i*size+j))], varn[str(-1-((i-1)*size+(j+1)))]], [1], 0, 1))
+
+    #./S/</>/v/^/M variables
+    #these would be added to the csp as well, before searching,
+    #along with other constraints
+    for i in range(0, size):
+      for j in range(0, size):
+        if board[i][j] == '.':
+          v = Variable(str(i*size+j), ['.'])
+        else:
+           v = Variable(str(i*size + j), ['.', 'S'])
+        varlist.append(v)
+        varn[str(str(i*size+j))] = v
+        #connect 1/0 variables to W/S/L/R/B/T/M variables
+        conslist.append(TableConstraint('connect', [varn[str(-1-(i*size+j))], varn[str(i*size+j)]], [[0,'.'],[1,'S']]))
+
+    return CSP('battleship', varlist, conslist), specified
+
+
+def build_model(board_text, model='cells', variableHeuristic='mrv'):
+    '''parse a puzzle and build its CSP. model is 'cells' (a variable
+       per cell, see build_cell_csp) or 'ships' (a variable per ship,
+       see shipmodel). Returns the parsed puzzle (as parse_puzzle) and
+       the arguments to pass to bt_search.'''
+    puzzle = parse_puzzle(board_text)
+    board, size, row_cons, col_cons, ship_cons = puzzle
+    if model == 'ships':
+        #one variable per ship; the fleet needs no checking afterwards
+        csp = build_ship_csp(board, size, row_cons, col_cons, ship_cons)
+        search_args = ('GAC', csp, variableHeuristic, False, False, None, None, None, None)
     else:
-       v = Variable(str(i*size + j), ['.', 'S'])
-    varlist.append(v)
-    varn[str(str(i*size+j))] = v
-    #connect 1/0 variables to W/S/L/R/B/T/M variables
-    conslist.append(TableConstraint('connect', [varn[str(-1-(i*size+j))], varn[str(i*size+j)]], [[0,'.'],[1,'S']]))
+        #find all solutions and check which one has right ship #'s
+        csp, specified = build_cell_csp(board, size, row_cons, col_cons)
+        search_args = ('GAC', csp, variableHeuristic, False, False, size, ship_cons, board, specified)
+    return puzzle, search_args
 
 
-def output_to_file(filename, sol, size):
-    f = open(filename, "a")
-    f.seek(0)
-    f.truncate()
+#solvers working on ship placements directly, by --engine name
+PLACEMENT_ENGINES = {'bitset': BitPuzzle, 'sat': SatPuzzle}
+
+
+def solve(board_text, model='cells', variableHeuristic='mrv', valueHeuristic='fixed', nodeLimit=None,
+          backjump=False, engine='csp'):
+    '''solve the puzzle in board_text (the format of an input file) and
+       return the solved grid as text, ships drawn with <M>, ^Mv and S,
+       or None if it has no solution. bt_search.nodesExplored holds the
+       number of nodes the search took. The heuristics, nodeLimit and
+       backjump are passed on to bt_search; if the limit stops the search, None is
+       returned and bt_search.limitReached is set.
+
+       engine 'bitset' solves with bitsolver and 'sat' with satmodel
+       instead of a CSP search; the model, heuristics and search options
+       are then ignored.'''
+    if engine in PLACEMENT_ENGINES:
+        puzzle = parse_puzzle(board_text)
+        solver = PLACEMENT_ENGINES[engine](*puzzle)
+        placements = next(solver.solutions(), None)
+        bt_search.nodesExplored = solver.nodesExplored
+        if placements is None:
+            return None
+        return render_solution(puzzle, 'ships', [(None, placement) for placement in placements])
+    puzzle, search_args = build_model(board_text, model, variableHeuristic)
+    solutions, num_nodes = bt_search(*search_args, valueHeuristic=valueHeuristic, nodeLimit=nodeLimit,
+                                     backjump=backjump)
+    if not solutions:
+        return None
+    return render_solution(puzzle, model, solutions[0])
+
+
+def solutions(board_text, model='cells', variableHeuristic='mrv', valueHeuristic='fixed', backjump=False,
+              engine='csp'):
+    '''generate the text of every solution of the puzzle, finding each
+       one only when it is asked for'''
+    if engine in PLACEMENT_ENGINES:
+        puzzle = parse_puzzle(board_text)
+        solver = PLACEMENT_ENGINES[engine](*puzzle)
+        bt_search.nodesExplored = 0
+        for placements in solver.solutions():
+            bt_search.nodesExplored = solver.nodesExplored
+            yield render_solution(puzzle, 'ships', [(None, placement) for placement in placements])
+        bt_search.nodesExplored = solver.nodesExplored
+        return
+    puzzle, search_args = build_model(board_text, model, variableHeuristic)
+    algo, csp, variableHeuristic, allSolutions, trace, size, ship_cons, board, specified = search_args
+    for solution in bt_solutions(algo, csp, variableHeuristic, trace, size, ship_cons, board, specified,
+                                 valueHeuristic, backjump=backjump):
+        yield render_solution(puzzle, model, solution)
+
+
+def count(board_text, model='cells', variableHeuristic='mrv', valueHeuristic='fixed', limit=None,
+          backjump=False, engine='csp'):
+    '''return the number of solutions of the puzzle, counting no
+       further than limit if it is given (limit=2 tells whether the
+       solution is unique)'''
+    if engine in PLACEMENT_ENGINES:
+        n = 0
+        for placements in PLACEMENT_ENGINES[engine](*parse_puzzle(board_text)).solutions():
+            n += 1
+            if limit is not None and n >= limit:
+                break
+        return n
+    puzzle, search_args = build_model(board_text, model, variableHeuristic)
+    algo, csp, variableHeuristic, allSolutions, trace, size, ship_cons, board, specified = search_args
+    return count_solutions(algo, csp, variableHeuristic, size, ship_cons, board, specified,
+                           valueHeuristic, limit, backjump)
+
+
+def render_solution(puzzle, model, solution):
+    '''return a solution found by bt_search for the model built by
+       build_model for puzzle as the text of the solved grid'''
+    size = puzzle[1]
+    if model == 'ships':
+        return render_cells(ships_to_cells(solution, size), size)
     var_dict = {}
-    for (var, val) in sol:
+    for (var, val) in solution:
         var_dict[int(var.name())] = val
+    return render_cells(var_dict, size)
 
+
+def render_cells(var_dict, size):
+    '''return the board whose cells (index i*size+j on the padded
+       board) are 'S' or '.' in var_dict as text, with ships drawn as
+       <M>, ^Mv and S'''
     for i in range(1, size-1):
         for j in range(1, size-1):
             if j < (size - 4) and var_dict[(i*size+j)] == "S" and var_dict[(i*size+j+1)] == "S" and var_dict[(i*size+j+2)] == "S" and var_dict[(i*size+j+3)] == "S" and var_dict[(i*size+j+4)] == "S":
@@ -163,16 +260,150 @@ def output_to_file(filename, sol, size):
                 var_dict[((i)*size+j)] = "^"
                 var_dict[((i+1)*size+j)] = "v"
         
+    rows = []
     for i in range(1, size-1):
-        for j in range(1, size-1):
-            f.write(var_dict[(i*size+j)])
-        if i != (size-2):
-            f.write("\n")
-    f.close()
-
-#find all solutions and check which one has right ship #'s
-csp = CSP('battleship', varlist, conslist)
-solutions, num_nodes = bt_search('GAC', csp, 'mrv', False, False, size, ship_cons, board, specified)
-sys.stdout = open(args.outputfile, 'w')
-for i in range(len(solutions)):
-  output_to_file(filename=args.outputfile, sol=solutions[i], size=size)
+        rows.append(''.join(var_dict[(i*size+j)] for j in range(1, size-1)))
+    return "\n".join(rows)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+    "--inputfile",
+    type=str,
+    help="The input file that contains the puzzles."
+  )
+  parser.add_argument(
+    "--outputfile",
+    type=str,
+    help="The output file that contains the solution (with --batch: the JSON-lines results, default stdout)."
+  )
+  parser.add_argument(
+    "--profile",
+    type=str,
+    metavar="PREFIX",
+    help="Profile the solver and write PREFIX.pstats and PREFIX.collapsed."
+  )
+  parser.add_argument(
+    "--model",
+    type=str,
+    default='cells',
+    choices=['cells', 'ships'],
+    help="Model the puzzle with a variable per cell or a variable per ship."
+  )
+  parser.add_argument(
+    "--engine",
+    type=str,
+    default='csp',
+    choices=['csp', 'bitset', 'sat'],
+    help="Solve with CSP search (see --model), bitset ship placements (bitsolver.py) or CDCL SAT (satmodel.py)."
+  )
+  parser.add_argument(
+    "--heuristic",
+    type=str,
+    default='mrv',
+    choices=['mrv', 'domwdeg', 'impact', 'fixed', 'random'],
+    help="Variable ordering of the search (see backtracking.UnassignedVars)."
+  )
+  parser.add_argument(
+    "--values",
+    type=str,
+    default='fixed',
+    choices=['fixed', 'random', 'lcv'],
+    help="Value ordering of the search: domain order, random or least constraining value first."
+  )
+  parser.add_argument(
+    "--backjump",
+    action='store_true',
+    help="Backjump over assignments that play no part in a failure and learn nogoods (GAC only)."
+  )
+  parser.add_argument(
+    "--count",
+    action='store_true',
+    help="Count the solutions instead of writing one; the count is printed and written to --outputfile if given."
+  )
+  parser.add_argument(
+    "--count-limit",
+    type=int,
+    default=None,
+    help="With --count, stop counting at this many solutions (2 checks uniqueness)."
+  )
+  parser.add_argument(
+    "--batch",
+    type=str,
+    metavar="SOURCE",
+    help="Solve every puzzle in a directory, or in a JSON-lines file ('-' for stdin) of {\"id\": ..., \"puzzle\": ...} objects, and write one JSON result per line."
+  )
+  parser.add_argument(
+    "--jobs",
+    type=int,
+    default=None,
+    help="Number of worker processes for --batch (default: one per CPU)."
+  )
+  parser.add_argument(
+    "--timeout",
+    type=float,
+    default=None,
+    help="Seconds allowed per puzzle with --batch or --portfolio."
+  )
+  parser.add_argument(
+    "--order",
+    type=str,
+    default='input',
+    choices=['input', 'completion'],
+    help="Write --batch results in input order or as they complete."
+  )
+  parser.add_argument(
+    "--portfolio",
+    action='store_true',
+    help="Race several variable/value orders and seeded restarts in parallel processes; the first to finish wins."
+  )
+  args = parser.parse_args()
+  if args.batch:
+    from batch import read_jobs, solve_batch, write_results
+    results = solve_batch(read_jobs(args.batch), args.model, args.jobs, args.timeout, args.order == 'input',
+                          args.engine, args.heuristic, args.values, args.backjump)
+    if args.outputfile:
+      with open(args.outputfile, 'w') as out:
+        write_results(results, out)
+    else:
+      write_results(results, sys.stdout)
+    return
+  if not args.inputfile or not (args.outputfile or args.count):
+    parser.error("--inputfile and --outputfile are required unless --batch is given")
+  if args.portfolio and args.engine != 'csp':
+    parser.error("--portfolio races CSP searches; it cannot be used with --engine {}".format(args.engine))
+  if args.portfolio and args.profile:
+    parser.error("--portfolio runs its searches in other processes; it cannot be used with --profile")
+  with open(args.inputfile, 'r') as f:
+    board_text = f.read()
+  if args.count:
+    n = count(board_text, args.model, args.heuristic, args.values, args.count_limit, args.backjump, args.engine)
+    print(n)
+    if args.outputfile:
+      with open(args.outputfile, 'w') as f:
+        f.write("{}\n".format(n))
+    return
+  if args.portfolio:
+    from portfolio import race
+    result = race(board_text, args.model, timeout=args.timeout, backjump=args.backjump)
+    if result is None:
+      print("Portfolio: no configuration finished", file=sys.stderr)
+      solution = None
+    else:
+      print("Portfolio: won by {} after {} nodes, {} restarts, {}s".format(
+        result['config'], result['nodes'], result['restarts'], result['time']), file=sys.stderr)
+      solution = result['solution']
+  elif args.profile:
+    solution = profile_call(args.profile, solve, board_text, args.model, args.heuristic, args.values,
+                            backjump=args.backjump, engine=args.engine)
+  else:
+    solution = solve(board_text, args.model, args.heuristic, args.values, backjump=args.backjump,
+                     engine=args.engine)
+  with open(args.outputfile, 'w') as f:
+    if solution is not None:
+      f.write(solution)
+
+
+if __name__ == '__main__':
+  main()
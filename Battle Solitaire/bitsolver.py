@@ -0,0 +1,181 @@
+'''Bitset ship-placement solver for Battle Solitaire.
+
+   The playing area is numbered row by row, so a set of cells is an
+   int with one bit per cell. Every legal placement of every ship
+   length (see shipmodel.legal_placements) is precomputed as two masks:
+   the cells it covers, and its zone, those cells plus the no-touch
+   halo around them. A placement fits when its cells miss the zones of
+   the ships already placed; placing it adds its zone to them.
+
+   Row and column counts are kept as one int too, with a field of
+   _width bits per row and column. A placement's usage is packed the
+   same way, and it fits the remaining counts when subtracting it
+   borrows from no field: each field has a guard bit on top, which the
+   subtraction only clears if that field went negative.
+
+   The search first covers the hinted ship cells, always the one with
+   the fewest fitting placements, then places the rest of the fleet
+   longest ships first, each ship of a length at a later placement than
+   the one before it. So every fleet layout is met exactly once and the
+   solutions are those of the cell and ship models.
+'''
+
+from shipmodel import SHIP_LENGTHS, legal_placements, placement_cells, placement_halo
+
+try:
+    _popcount = int.bit_count
+except AttributeError:   #before Python 3.10
+    def _popcount(x):
+        return bin(x).count('1')
+
+
+class BitPuzzle:
+    '''the placement masks and counts of one puzzle, as parsed by
+       battle.parse_puzzle. nodesExplored counts the search nodes of
+       the last call of solutions().'''
+
+    def __init__(self, board, size, row_cons, col_cons, ship_cons):
+        n = size - 2
+        self.size = size
+        self.nodesExplored = 0
+        self._n = n
+        self._width = n.bit_length() + 1
+        self._fieldMask = (1 << (self._width - 1)) - 1
+        self._guards = 0
+        for k in range(2 * n):
+            self._guards |= 1 << (k * self._width + self._width - 1)
+
+        #the fleet, longest ships first: [length, count]
+        self._fleet = []
+        for index in reversed(range(len(SHIP_LENGTHS))):
+            count = int(ship_cons[index]) if index < len(ship_cons) else 0
+            if count:
+                self._fleet.append([SHIP_LENGTHS[index], count])
+
+        self._rowMasks = [0] * n
+        self._colMasks = [0] * n
+        self._water = 0
+        self._hints = 0
+        for i in range(1, size - 1):
+            for j in range(1, size - 1):
+                bit = self._bit(i, j)
+                self._rowMasks[i - 1] |= bit
+                self._colMasks[j - 1] |= bit
+                if board[i][j] == '.':
+                    self._water |= bit
+                elif board[i][j] != '0':
+                    self._hints |= bit
+
+        self._budget = 0
+        for k in range(n):
+            self._budget |= int(row_cons[k]) << (k * self._width)
+            self._budget |= int(col_cons[k]) << ((n + k) * self._width)
+        self._consistent = sum(int(c) for c in row_cons) == sum(int(c) for c in col_cons) == \
+            sum(length * count for length, count in self._fleet)
+
+        #length -> list of (cover, zone, usage, placement); bit -> placements covering it
+        self._placements = dict()
+        self._covering = dict()
+        for length, count in self._fleet:
+            entries = []
+            for placement in legal_placements(length, board, size, row_cons, col_cons):
+                cells = placement_cells(placement)
+                cover = zone = usage = 0
+                for (i, j) in cells:
+                    cover |= self._bit(i, j)
+                    usage += (1 << ((i - 1) * self._width)) + (1 << ((n + j - 1) * self._width))
+                zone = cover
+                for (i, j) in placement_halo(placement):
+                    if 0 < i < size - 1 and 0 < j < size - 1:
+                        zone |= self._bit(i, j)
+                entry = (cover, zone, usage, placement)
+                entries.append(entry)
+                hinted = cover & self._hints
+                while hinted:
+                    bit = hinted & -hinted
+                    self._covering.setdefault(bit, []).append((length, entry))
+                    hinted ^= bit
+            self._placements[length] = entries
+
+    def _bit(self, i, j):
+        '''the bit of cell (i, j) of the padded board'''
+        return 1 << ((i - 1) * self._n + (j - 1))
+
+    def _fits(self, budget, usage):
+        guards = self._guards
+        return ((budget | guards) - usage) & guards == guards
+
+    def _feasible(self, blocked, budget):
+        '''can every row and column still get its remaining count from
+           the cells outside the zones placed so far?'''
+        width = self._width
+        mask = self._fieldMask
+        for k, line in enumerate(self._rowMasks + self._colMasks):
+            need = (budget >> (k * width)) & mask
+            if need and need > _popcount(line & ~blocked):
+                return False
+        return True
+
+    def solutions(self):
+        '''generate every solution as a list of placements'''
+        self.nodesExplored = 0
+        if not self._consistent:
+            return
+        left = dict((length, count) for length, count in self._fleet)
+        yield from self._coverHints(self._water, 0, self._budget, left, [])
+
+    def _coverHints(self, blocked, covered, budget, left, placed):
+        self.nodesExplored += 1
+        uncovered = self._hints & ~covered
+        if not uncovered:
+            yield from self._placeFleet(blocked, budget, left, 0, 0, placed)
+            return
+        #branch on the hinted cell with the fewest placements that fit
+        best = None
+        while uncovered:
+            bit = uncovered & -uncovered
+            uncovered ^= bit
+            fitting = [(length, entry) for (length, entry) in self._covering.get(bit, ())
+                       if left[length] and not entry[0] & blocked and self._fits(budget, entry[2])]
+            if best is None or len(fitting) < len(best):
+                best = fitting
+                if not best:
+                    return
+        for length, (cover, zone, usage, placement) in best:
+            newBlocked = blocked | zone
+            newBudget = budget - usage
+            if not self._feasible(newBlocked, newBudget):
+                continue
+            left[length] -= 1
+            placed.append(placement)
+            yield from self._coverHints(newBlocked, covered | cover, newBudget, left, placed)
+            placed.pop()
+            left[length] += 1
+
+    def _placeFleet(self, blocked, budget, left, fleetIndex, start, placed):
+        '''place the ships of self._fleet from fleetIndex on, the next
+           one at placement start or later of its length'''
+        self.nodesExplored += 1
+        fleet = self._fleet
+        while fleetIndex < len(fleet) and not left[fleet[fleetIndex][0]]:
+            fleetIndex += 1
+            start = 0
+        if fleetIndex == len(fleet):
+            if budget == 0:
+                yield list(placed)
+            return
+        length = fleet[fleetIndex][0]
+        entries = self._placements[length]
+        for index in range(start, len(entries)):
+            cover, zone, usage, placement = entries[index]
+            if cover & blocked or not self._fits(budget, usage):
+                continue
+            newBlocked = blocked | zone
+            newBudget = budget - usage
+            if not self._feasible(newBlocked, newBudget):
+                continue
+            left[length] -= 1
+            placed.append(placement)
+            yield from self._placeFleet(newBlocked, newBudget, left, fleetIndex, index + 1, placed)
+            placed.pop()
+            left[length] += 1
@@ -1,4 +1,9 @@
 from csp import Constraint, Variable
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from profiling import timed
 
 
 class TableConstraint(Constraint):
@@ -8,7 +13,7 @@ class TableConstraint(Constraint):
        A table constraint explicitly stores the set of satisfying
        tuples of assignments.'''
 
-    def __init__(self, name, scope, satisfyingAssignments):
+    def __init__(self, name, scope, satisfyingAssignments, mode='index'):
         '''Init by specifying a name and a set variables the constraint is over.
            Along with a list of satisfying assignments.
            Each satisfying assignment is itself a list, of length equal to
@@ -31,43 +36,118 @@ class TableConstraint(Constraint):
                                 [4, 2, 3, 1], [4, 3, 1, 2], [4, 3, 2, 1]])
           as these are the only assignments to A,B,C respectively that
           satisfy alldiff(A,B,C,D)
+
+          mode selects how supports are found:
+          'index'   == for each (position, value) keep the list of
+                       satisfying tuples with that value there, and only
+                       scan those (after trying the last support found).
+          'compact' == compact-table propagation: for each (position,
+                       value) keep a bitset of the tuples with that
+                       value there. The tuples still valid are the AND
+                       over positions of the OR of the bitsets of the
+                       values in the current domain, and a value has
+                       support iff its bitset meets that. Best for
+                       large arities and tables.
         '''
 
         Constraint.__init__(self,name, scope)
         self._name = "TableCnstr_" + name
+        if mode not in ['index', 'compact']:
+            print("Error: TableConstraint given an illegal mode {}. Must be one of 'index' or 'compact'".format(mode))
+        self._mode = mode
+        self._position = dict()           #var -> its (first) position in scope
+        for i, var in enumerate(self._scope):
+            self._position.setdefault(var, i)
+        self._setTuples(satisfyingAssignments)
+
+    def _setTuples(self, satisfyingAssignments):
         self.satAssignments = satisfyingAssignments
+        self._satSet = set(tuple(assignment) for assignment in satisfyingAssignments)
+        self._residues.clear()
+        #per position: value -> indexes of the satisfying tuples with
+        #that value at that position, and the same set as a bitset
+        self._supports = [dict() for var in self._scope]
+        self._masks = [dict() for var in self._scope]
+        for t, assignment in enumerate(satisfyingAssignments):
+            for i, val in enumerate(assignment):
+                self._supports[i].setdefault(val, []).append(t)
+                self._masks[i][val] = self._masks[i].get(val, 0) | (1 << t)
+
+    def canonicalKey(self):
+        return (type(self), tuple(self._scope))
+
+    def absorb(self, other):
+        '''keep only the tuples both tables allow'''
+        self._setTuples([a for a in self.satAssignments if tuple(a) in other._satSet])
 
     def check(self):
         '''check if current variable assignments are in the satisfying set'''
         assignments = []
-        for v in self.scope():
+        for v in self._scope:
             if v.isAssigned():
                 assignments.append(v.getValue())
             else:
                 return True
-        return assignments in self.satAssignments
+        return tuple(assignments) in self._satSet
+
+    def _validTuples(self):
+        '''bitset of the satisfying tuples whose every value is still in
+           the current domain of its variable'''
+        valid = (1 << len(self.satAssignments)) - 1
+        for i, var in enumerate(self._scope):
+            masks = self._masks[i]
+            live = 0
+            for val in var.curDomain():
+                live |= masks.get(val, 0)
+            valid &= live
+            if not valid:
+                break
+        return valid
 
     def hasSupport(self, var,val):
         '''check if var=val has an extension to an assignment of all variables in
            constraint's scope that satisfies the constraint. Important only to
            examine values in the variable's current domain as possible extensions'''
-        if var not in self.scope():
+        vindex = self._position.get(var)
+        if vindex is None:
             return True   #var=val has support on any constraint it does not participate in
-        vindex = self.scope().index(var)
-        found = False
-        for assignment in self.satAssignments:
-            if assignment[vindex] != val:
-                continue   #this assignment can't work it doesn't make var=val
-            found = True   #Otherwise it has potential. Assume found until shown otherwise
-            for i, v in enumerate(self.scope()):
+        if self._mode == 'compact':
+            return self._masks[vindex].get(val, 0) & self._validTuples() != 0
+        residue = self._residues.get((var, val))
+        if residue is not None and all(v.inCurDomain(residue[i]) for i, v in enumerate(self._scope)):
+            return True   #the last support found for var=val is still valid
+        for t in self._supports[vindex].get(val, ()):
+            assignment = self.satAssignments[t]   #makes var=val, has potential
+            found = True
+            for i, v in enumerate(self._scope):
                 if i != vindex and not v.inCurDomain(assignment[i]):
                     found = False  #Bummer...this assignment didn't work it assigns
                     break          #a value to v that is not in v's curDomain
                                    #note we skip checking if val in in var's curDomain
-            if found:     #if found still true the assigment worked. We can stop
-                break
-        return found     #either way found has the right truth value
-
+            if found:     #the assigment worked. We can stop
+                self._residues[(var, val)] = assignment
+                return True
+        return False
+
+    def unsupportedValues(self, skip=None):
+        '''in 'compact' mode the valid tuples are computed once per call.
+           Pruning a value without support cannot invalidate a tuple that
+           was still valid, so the bitset stays exact while the caller
+           prunes.'''
+        if self._mode != 'compact':
+            for pair in Constraint.unsupportedValues(self, skip):
+                yield pair
+            return
+        valid = self._validTuples()
+        for i, var in enumerate(self._scope):
+            if var is skip:
+                continue
+            masks = self._masks[i]
+            for val in var.curDomain():
+                if not masks.get(val, 0) & valid:
+                    yield var, val
+
+@timed('battle.findvals')
 def findvals(remainingVars, assignment, finalTestfn, partialTestfn=lambda x: True):
     '''Helper function for finding an assignment to the variables of a constraint
        that together with var=val satisfy the constraint. That is, this
@@ -137,6 +217,18 @@ class NValuesConstraint(Constraint):
         self._required = required_values
         self._lb = lower_bound
         self._ub = upper_bound
+        #per scope position, the bits of the required values in that
+        #variable's domain (see Variable.curDomainBits)
+        self._reqBits = [var.valueBits(required_values) for var in self._scope]
+
+    def canonicalKey(self):
+        #the count does not depend on the order of the scope
+        return (type(self), tuple(sorted(self._scope, key=id)), frozenset(self._required))
+
+    def absorb(self, other):
+        '''both ranges must hold, so keep their intersection'''
+        self._lb = max(self._lb, other._lb)
+        self._ub = min(self._ub, other._ub)
 
     def check(self):
         assignments = []
@@ -158,33 +250,188 @@ class NValuesConstraint(Constraint):
 
         return self._lb <= rv_count and self._ub >= rv_count
 
+    def _counts(self):
+        '''return (must, can): the number of variables in scope whose
+           current domain holds only required values, and the number
+           whose current domain holds at least one'''
+        must = can = 0
+        for var, req in zip(self._scope, self._reqBits):
+            bits = var.curDomainBits()
+            if bits & req:
+                can += 1
+                if not bits & ~req:
+                    must += 1
+        return must, can
+
     def hasSupport(self, var, val):
         '''check if var=val has an extension to an assignment of the
            other variable in the constraint that satisfies the constraint
 
-           HINT: check the implementation of AllDiffConstraint.hasSupport
-                 a similar approach is applicable here (but of course
-                 there are other ways as well)
+           The other variables can together take any number of required
+           values between the number that must take one and the number
+           that can, so var=val has support iff that range, shifted by
+           one if val is required, meets [lower_bound, upper_bound].
         '''
-        if var not in self.scope():
+        if var not in self._scope:
             return True   #var=val has support on any constraint it does not participate in
+        must, can = self._counts()
+        req = self._reqBits[self._scope.index(var)]
+        bits = var.curDomainBits()
+        if bits & req:
+            can -= 1
+            if not bits & ~req:
+                must -= 1
+        if val in self._required:
+            must += 1
+            can += 1
+        return must <= self._ub and can >= self._lb
+
+    def unsupportedValues(self, skip=None):
+        '''counting propagator: one pass over the scope computes how
+           many variables must and can take a required value, after which
+           each variable is decided in O(1) (required values lose support
+           when one more must would exceed upper_bound, the others when
+           one less can would drop below lower_bound). The counts are
+           updated as the caller prunes the pairs generated.'''
+        must, can = self._counts()
+        lb, ub = self._lb, self._ub
+        for var, req in zip(self._scope, self._reqBits):
+            if var is skip:
+                continue
+            bits = var.curDomainBits()
+            c = 1 if bits & req else 0
+            m = 1 if c and not bits & ~req else 0
+            if c and not (must - m + 1 <= ub and can >= lb):
+                #no required value of var has support
+                for val in var.curDomain():
+                    if val in self._required:
+                        yield var, val
+                must -= m
+                can -= 1
+            elif bits & ~req and not (must - m <= ub and can - c >= lb):
+                #no other value of var has support
+                for val in var.curDomain():
+                    if val not in self._required:
+                        yield var, val
+                must += 1 - m
+
+class FunctionConstraint(Constraint):
+    '''Constraint given by a test function. testfn is passed the list of
+       values of the scope variables, in scope order, and returns True if
+       they satisfy the constraint. Supports are found with findvals, so
+       keep the arity small.
+
+       For example FunctionConstraint('less', [V1, V2], lambda vals: vals[0] < vals[1])
+    '''
+
+    def __init__(self, name, scope, testfn):
+        Constraint.__init__(self,name, scope)
+        self._name = "Function_" + name
+        self._testfn = testfn
+
+    def canonicalKey(self):
+        return (type(self), self._testfn, tuple(self._scope))
+
+    def check(self):
+        values = []
+        for v in self._scope:
+            if not v.isAssigned():
+                return True
+            values.append(v.getValue())
+        return self._testfn(values)
 
-        #define the test functions for findvals
+    def hasSupport(self, var, val):
+        if var not in self._scope:
+            return True   #var=val has support on any constraint it does not participate in
+        residue = self._residues.get((var, val))
+        if residue is not None and all(v.inCurDomain(a) for (v, a) in residue):
+            return True   #the last support found for var=val is still valid
         def valsOK(l):
-            '''tests a list of assignments which are pairs (var,val)
-               to see if they can satisfy this sum constraint'''
-            rv_count = 0
-            vals = [val for (var, val) in l]
-            for v in vals:
-                if v in self._required:
-                    rv_count += 1
-            least = rv_count + self.arity() - len(vals)
-            most =  rv_count
-            return self._lb <= least and self._ub >= most
-        varsToAssign = self.scope()
-        varsToAssign.remove(var)
-        x = findvals(varsToAssign, [(var, val)], valsOK, valsOK)
-        return x
+            values = dict(l)
+            return self._testfn([values[v] for v in self._scope])
+        varsToAssign = [v for v in self._scope if v is not var]
+        assignment = [(var, val)]
+        if findvals(varsToAssign, assignment, valsOK):
+            self._residues[(var, val)] = assignment
+            return True
+        return False
+
+
+class SumConstraint(Constraint):
+    '''Weighted count constraint: each value of each scope variable
+       contributes a weight (weights[i] maps values of scope[i] to
+       numbers, missing values weigh 0) and the total over the scope
+       must lie in [lower_bound, upper_bound].
+
+       Propagation is on bounds: var=val is kept while the weight of val
+       plus the smallest and largest totals the other variables can
+       reach straddles the range. That is exact once the other variables
+       are down to one value each.
+    '''
+
+    def __init__(self, name, scope, weights, lower_bound, upper_bound):
+        Constraint.__init__(self,name, scope)
+        self._name = "Sum_" + name
+        self._weights = [dict(w) for w in weights]
+        self._lb = lower_bound
+        self._ub = upper_bound
+
+    def canonicalKey(self):
+        return (type(self), tuple(zip(self._scope, (frozenset(w.items()) for w in self._weights))))
+
+    def absorb(self, other):
+        '''both ranges must hold, so keep their intersection'''
+        self._lb = max(self._lb, other._lb)
+        self._ub = min(self._ub, other._ub)
+
+    def check(self):
+        total = 0
+        for v, w in zip(self._scope, self._weights):
+            if not v.isAssigned():
+                return True
+            total += w.get(v.getValue(), 0)
+        return self._lb <= total <= self._ub
+
+    def _bounds(self):
+        '''per scope position (least, greatest) weight in the current domain'''
+        bounds = []
+        for v, w in zip(self._scope, self._weights):
+            weights = [w.get(val, 0) for val in v.curDomain()]
+            bounds.append((min(weights), max(weights)))
+        return bounds
+
+    def hasSupport(self, var, val):
+        if var not in self._scope:
+            return True   #var=val has support on any constraint it does not participate in
+        bounds = self._bounds()
+        i = self._scope.index(var)
+        low = sum(b[0] for b in bounds) - bounds[i][0]
+        high = sum(b[1] for b in bounds) - bounds[i][1]
+        weight = self._weights[i].get(val, 0)
+        return low + weight <= self._ub and high + weight >= self._lb
+
+    def unsupportedValues(self, skip=None):
+        '''the bounds of the whole scope are summed once per call and
+           adjusted as the caller prunes'''
+        bounds = self._bounds()
+        low = sum(b[0] for b in bounds)
+        high = sum(b[1] for b in bounds)
+        for i, (var, w) in enumerate(zip(self._scope, self._weights)):
+            if var is skip:
+                continue
+            least, greatest = bounds[i]
+            otherLow, otherHigh = low - least, high - greatest
+            pruned = False
+            for val in var.curDomain():
+                weight = w.get(val, 0)
+                if otherLow + weight > self._ub or otherHigh + weight < self._lb:
+                    pruned = True
+                    yield var, val
+            if pruned:
+                weights = [w.get(val, 0) for val in var.curDomain()]
+                low += min(weights) - least
+                high += max(weights) - greatest
+
 
 class IfAllThenOneConstraint(Constraint):
     '''if each variable in left_side equals each value in left_values 
@@ -12,19 +12,35 @@ class Variable:
       domain for the variable. Values pruned from the variable domain
       are removed from the current domain but not from the original
       domain. Values can be also restored.
+
+      The current domain is a bitset over the positions of the values
+      in the original domain, so pruning and restoring a value are
+      single bit operations. Every pruning is recorded on one
+      chronological trail shared by all variables. A search saves
+      a mark (trailMark) before propagating and pops the trail back
+      to it (undoTo) when it backtracks.
     '''
 
-    undoDict = dict()             #stores pruned values indexed by a
-                                        #(variable,value) reason pair
+    trail = []                    #(variable, bit) for every pruned value,
+                                  #in the order the values were pruned
+    domainListener = None         #if set, called with each variable that
+                                  #loses a value (see UnassignedVars)
     def __init__(self, name, domain):
         '''Create a variable object, specifying its name (a
         string) and domain of values.
         '''
         self._name = name                #text name for variable
-        self._dom = list(domain)         #Make a copy of passed domain
-        self._curdom = list(domain)      #using list
+        self._id = None                  #position in the CSP's variables, set by CSP
         self._value = None
         self.type = None # "M", "<", ">", "S"
+        self._setDomain(domain)
+
+    def _setDomain(self, domain):
+        self._dom = list(domain)         #Make a copy of passed domain
+        self._bit = dict((val, 1 << i) for i, val in enumerate(self._dom))
+        self._full = (1 << len(self._dom)) - 1
+        self._curdom = self._full        #bit i set <=> self._dom[i] in current domain
+        self._cursize = len(self._dom)
 
     def __str__(self):
         return "Variable {}".format(self._name)
@@ -35,17 +51,17 @@ class Variable:
 
     def domainSize(self):
         '''Return the size of the domain'''
-        return(len(self.domain()))
+        return(len(self._dom))
 
     def resetDomain(self, newdomain):
         '''reset the domain of this variable'''
-        self._dom = newdomain
+        self._setDomain(newdomain)
 
     def getValue(self):
         return self._value
 
     def setValue(self, value):
-        if value != None and not value in self._dom:
+        if value != None and not value in self._bit:
             print("Error: tried to assign value {} to variable {} that is not in {}'s domain".format(value,self._name,self._name))
         else:
             self._value = value    
@@ -54,65 +70,98 @@ class Variable:
         self.setValue(None)
 
     def isAssigned(self):
-        return self.getValue() != None
+        return self._value != None
 
     def name(self):
         return self._name
 
+    def id(self):
+        '''return the dense index of this variable in the CSP it belongs to'''
+        return self._id
+
     def curDomain(self):
         '''return copy of variable current domain. But if variable is assigned
            return just its assigned value (this makes implementing hasSupport easier'''
-        if self.isAssigned():
-            return([self.getValue()])
-        return(list(self._curdom))
+        if self._value != None:
+            return([self._value])
+        if self._curdom == self._full:
+            return(list(self._dom))
+        return([val for val in self._dom if self._curdom & self._bit[val]])
 
     def curDomainSize(self):
         '''Return the size of the current domain'''
-        if self.isAssigned():
+        if self._value != None:
             return(1)
-        return(len(self._curdom))
+        return(self._cursize)
+
+    def valueBits(self, values):
+        '''return the bitset (see curDomainBits) of those values that are
+           in the domain of this variable'''
+        bits = 0
+        for val in values:
+            bits |= self._bit.get(val, 0)
+        return bits
+
+    def curDomainBits(self):
+        '''return the current domain as a bitset, bit i standing for
+           domain()[i]. If the variable is assigned, only the bit of its
+           value is set'''
+        if self._value != None:
+            return self._bit[self._value]
+        return self._curdom
 
     def inCurDomain(self, value):
         '''check if value is in current domain'''
-        if self.isAssigned():
-            return(value==self.getValue())
-        return(value in self._curdom)
-
-    def pruneValue(self, value, reasonVar, reasonVal):
-        '''Remove value from current domain'''
-        try:
-            self._curdom.remove(value)
-        except:
+        if self._value != None:
+            return(value==self._value)
+        return(self._curdom & self._bit.get(value, 0) != 0)
+
+    def pruneValue(self, value):
+        '''Remove value from current domain and record it on the trail'''
+        bit = self._bit.get(value, 0)
+        if not self._curdom & bit:
             print("Error: tried to prune value {} from variable {}'s domain, but value not present!".format(value, self._name))
-        dkey = (reasonVar, reasonVal)
-        if not dkey in Variable.undoDict:
-            Variable.undoDict[dkey] = []
-        Variable.undoDict[dkey].append((self, value))
+            return
+        self._curdom ^= bit
+        self._cursize -= 1
+        Variable.trail.append((self, bit))
+        if Variable.domainListener is not None:
+            Variable.domainListener(self)
 
     def restoreVal(self, value):
-        self._curdom.append(value)
+        bit = self._bit[value]
+        if not self._curdom & bit:
+            self._curdom |= bit
+            self._cursize += 1
 
     def restoreCurDomain(self):
-        self._curdom = self.domain()
+        self._curdom = self._full
+        self._cursize = len(self._dom)
 
     def reset(self):
         self.restoreCurDomain()
         self.unAssign()
 
     def dumpVar(self):
-        print("Variable\"{}={}\": Dom = {}, CurDom = {}".format(self._name, self._value, self._dom, self._curdom))
+        print("Variable\"{}={}\": Dom = {}, CurDom = {}".format(self._name, self._value, self._dom, [val for val in self._dom if self._curdom & self._bit[val]]))
+
+    @staticmethod
+    def clearTrail():
+        del Variable.trail[:]
 
     @staticmethod
-    def clearUndoDict():
-        undoDict = dict()
+    def trailMark():
+        '''return a mark that undoTo can later pop the trail back to'''
+        return len(Variable.trail)
 
     @staticmethod
-    def restoreValues(reasonVar, reasonVal):
-        dkey = (reasonVar, reasonVal)
-        if dkey in Variable.undoDict:
-            for (var,val) in Variable.undoDict[dkey]:
-                var.restoreVal(val)
-            del Variable.undoDict[dkey]
+    def undoTo(mark):
+        '''restore, latest first, every value pruned since mark was taken'''
+        trail = Variable.trail
+        while len(trail) > mark:
+            var, bit = trail.pop()
+            var._curdom |= bit
+            var._cursize += 1
 
 
 
@@ -139,6 +188,9 @@ class Constraint:
         objects).'''
         self._scope = list(scope)
         self._name = "baseClass_" + name  #override in subconstraint types!
+        self._id = None                   #position in the CSP's constraints, set by CSP
+        self._residues = dict()           #(var, val) -> last support found for it
+        self._weight = 1                  #1 + domain wipe-outs it caused (dom/wdeg)
 
     def scope(self):
         return list(self._scope)
@@ -146,6 +198,10 @@ class Constraint:
     def arity(self):
         return len(self._scope)
 
+    def id(self):
+        '''return the dense index of this constraint in the CSP it belongs to'''
+        return self._id
+
     def numUnassigned(self):
         i = 0
         for var in self._scope:
@@ -156,6 +212,41 @@ class Constraint:
     def unAssignedVars(self):
         return [var for var in self.scope() if not var.isAssigned()]
 
+    def unsupportedValues(self, skip=None):
+        '''generate the (var, val) pairs of the scope, var not being
+           skip, for which hasSupport(var, val) is False. The caller
+           prunes each pair (or gives up if var is assigned) before
+           asking for the next one, so later checks see the smaller
+           domains. Constraint types with a faster propagator than
+           one hasSupport call per value override this.'''
+        for var in self._scope:
+            if var is skip:
+                continue
+            for val in var.curDomain():
+                if not self.hasSupport(var, val):
+                    yield var, val
+
+    def bumpWeight(self):
+        '''count a domain wipe-out caused by this constraint. The
+           weights persist across searches of the same CSP, so restarts
+           keep what earlier runs learnt.'''
+        self._weight += 1
+        if Variable.domainListener is not None:
+            for var in self._scope:
+                Variable.domainListener(var)
+
+    def canonicalKey(self):
+        '''return a hashable key such that constraints with equal keys
+           restrict the same variables in ways absorb() can combine into
+           one constraint, or None if this constraint is never merged
+           (the default). Used by CSP to drop duplicate constraints.'''
+        return None
+
+    def absorb(self, other):
+        '''tighten this constraint so it also enforces other, a
+           constraint with the same canonicalKey()'''
+        pass
+
     # def check(self):
     #     util.raiseNotDefined()
 
@@ -177,46 +268,87 @@ class CSP:
        to put some other functions that depend on which variables
        and constraints are active'''
 
-    def __init__(self, name, variables, constraints):
+    def __init__(self, name, variables, constraints, canonicalize=True):
         '''create a CSP problem object passing it a name, a list of
-           variable objects, and a list of constraint objects'''
+           variable objects, and a list of constraint objects.
+
+           If canonicalize is True, constraints that are identical to
+           or subsumed by an earlier one (see Constraint.canonicalKey)
+           are merged into it, and the number removed is reported on
+           stderr.
+
+           Variables and constraints are numbered densely in the order
+           given (see Variable.id and Constraint.id), and the
+           constraints of each variable are stored in an array indexed
+           by that number.'''
         self._name = name
-        self._variables = variables
-        self._constraints = constraints
+        if canonicalize:
+            constraints, removed = CSP.canonicalize(constraints)
+            if removed:
+                print("CSP {}: merged away {} duplicate or subsumed constraints".format(name, removed), file=sys.stderr)
+        self._variables = tuple(variables)
+        self._constraints = tuple(constraints)
+        for i, v in enumerate(self._variables):
+            v._id = i
+        for i, c in enumerate(self._constraints):
+            c._id = i
 
         #some sanity checks
         varsInCnst = set()
         for c in constraints:
-            varsInCnst = varsInCnst.union(c.scope())
+            varsInCnst.update(c._scope)
+        varSet = set(self._variables)
         for v in variables:
             if v not in varsInCnst:
                 print("Warning: variable {} is not in any constraint of the CSP {}".format(v.name(), self.name()))
         for v in varsInCnst:
-            if v not in variables:
+            if v not in varSet:
                 print("Error: variable {} appears in constraint but specified as one of the variables of the CSP {}".format(v.name(), self.name()))
 
-        self.constraints_of = [[] for i in range(len(variables))]
+        constraints_of = [[] for i in range(len(self._variables))]
+        for c in self._constraints:
+            for v in c._scope:
+                if v in varSet:
+                    constraints_of[v._id].append(c)
+        self.constraints_of = [tuple(cs) for cs in constraints_of]
+
+    @staticmethod
+    def canonicalize(constraints):
+        '''return (kept, removed): the constraints with every one whose
+           canonicalKey() equals that of an earlier one absorbed into the
+           earlier one, in their original order, and how many were
+           absorbed'''
+        kept = []
+        first = dict()
         for c in constraints:
-            for v in c.scope():
-                i = variables.index(v)
-                self.constraints_of[i].append(c)
+            key = c.canonicalKey()
+            if key is None:
+                kept.append(c)
+            elif key in first:
+                first[key].absorb(c)
+            else:
+                first[key] = c
+                kept.append(c)
+        return kept, len(constraints) - len(kept)
 
     def name(self):
         return self._name
 
     def variables(self):
-        return list(self._variables)
+        '''return the variables of the CSP (a read-only tuple, not a copy)'''
+        return self._variables
 
     def constraints(self):
-        return list(self._constraints)
+        '''return the constraints of the CSP (a read-only tuple, not a copy)'''
+        return self._constraints
 
     def constraintsOf(self, var):
-        '''return constraints with var in their scope'''
-        try:
-            i = self.variables().index(var)
-            return list(self.constraints_of[i])
-        except:
+        '''return constraints with var in their scope (a read-only tuple)'''
+        i = var._id
+        if i is None or i >= len(self._variables) or self._variables[i] is not var:
             print("Error: tried to find constraint of variable {} that isn't in this CSP {}".format(var, self.name()))
+            return ()
+        return self.constraints_of[i]
 
     def unAssignAllVars(self):
         '''unassign all variables'''
@@ -0,0 +1,98 @@
+'''Race several search configurations on one Battle Solitaire puzzle.
+
+   Backtracking times vary a lot with the variable and value order, and
+   a hard puzzle for one order is often easy for another. race() starts
+   one process per configuration of the portfolio and returns the
+   result of the first to finish; the others are killed.
+
+   A configuration is (variable heuristic, value heuristic, seed). With
+   seed None the search is run once to the end. With a seed the random
+   module is seeded and the search restarts whenever it uses up its
+   node limit, the limit growing by RESTART_GROWTH each time, so every
+   configuration is still a complete search and a "no solution" from
+   any of them settles the race too.
+'''
+
+import multiprocessing
+import random
+import time
+from queue import Empty
+
+DEFAULT_PORTFOLIO = [
+    ('mrv', 'fixed', None),
+    ('mrv', 'random', 1),
+    ('mrv', 'random', 2),
+    ('random', 'random', 3),
+    ('domwdeg', 'random', 4),
+]
+
+RESTART_BASE = 100     #node limit of the first run of a restarting configuration
+RESTART_GROWTH = 1.5
+
+
+def config_name(config):
+    variables, values, seed = config
+    return '{}/{}'.format(variables, values) + ('' if seed is None else '/seed {}'.format(seed))
+
+
+def run_config(board_text, model, config, backjump=False):
+    '''solve board_text with one configuration in this process, with
+       backjumping if backjump. Returns (solution text or None, nodes
+       explored over all runs, restarts)'''
+    from battle import build_model, render_solution, bt_search
+    variables, values, seed = config
+    puzzle, search_args = build_model(board_text, model, variables)
+    if seed is None:
+        limit = None
+    else:
+        random.seed(seed)
+        limit = RESTART_BASE
+    nodes = restarts = 0
+    while True:
+        solutions, explored = bt_search(*search_args, valueHeuristic=values,
+                                        nodeLimit=None if limit is None else int(limit), backjump=backjump)
+        nodes += explored
+        if not bt_search.limitReached:
+            break
+        restarts += 1
+        limit *= RESTART_GROWTH
+    solution = render_solution(puzzle, model, solutions[0]) if solutions else None
+    return solution, nodes, restarts
+
+
+def _race_entry(queue, board_text, model, config, backjump):
+    start = time.perf_counter()
+    solution, nodes, restarts = run_config(board_text, model, config, backjump)
+    queue.put({'config': config_name(config), 'solution': solution, 'nodes': nodes,
+               'restarts': restarts, 'time': round(time.perf_counter() - start, 4)})
+
+
+def race(board_text, model='cells', portfolio=DEFAULT_PORTFOLIO, timeout=None, backjump=False):
+    '''run every configuration of portfolio on board_text in its own
+       process (all with backjumping if backjump) and return the result
+       of the first one to finish: a dict
+       with the winning 'config', its 'solution' (None if the puzzle has
+       none), 'nodes', 'restarts' and 'time'. Returns None if nothing
+       finished within timeout seconds.'''
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_race_entry, args=(queue, board_text, model, config, backjump),
+                                         daemon=True)
+                 for config in portfolio]
+    for p in processes:
+        p.start()
+    try:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return queue.get(timeout=1 if deadline is None else max(0, min(1, deadline - time.monotonic())))
+            except Empty:
+                #give up once past the deadline or if every racer died
+                if deadline is not None and time.monotonic() >= deadline:
+                    return None
+                if not any(p.is_alive() for p in processes) and queue.empty():
+                    return None
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.kill()
+            p.join()
@@ -0,0 +1,336 @@
+'''A small CDCL SAT solver.
+
+   Variables are numbered from 1 and literals are written as in DIMACS:
+   v for "v is true", -v for "v is false". Internally literal v is 2v
+   and -v is 2v+1, so the negation of a literal is lit ^ 1 and both
+   index flat lists.
+
+   The solver is the usual conflict-driven clause learning loop:
+
+     - unit propagation with two watched literals per clause; a clause
+       is only looked at when one of its two watched literals becomes
+       false, and the watches need no undoing on backtracking
+     - on a conflict, the first-UIP clause is learned (with its
+       literals that are implied by the others removed), and the search
+       jumps back to the second highest level in it
+     - decisions take the unassigned variable of highest VSIDS activity
+       (bumped for the variables in each conflict, decayed over time),
+       with the polarity it last had (phase saving)
+     - restarts after a Luby sequence of conflicts, RESTART_UNIT each
+     - learned clauses are halved, worst LBD (number of decision levels
+       among their literals) first, when there are too many
+'''
+
+import heapq
+
+RESTART_UNIT = 100     #conflicts per Luby unit between restarts
+VAR_DECAY = 0.95
+
+
+def luby(i):
+    '''the i-th element (from 0) of the Luby sequence 1 1 2 1 1 2 4 ...'''
+    size, seq = 1, 0
+    while size < i + 1:
+        seq += 1
+        size = 2 * size + 1
+    while size - 1 != i:
+        size = (size - 1) >> 1
+        seq -= 1
+        i = i % size
+    return 1 << seq
+
+
+class SatSolver:
+    '''A CDCL solver. Add variables with newVar and clauses with
+       addClause, then call solve; model[v] is the value of variable v
+       in the satisfying assignment found. Clauses can be added between
+       calls of solve (to block a solution and look for the next, say).
+       conflicts, decisions and propagations count the work done.'''
+
+    def __init__(self):
+        self.numVars = 0
+        self.model = None
+        self.conflicts = self.decisions = self.propagations = 0
+        self._ok = True                 #False once the clauses are known unsatisfiable
+        self._value = [None, None]      #literal -> True/False/None
+        self._watches = [[], []]        #literal -> clauses watching it
+        self._level = [0]               #variable -> decision level of its assignment
+        self._reason = [None]           #variable -> clause that implied it
+        self._activity = [0.0]
+        self._phase = [False]
+        self._seen = [False]
+        self._heap = []                 #(-activity, variable), lazy
+        self._varInc = 1.0
+        self._trail = []
+        self._trailLim = []
+        self._qhead = 0
+        self._learnts = []
+        self._lbd = dict()              #id(learned clause) -> its LBD
+        self._maxLearnts = 2000
+
+    def newVar(self):
+        '''add a variable and return its number'''
+        self.numVars += 1
+        self._value += [None, None]
+        self._watches += [[], []]
+        self._level.append(0)
+        self._reason.append(None)
+        self._activity.append(0.0)
+        self._phase.append(False)
+        self._seen.append(False)
+        heapq.heappush(self._heap, (0.0, self.numVars))
+        return self.numVars
+
+    def addClause(self, lits):
+        '''add the clause, a list of DIMACS literals. Returns False if the
+           clauses are now known to be unsatisfiable.'''
+        if not self._ok:
+            return False
+        self._cancelUntil(0)
+        clause = []
+        for lit in lits:
+            lit = 2 * lit if lit > 0 else -2 * lit + 1
+            value = self._value[lit]
+            if value is True or lit ^ 1 in clause:
+                return True          #satisfied at the root, or a tautology
+            if value is None and lit not in clause:
+                clause.append(lit)
+        if not clause:
+            self._ok = False
+        elif len(clause) == 1:
+            self._enqueue(clause[0], None)
+            self._ok = self._propagate() is None
+        else:
+            self._watches[clause[0]].append(clause)
+            self._watches[clause[1]].append(clause)
+        return self._ok
+
+    def solve(self):
+        '''return True if the clauses are satisfiable, filling in
+           self.model, and False if not'''
+        if not self._ok:
+            return False
+        if self._propagate() is not None:
+            self._ok = False
+            return False
+        restarts = 0
+        while True:
+            status = self._search(luby(restarts) * RESTART_UNIT)
+            if status is not None:
+                self._cancelUntil(0)
+                return status
+            restarts += 1
+
+    def _enqueue(self, lit, reason):
+        self._value[lit] = True
+        self._value[lit ^ 1] = False
+        var = lit >> 1
+        self._level[var] = len(self._trailLim)
+        self._reason[var] = reason
+        self._trail.append(lit)
+
+    def _propagate(self):
+        '''propagate the assignments on the trail not yet propagated;
+           return a conflicting clause, or None'''
+        value = self._value
+        watches = self._watches
+        trail = self._trail
+        while self._qhead < len(trail):
+            falseLit = trail[self._qhead] ^ 1
+            self._qhead += 1
+            self.propagations += 1
+            ws = watches[falseLit]
+            i = j = 0
+            n = len(ws)
+            while i < n:
+                clause = ws[i]
+                i += 1
+                if not clause:
+                    continue         #a deleted learned clause
+                if clause[0] == falseLit:
+                    clause[0] = clause[1]
+                    clause[1] = falseLit
+                first = clause[0]
+                if value[first] is True:
+                    ws[j] = clause
+                    j += 1
+                    continue
+                for k in range(2, len(clause)):
+                    lit = clause[k]
+                    if value[lit] is not False:
+                        clause[1] = lit
+                        clause[k] = falseLit
+                        watches[lit].append(clause)
+                        break
+                else:
+                    ws[j] = clause
+                    j += 1
+                    if value[first] is False:
+                        while i < n:
+                            ws[j] = ws[i]
+                            j += 1
+                            i += 1
+                        del ws[j:]
+                        return clause
+                    self._enqueue(first, clause)
+            del ws[j:]
+        return None
+
+    def _analyze(self, conflict):
+        '''return the first-UIP clause learned from conflict (its
+           asserting literal first) and the level to jump back to'''
+        seen = self._seen
+        level = self._level
+        reason = self._reason
+        trail = self._trail
+        current = len(self._trailLim)
+        learnt = [None]
+        pending = 0
+        lit = None
+        index = len(trail) - 1
+        clause = conflict
+        while True:
+            if id(clause) in self._lbd:
+                self._lbd[id(clause)] = min(self._lbd[id(clause)], self._clauseLbd(clause))
+            for q in (clause if lit is None else clause[1:]):
+                var = q >> 1
+                if not seen[var] and level[var] > 0:
+                    seen[var] = True
+                    self._bump(var)
+                    if level[var] >= current:
+                        pending += 1
+                    else:
+                        learnt.append(q)
+            while not seen[trail[index] >> 1]:
+                index -= 1
+            lit = trail[index]
+            index -= 1
+            clause = reason[lit >> 1]
+            seen[lit >> 1] = False
+            pending -= 1
+            if pending == 0:
+                break
+        learnt[0] = lit ^ 1
+
+        #drop literals implied by the others
+        kept = [learnt[0]]
+        for q in learnt[1:]:
+            why = reason[q >> 1]
+            if why is None or not all(seen[r >> 1] or level[r >> 1] == 0 for r in why[1:]):
+                kept.append(q)
+        for q in learnt[1:]:
+            seen[q >> 1] = False
+
+        backLevel = 0
+        if len(kept) > 1:
+            top = max(range(1, len(kept)), key=lambda k: level[kept[k] >> 1])
+            kept[1], kept[top] = kept[top], kept[1]
+            backLevel = level[kept[1] >> 1]
+        self._varInc /= VAR_DECAY
+        return kept, backLevel
+
+    def _clauseLbd(self, clause):
+        level = self._level
+        return len(set(level[lit >> 1] for lit in clause))
+
+    def _bump(self, var):
+        activity = self._activity
+        activity[var] += self._varInc
+        if activity[var] > 1e100:
+            for v in range(1, self.numVars + 1):
+                activity[v] *= 1e-100
+            self._varInc *= 1e-100
+            self._heap = [(-activity[v], v) for v in range(1, self.numVars + 1)
+                          if self._value[2 * v] is None]
+            heapq.heapify(self._heap)
+        elif self._value[2 * var] is None:
+            heapq.heappush(self._heap, (-activity[var], var))
+
+    def _cancelUntil(self, level):
+        if len(self._trailLim) <= level:
+            return
+        value = self._value
+        phase = self._phase
+        activity = self._activity
+        heap = self._heap
+        trail = self._trail
+        stop = self._trailLim[level]
+        for k in range(len(trail) - 1, stop - 1, -1):
+            lit = trail[k]
+            var = lit >> 1
+            value[lit] = value[lit ^ 1] = None
+            self._reason[var] = None
+            phase[var] = not lit & 1
+            heapq.heappush(heap, (-activity[var], var))
+        del trail[stop:]
+        del self._trailLim[level:]
+        self._qhead = stop
+        if len(heap) > 4 * self.numVars + 64:
+            self._heap = [(-activity[v], v) for v in range(1, self.numVars + 1) if value[2 * v] is None]
+            heapq.heapify(self._heap)
+
+    def _pickBranch(self):
+        value = self._value
+        heap = self._heap
+        while heap:
+            var = heapq.heappop(heap)[1]
+            if value[2 * var] is None:
+                return 2 * var if self._phase[var] else 2 * var + 1
+        return None
+
+    def _reduceLearnts(self):
+        '''delete the worse half of the learned clauses that are not the
+           reason of a current assignment'''
+        reason = self._reason
+        value = self._value
+
+        def locked(clause):
+            return value[clause[0]] is True and reason[clause[0] >> 1] is clause
+
+        self._learnts.sort(key=lambda clause: self._lbd[id(clause)])
+        keep = self._learnts[:len(self._learnts) // 2]
+        for clause in self._learnts[len(self._learnts) // 2:]:
+            if self._lbd[id(clause)] <= 2 or locked(clause):
+                keep.append(clause)
+            else:
+                del self._lbd[id(clause)]
+                clause.clear()       #dropped from the watch lists as they are visited
+        self._learnts = keep
+        self._maxLearnts = int(self._maxLearnts * 1.1)
+
+    def _search(self, conflictBudget):
+        '''search until a model, unsatisfiability or conflictBudget
+           conflicts; return True, False or None (restart)'''
+        conflicts = 0
+        while True:
+            conflict = self._propagate()
+            if conflict is not None:
+                self.conflicts += 1
+                conflicts += 1
+                if not self._trailLim:
+                    self._ok = False
+                    return False
+                learnt, backLevel = self._analyze(conflict)
+                self._cancelUntil(backLevel)
+                if len(learnt) == 1:
+                    self._enqueue(learnt[0], None)
+                else:
+                    self._watches[learnt[0]].append(learnt)
+                    self._watches[learnt[1]].append(learnt)
+                    self._learnts.append(learnt)
+                    self._lbd[id(learnt)] = self._clauseLbd(learnt)
+                    self._enqueue(learnt[0], learnt)
+            else:
+                if conflicts >= conflictBudget:
+                    self._cancelUntil(0)
+                    return None
+                if len(self._learnts) >= self._maxLearnts:
+                    self._reduceLearnts()
+                lit = self._pickBranch()
+                if lit is None:
+                    value = self._value
+                    self.model = [None] + [value[2 * v] for v in range(1, self.numVars + 1)]
+                    return True
+                self.decisions += 1
+                self._trailLim.append(len(self._trail))
+                self._enqueue(lit, None)
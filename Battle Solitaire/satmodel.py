@@ -0,0 +1,144 @@
+'''SAT encoding of a Battle Solitaire puzzle, solved with sat.SatSolver.
+
+   There is a boolean variable per cell of the playing area (ship or
+   water) and one per legal placement of a ship of the fleet (see
+   shipmodel.legal_placements, which already keeps placements off water
+   and in agreement with the hints). The clauses say:
+
+     - a placement covers its cells and leaves its halo water, so ships
+       never touch and never overlap
+     - a ship cell is covered by some placement
+     - hinted ship cells are ship cells
+     - each row and column has its count of ship cells, and there are
+       as many placements of each length as the fleet has ships of it
+
+   The counts are "exactly k of these literals" constraints, encoded
+   with a sequential counter: r(i, j) is true iff at least j of the
+   first i literals are true, defined in both directions by
+   r(i, j) <-> r(i-1, j) or (r(i-1, j-1) and x(i)), then r(n, k) is
+   asserted and r(n, k+1) denied. That takes O(nk) variables and
+   clauses, and unit propagation on it enforces both bounds as soon as
+   they are reached.
+
+   A solution is the set of its true placements, so blocking that set
+   with one clause gives the next solution; solutions() counts each
+   fleet layout once.
+'''
+
+from sat import SatSolver
+from shipmodel import SHIP_LENGTHS, legal_placements, placement_cells, placement_halo
+
+
+def exactly(solver, lits, k):
+    '''add clauses to solver saying exactly k of lits (DIMACS literals)
+       are true'''
+    n = len(lits)
+    if k > n:
+        solver.addClause([])
+        return
+    if k == 0:
+        for lit in lits:
+            solver.addClause([-lit])
+        return
+    if k == n:
+        for lit in lits:
+            solver.addClause([lit])
+        return
+    #prev[j] for j = 0..k+1 is r(i-1, j): True, False or a variable
+    prev = [True] + [False] * (k + 1)
+    for i, x in enumerate(lits):
+        cur = [True]
+        for j in range(1, k + 2):
+            below, carry = prev[j], prev[j - 1]
+            if below is True or (below is False and carry is False):
+                cur.append(below)
+                continue
+            r = solver.newVar()
+            #r <- below; r <- carry and x
+            _clause(solver, [r, _neg(below)])
+            _clause(solver, [r, _neg(carry), -x])
+            #r -> below or carry; r -> below or x
+            _clause(solver, [-r, below, carry])
+            _clause(solver, [-r, below, x])
+            cur.append(r)
+        prev = cur
+    _clause(solver, [prev[k]])
+    _clause(solver, [_neg(prev[k + 1])])
+
+
+def _neg(lit):
+    if lit is True or lit is False:
+        return not lit
+    return -lit
+
+
+def _clause(solver, lits):
+    '''add a clause whose literals may also be the constants True and
+       False'''
+    clause = []
+    for lit in lits:
+        if lit is True:
+            return
+        if lit is not False:
+            clause.append(lit)
+    solver.addClause(clause)
+
+
+class SatPuzzle:
+    '''the CNF of one puzzle, as parsed by battle.parse_puzzle, in a
+       SatSolver (self.solver). nodesExplored counts the solver's
+       decisions so far.'''
+
+    def __init__(self, board, size, row_cons, col_cons, ship_cons):
+        solver = self.solver = SatSolver()
+        self.size = size
+        cell = dict()
+        for i in range(1, size - 1):
+            for j in range(1, size - 1):
+                cell[(i, j)] = solver.newVar()
+                if board[i][j] == '.':
+                    solver.addClause([-cell[(i, j)]])
+                elif board[i][j] != '0':
+                    solver.addClause([cell[(i, j)]])
+
+        #placement variable -> placement
+        self._placements = dict()
+        covering = dict((c, []) for c in cell)
+        for index, length in enumerate(SHIP_LENGTHS):
+            count = int(ship_cons[index]) if index < len(ship_cons) else 0
+            if not count:
+                continue
+            ofLength = []
+            for placement in legal_placements(length, board, size, row_cons, col_cons):
+                p = solver.newVar()
+                self._placements[p] = placement
+                ofLength.append(p)
+                for c in placement_cells(placement):
+                    solver.addClause([-p, cell[c]])
+                    covering[c].append(p)
+                for c in placement_halo(placement):
+                    if c in cell:
+                        solver.addClause([-p, -cell[c]])
+            exactly(solver, ofLength, count)
+
+        for c, ps in covering.items():
+            solver.addClause([-cell[c]] + ps)
+
+        n = size - 2
+        for k in range(n):
+            exactly(solver, [cell[(k + 1, j)] for j in range(1, size - 1)], int(row_cons[k]))
+            exactly(solver, [cell[(i, k + 1)] for i in range(1, size - 1)], int(col_cons[k]))
+
+    @property
+    def nodesExplored(self):
+        return self.solver.decisions
+
+    def solutions(self):
+        '''generate every solution as a list of placements. The blocking
+           clauses stay in the solver, so this is good for one pass.'''
+        solver = self.solver
+        while solver.solve():
+            chosen = [p for p in self._placements if solver.model[p]]
+            yield [self._placements[p] for p in chosen]
+            if not solver.addClause([-p for p in chosen]):
+                return
@@ -0,0 +1,157 @@
+'''Ship-placement model of a Battle Solitaire puzzle.
+
+   Instead of one variable per cell, there is one variable per ship of
+   the fleet. Its values are placements (length, i, j, orientation):
+   the ship's top/left cell is (i, j) on the padded board and
+   orientation is 'h', 'v', or 'S' for submarines. Placements that
+   run over water, contradict a hint, or would touch a hinted ship
+   cell are never put in the domains. The constraints are:
+
+     - ships of the fleet do not overlap or touch, even diagonally
+     - each row and column holds its count of ship cells
+     - each hinted ship cell is covered by exactly one ship
+     - ships of the same length are placed in increasing order, so
+       each fleet layout is searched once rather than once per
+       permutation of identical ships
+
+   Fleet composition is built into the variables, so it no longer has
+   to be checked on complete boards, and row/column counts prune ship
+   placements during search.
+'''
+
+from csp import Variable, CSP
+from constraints import NValuesConstraint, SumConstraint, FunctionConstraint
+
+#fleet string index -> ship length: submarines, destroyers, cruisers,
+#battleships, carriers
+SHIP_LENGTHS = [1, 2, 3, 4, 5]
+
+
+def placement_cells(placement):
+    '''return the board cells (i, j) covered by placement, top/left first'''
+    length, i, j, orientation = placement
+    if orientation == 'v':
+        return [(i + k, j) for k in range(length)]
+    return [(i, j + k) for k in range(length)]
+
+
+def placement_symbols(placement):
+    '''return the symbols a solution shows on the cells of placement'''
+    length, i, j, orientation = placement
+    if length == 1:
+        return ['S']
+    if orientation == 'v':
+        return ['^'] + ['M'] * (length - 2) + ['v']
+    return ['<'] + ['M'] * (length - 2) + ['>']
+
+
+def placement_halo(placement):
+    '''return the cells next to placement (diagonals included) that it
+       does not cover itself'''
+    cells = set(placement_cells(placement))
+    halo = set()
+    for (i, j) in cells:
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                halo.add((i + di, j + dj))
+    return halo - cells
+
+
+def legal_placements(length, board, size, row_cons, col_cons):
+    '''return every placement of a ship of the given length that fits on
+       the board: inside the (size-2)x(size-2) playing area, off water,
+       within row and column counts, agreeing with the hints it covers
+       and not touching any other hinted ship cell'''
+    placements = []
+    orientations = ['S'] if length == 1 else ['h', 'v']
+    for orientation in orientations:
+        for i in range(1, size - 1):
+            for j in range(1, size - 1):
+                placement = (length, i, j, orientation)
+                cells = placement_cells(placement)
+                if any(x > size - 2 or y > size - 2 for (x, y) in cells):
+                    continue
+                symbols = placement_symbols(placement)
+                ok = True
+                for (x, y), symbol in zip(cells, symbols):
+                    hint = board[x][y]
+                    if hint == '.' or (hint != '0' and hint != symbol):
+                        ok = False
+                        break
+                if not ok:
+                    continue
+                rows = [x for (x, y) in cells]
+                cols = [y for (x, y) in cells]
+                if any(rows.count(x) > int(row_cons[x - 1]) for x in set(rows)) or \
+                   any(cols.count(y) > int(col_cons[y - 1]) for y in set(cols)):
+                    continue
+                if any(board[x][y] not in '0.' for (x, y) in placement_halo(placement)):
+                    continue
+                placements.append(placement)
+    return placements
+
+
+def build_ship_csp(board, size, row_cons, col_cons, ship_cons):
+    '''build the ship-placement CSP. board is the padded board (list of
+       strings, '0' unknown, '.' water, otherwise a ship hint), size its
+       padded width, row_cons/col_cons/ship_cons the strings from the
+       puzzle file. Returns the CSP; its variables are the ships.'''
+    ships = []
+    for index, count in enumerate(ship_cons):
+        length = SHIP_LENGTHS[index]
+        domain = legal_placements(length, board, size, row_cons, col_cons)
+        for k in range(int(count)):
+            ships.append(Variable("ship{}_{}".format(length, k), domain))
+
+    conslist = []
+
+    #no overlapping or touching ships
+    halo = {}
+    covers = {}
+    for ship in ships:
+        for placement in ship.domain():
+            if placement not in covers:
+                covers[placement] = frozenset(placement_cells(placement))
+                halo[placement] = covers[placement] | placement_halo(placement)
+    def apart(vals):
+        return not (covers[vals[0]] & halo[vals[1]])
+    for a in range(len(ships)):
+        for b in range(a + 1, len(ships)):
+            conslist.append(FunctionConstraint('apart', [ships[a], ships[b]], apart))
+
+    #identical ships in increasing order
+    def ordered(vals):
+        return vals[0] < vals[1]
+    for a in range(len(ships) - 1):
+        if ships[a].domain() == ships[a + 1].domain():
+            conslist.append(FunctionConstraint('order', [ships[a], ships[a + 1]], ordered))
+
+    #row and column counts
+    for line in range(1, size - 1):
+        for cons, axis in ((row_cons, 0), (col_cons, 1)):
+            weights = []
+            for ship in ships:
+                weights.append(dict((p, sum(1 for cell in covers[p] if cell[axis] == line))
+                                    for p in ship.domain()))
+            count = int(cons[line - 1])
+            conslist.append(SumConstraint('row' if axis == 0 else 'col', ships, weights, count, count))
+
+    #hinted ship cells are covered by exactly one ship
+    for i in range(1, size - 1):
+        for j in range(1, size - 1):
+            if board[i][j] not in '0.':
+                covering = set(p for p in covers if (i, j) in covers[p])
+                conslist.append(NValuesConstraint('hint', ships, covering, 1, 1))
+
+    return CSP('battleship_ships', ships, conslist)
+
+
+def ships_to_cells(solution, size):
+    '''turn a solution of the ship CSP (list of (ship variable,
+       placement) pairs) into a dict from padded cell index i*size+j to
+       'S' (ship) or '.' (water), the form output_to_file works on'''
+    var_dict = dict((i * size + j, '.') for i in range(size) for j in range(size))
+    for (ship, placement) in solution:
+        for (i, j) in placement_cells(placement):
+            var_dict[i * size + j] = 'S'
+    return var_dict
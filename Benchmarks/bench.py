@@ -0,0 +1,306 @@
+"""
+Benchmark harness for the Checkers, Hua Rong Dao and Battle Solitaire solvers.
+
+Every case (the sample inputs shipped with each solver plus larger generated
+instances) runs in a fresh interpreter so that peak RSS is measured per case.
+For each case the wall time, the number of search nodes and the peak RSS are
+recorded and compared against the stored baseline.
+
+    python Benchmarks/bench.py                  # run and compare with baseline.json
+    python Benchmarks/bench.py --update         # run and rewrite baseline.json
+    python Benchmarks/bench.py --only battle    # only cases whose name contains 'battle'
+
+The exit status is 1 when any case regresses past the threshold, or when its
+output no longer matches the one recorded in the baseline.
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import generators
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOLVER_DIRS = {
+    'checkers': os.path.join(ROOT, 'Checkers'),
+    'hrd': os.path.join(ROOT, 'Hua Rong Dao'),
+    'battle': os.path.join(ROOT, 'Battle Solitaire'),
+}
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# (name, solver, mode, source). The source is either the path of a sample
+# input relative to the solver's directory or a callable producing the text
+# of a generated one. 'game' plays the whole game the way the checkers CLI
+# does, 'search-N' runs a single depth-N alpha-beta search from the position;
+# 'pvs-game' and 'pvs-search-N' do the same with --search pvs.
+# Battle cases run the cell model ('gac'), the ship model ('ships'), the
+# bitset placement solver ('bitset') or the SAT solver ('sat').
+CASES = [
+    ('checkers-0', 'checkers', 'game', 'checkers0.txt'),
+    ('checkers-1', 'checkers', 'game', 'checkers1.txt'),
+    ('checkers-2', 'checkers', 'game', 'checkers2.txt'),
+    ('checkers-gen-6v6-s0', 'checkers', 'search-8', lambda: generators.checkers_instance(0, 6, 6)),
+    ('checkers-gen-6v6-s1', 'checkers', 'search-8', lambda: generators.checkers_instance(1, 6, 6)),
+    ('checkers-pvs-0', 'checkers', 'pvs-game', 'checkers0.txt'),
+    ('checkers-pvs-2', 'checkers', 'pvs-game', 'checkers2.txt'),
+    ('checkers-pvs-gen-6v6-s0', 'checkers', 'pvs-search-8', lambda: generators.checkers_instance(0, 6, 6)),
+    ('checkers-pvs-gen-6v6-s1', 'checkers', 'pvs-search-8', lambda: generators.checkers_instance(1, 6, 6)),
+    ('hrd-easy2', 'hrd', 'astar', 'easy2.txt'),
+    ('hrd-hard3', 'hrd', 'astar', 'hard3.txt'),
+    ('hrd-gen-d50', 'hrd', 'astar', lambda: generators.hrd_instance(2, 50)),
+    ('hrd-gen-d70', 'hrd', 'astar', lambda: generators.hrd_instance(2, 70)),
+    ('battle-easyalt', 'battle', 'gac', 'input_easyalt.txt'),
+    ('battle-easy1', 'battle', 'gac', 'input_easy1.txt'),
+    ('battle-gen-7x7-s0', 'battle', 'gac', lambda: generators.battle_instance(7, '32100', 0)),
+    ('battle-gen-7x7-s1', 'battle', 'gac', lambda: generators.battle_instance(7, '32100', 1)),
+    ('battle-gen-8x8-s1', 'battle', 'gac', lambda: generators.battle_instance(8, '32110', 1)),
+    ('battle-ships-easy1', 'battle', 'ships', 'input_easy1.txt'),
+    ('battle-ships-gen-8x8-s0', 'battle', 'ships', lambda: generators.battle_instance(8, '32110', 0)),
+    ('battle-ships-gen-8x8-s1', 'battle', 'ships', lambda: generators.battle_instance(8, '32110', 1)),
+    ('battle-bitset-easy1', 'battle', 'bitset', 'input_easy1.txt'),
+    ('battle-bitset-gen-8x8-s1', 'battle', 'bitset', lambda: generators.battle_instance(8, '32110', 1)),
+    ('battle-bitset-gen-9x9-s0', 'battle', 'bitset', lambda: generators.battle_instance(9, '43210', 0, hints=1)),
+    ('battle-sat-easy1', 'battle', 'sat', 'input_easy1.txt'),
+    ('battle-sat-gen-8x8-s1', 'battle', 'sat', lambda: generators.battle_instance(8, '32110', 1)),
+    ('battle-sat-gen-9x9-s0', 'battle', 'sat', lambda: generators.battle_instance(9, '43210', 0, hints=1)),
+]
+
+METRICS = ['time', 'nodes', 'rss']
+# Differences below these are noise, whatever the relative change.
+FLOORS = {'time': 0.05, 'nodes': 0, 'rss': 2048}
+
+
+def run_solver(solver, mode, inputfile, outputfile):
+    """
+    Run one solver in this process and return the number of nodes it explored.
+
+    :param solver: One of 'checkers', 'hrd' or 'battle'.
+    :param mode: The case mode (see CASES).
+    :param inputfile: The puzzle to solve.
+    :param outputfile: Where the solver writes its solution.
+    :return: The node count reported by the solver.
+    """
+    directory = SOLVER_DIRS[solver]
+    sys.path.insert(0, directory)
+
+    if solver == 'checkers':
+        import checkers
+        state = checkers.State(checkers.read_from_file(inputfile))
+        if mode.startswith('pvs-'):
+            if mode == 'pvs-game':
+                checkers.write_to_file(checkers.solve_checkers(state, 'r', search='pvs'), outputfile)
+            else:
+                depth = int(mode.split('-')[2])
+                checkers.pvs.nodesExplored = 0
+                _, best_move = checkers.pvs_search(state, depth, True, 'r')
+                checkers.write_to_file([best_move], outputfile)
+            return checkers.pvs.nodesExplored
+        if mode == 'game':
+            checkers.write_to_file(checkers.solve_checkers(state, 'r'), outputfile)
+        else:
+            depth = int(mode.split('-')[1])
+            checkers.alpha_beta.nodesExplored = 0
+            _, best_move = checkers.alpha_beta(state, depth, -float('inf'), float('inf'), True, 'r')
+            checkers.write_to_file([best_move], outputfile)
+        return checkers.alpha_beta.nodesExplored
+
+    if solver == 'hrd':
+        import hrd
+        board, goal_board = hrd.read_from_file(inputfile)
+        initial_state = hrd.State(board, h=hrd.manhattan_distance(board, goal_board))
+        solution = hrd.a_star(initial_state, goal_board)
+        if solution != "No solution":
+            hrd.write_solution_to_file(solution, outputfile)
+        else:
+            with open(outputfile, 'w') as f:
+                f.write("No solution\n")
+        return hrd.a_star.nodesExplored
+
+    import battle
+    with open(inputfile) as f:
+        solution = battle.solve(f.read(), 'ships' if mode == 'ships' else 'cells',
+                                engine=mode if mode in ('bitset', 'sat') else 'csp')
+    with open(outputfile, 'w') as f:
+        if solution is not None:
+            f.write(solution)
+    return battle.bt_search.nodesExplored
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process in KB. ru_maxrss survives exec on
+    Linux, so it would report the parent's size if that was larger; VmHWM
+    belongs to the new address space and is preferred when available.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def worker(solver, mode, inputfile, outputfile):
+    """
+    Entry point of the child interpreter: solve, then print the measurements
+    as one JSON object on stdout.
+    """
+    os.chdir(SOLVER_DIRS[solver])
+    start = time.perf_counter()
+    nodes = run_solver(solver, mode, inputfile, outputfile)
+    elapsed = time.perf_counter() - start
+    with open(outputfile, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    print(json.dumps({
+        'time': round(elapsed, 4),
+        'nodes': nodes,
+        'rss': peak_rss(),
+        'output': digest,
+    }))
+
+
+def run_case(case, workdir, timeout):
+    name, solver, mode, source = case
+    if callable(source):
+        inputfile = os.path.join(workdir, name + '.txt')
+        with open(inputfile, 'w') as f:
+            f.write(source())
+    else:
+        inputfile = os.path.join(SOLVER_DIRS[solver], source)
+    outputfile = os.path.join(workdir, name + '.out')
+
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker', solver, mode, inputfile, outputfile]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {'error': 'timed out after {}s'.format(timeout)}
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'exit {}'.format(proc.returncode)}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(name, result, base, threshold):
+    """
+    Compare one case with its baseline entry.
+
+    :return: A list of human readable regressions (empty if none).
+    """
+    if 'error' in result:
+        return ['{}: {}'.format(name, result['error'])]
+    if base is None:
+        return []
+    problems = []
+    for metric in METRICS:
+        old, new = base[metric], result[metric]
+        if new - old > FLOORS[metric] and new > old * (1 + threshold):
+            problems.append('{}: {} {} -> {} (+{:.0%})'.format(
+                name, metric, old, new, (new - old) / old if old else float('inf')))
+    if base.get('output') != result['output']:
+        problems.append('{}: output changed'.format(name))
+    return problems
+
+
+def format_row(name, result, base):
+    if 'error' in result:
+        return '{:<22} {}'.format(name, result['error'])
+    cells = []
+    for metric in METRICS:
+        value = result[metric]
+        if base is not None and base[metric]:
+            cells.append('{:>10} ({:+.0%})'.format(value, (value - base[metric]) / base[metric]))
+        else:
+            cells.append('{:>10} {:>7}'.format(value, '(new)' if base is None else ''))
+    return '{:<22} {}'.format(name, '  '.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--only",
+        type=str,
+        default='',
+        help="Only run cases whose name contains this substring."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Relative increase of a metric that counts as a regression."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="Seconds allowed per case."
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=BASELINE,
+        help="The baseline JSON file."
+    )
+    parser.add_argument(
+        "--update",
+        action='store_true',
+        help="Rewrite the baseline with the results of this run."
+    )
+    parser.add_argument(
+        "--worker",
+        nargs=4,
+        metavar=('SOLVER', 'MODE', 'INPUT', 'OUTPUT'),
+        help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print('{:<22} {:>18}  {:>18}  {:>18}'.format('case', 'time (s)', 'nodes', 'peak rss (KB)'))
+    results = {}
+    problems = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for case in CASES:
+            name = case[0]
+            if args.only not in name:
+                continue
+            result = run_case(case, workdir, args.timeout)
+            results[name] = result
+            print(format_row(name, result, baseline.get(name)))
+            sys.stdout.flush()
+            problems += compare(name, result, baseline.get(name), args.threshold)
+
+    if args.update:
+        failed = [name for name, result in results.items() if 'error' in result]
+        if failed:
+            print('Not updating the baseline, these cases failed: {}'.format(', '.join(failed)))
+            return 1
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Baseline written to {}'.format(args.baseline))
+        return 0
+
+    if problems:
+        print('\nRegressions:')
+        for problem in problems:
+            print('  ' + problem)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
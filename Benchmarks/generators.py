@@ -0,0 +1,156 @@
+"""
+Deterministic generators for benchmark instances that are larger than the
+sample inputs shipped next to each solver.
+
+Every generator takes a seed and returns the text of an input file in the
+format the corresponding solver's ``--inputfile`` expects.
+"""
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HRD_DIR = os.path.join(ROOT, 'Hua Rong Dao')
+
+# Ship lengths indexed like the fleet string of a Battle Solitaire input:
+# submarines, destroyers, cruisers, battleships, carriers.
+SHIP_LENGTHS = [1, 2, 3, 4, 5]
+SHIP_ENDS = {1: ['S'], 2: ['<', '>'], 3: ['<', 'M', '>'], 4: ['<', 'M', 'M', '>'],
+             5: ['<', 'M', 'M', 'M', '>']}
+
+
+def battle_instance(size, fleet, seed, hints=2):
+    """
+    Place the fleet at random on a size x size board and return a puzzle
+    with the resulting row/column counts and a few revealed cells.
+
+    :param size: The width and height of the board (at most 9 so that every
+        count fits in one digit).
+    :param fleet: The fleet string, e.g. '43210'.
+    :param seed: The random seed.
+    :param hints: The number of ship cells to reveal.
+    :return: The text of the puzzle.
+    """
+    rng = random.Random(seed)
+    while True:
+        grid = _place_fleet(rng, size, fleet)
+        if grid is not None:
+            break
+
+    row_counts = ''.join(str(sum(ch != '.' for ch in row)) for row in grid)
+    col_counts = ''.join(str(sum(grid[i][j] != '.' for i in range(size))) for j in range(size))
+    ship_cells = [(i, j) for i in range(size) for j in range(size) if grid[i][j] != '.']
+    revealed = set(rng.sample(ship_cells, min(hints, len(ship_cells))))
+
+    lines = [row_counts, col_counts, fleet]
+    for i in range(size):
+        lines.append(''.join(grid[i][j] if (i, j) in revealed else '0' for j in range(size)))
+    return '\n'.join(lines) + '\n'
+
+
+def _place_fleet(rng, size, fleet):
+    grid = [['.'] * size for _ in range(size)]
+    taken = set()
+    ships = []
+    for index, count in enumerate(fleet):
+        ships += [SHIP_LENGTHS[index]] * int(count)
+    for length in sorted(ships, reverse=True):
+        spots = []
+        for i in range(size):
+            for j in range(size):
+                for di, dj in ([(0, 1), (1, 0)] if length > 1 else [(0, 1)]):
+                    cells = [(i + k * di, j + k * dj) for k in range(length)]
+                    if all(0 <= x < size and 0 <= y < size and (x, y) not in taken for x, y in cells):
+                        spots.append(cells)
+        if not spots:
+            return None
+        cells = rng.choice(spots)
+        vertical = length > 1 and cells[0][1] == cells[1][1]
+        for k, (x, y) in enumerate(cells):
+            part = SHIP_ENDS[length][k]
+            if vertical:
+                part = {'<': '^', '>': 'v'}.get(part, part)
+            grid[x][y] = part
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    taken.add((x + dx, y + dy))
+    return grid
+
+
+CLASSIC_HRD = ['^11^',
+               'v11v',
+               '^<>^',
+               'v22v',
+               '2..2']
+
+
+def hrd_instance(seed, distance, goal=CLASSIC_HRD):
+    """
+    Pick a Hua Rong Dao board at the given move distance from the goal
+    (found by breadth-first search out of the goal) and return a puzzle
+    asking to solve back to it.
+
+    :param seed: The random seed used to choose among the boards at that distance.
+    :param distance: The number of moves between the initial board and the goal.
+    :param goal: The goal board as a list of rows.
+    :return: The text of the puzzle.
+    """
+    if HRD_DIR not in sys.path:
+        sys.path.insert(0, HRD_DIR)
+    import hrd
+
+    rng = random.Random(seed)
+    goal_board = _hrd_board(hrd, goal)
+    layer = [hrd.State(goal_board)]
+    seen = {str(goal_board.grid)}
+    for _ in range(distance):
+        next_layer = []
+        for state in layer:
+            for successor in hrd.generate_successors(state, goal_board):
+                key = str(successor.board.grid)
+                if key not in seen:
+                    seen.add(key)
+                    next_layer.append(successor)
+        if not next_layer:
+            break
+        layer = next_layer
+    state = rng.choice(layer)
+    return hrd.grid_to_string(state.board.grid) + '\n' + '\n'.join(goal) + '\n'
+
+
+def _hrd_board(hrd, rows):
+    pieces = []
+    found_2by2 = False
+    for y, line in enumerate(rows):
+        for x, ch in enumerate(line):
+            if ch == '^':
+                pieces.append(hrd.Piece(False, False, x, y, 'v'))
+            elif ch == '<':
+                pieces.append(hrd.Piece(False, False, x, y, 'h'))
+            elif ch == hrd.char_single:
+                pieces.append(hrd.Piece(False, True, x, y, None))
+            elif ch == '1' and not found_2by2:
+                pieces.append(hrd.Piece(True, False, x, y, None))
+                found_2by2 = True
+    return hrd.Board(len(rows), pieces)
+
+
+def checkers_instance(seed, red, black):
+    """
+    Scatter men of both colours over the dark squares of an empty board.
+
+    :param seed: The random seed.
+    :param red: The number of red men.
+    :param black: The number of black men.
+    :return: The text of the puzzle.
+    """
+    rng = random.Random(seed)
+    board = [['.'] * 8 for _ in range(8)]
+    dark = [(i, j) for i in range(8) for j in range(8) if (i + j) % 2 == 1]
+    red_squares = [sq for sq in dark if sq[0] != 0]
+    for (i, j) in rng.sample(red_squares, red):
+        board[i][j] = 'r'
+    black_squares = [sq for sq in dark if sq[0] != 7 and board[sq[0]][sq[1]] == '.']
+    for (i, j) in rng.sample(black_squares, black):
+        board[i][j] = 'b'
+    return '\n'.join(''.join(row) for row in board) + '\n'
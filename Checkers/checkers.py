@@ -1,5 +1,18 @@
 import argparse
 import copy
+import os
+import random
+import struct
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from profiling import timed, profile_call
+from recordfile import RecordFile
+
+try:
+    import numpy as np
+except ImportError:   # only needed for evaluate_batch
+    np = None
 
 
 class State:
@@ -13,23 +26,32 @@ class State:
             print(''.join(row))
         print("")
 
+    @timed('checkers.State.clone (deepcopy)')
     def clone(self):
         return State(copy.deepcopy(self.board))
 
 
+@timed('checkers.evaluate')
 def evaluate(state, current_depth):
         b_piece = sum([row.count('b') + 1.5 * row.count('B') for row in state.board])
         r_piece = sum([row.count('r') + 1.5 * row.count('R') for row in state.board])
         return r_piece - b_piece - 0.2 * current_depth
 
-def is_game_over(state, player):
+def is_game_over(state, player, moves=None):
+        """
+        :param moves: The valid moves of player, if already generated.
+        """
         b_pieces = sum([row.count('b') + row.count('B') for row in state.board])
         r_pieces = sum([row.count('r') + row.count('R') for row in state.board])
-        moves = get_valid_moves(state, player)
+        if moves is None:
+            moves = get_valid_moves(state, player)
         return b_pieces == 0 or r_pieces == 0 or moves == []
 
+# The opponent's pieces, by piece or player.
+OPPONENT = {'r': ('b', 'B'), 'R': ('b', 'B'), 'b': ('r', 'R'), 'B': ('r', 'R')}
+
 def get_opp_char(player):
-    return ['r', 'R'] if player in ['b', 'B'] else ['b', 'B']
+    return OPPONENT.get(player, ('b', 'B'))
 
 def get_next_turn(curr_turn):
     return 'b' if curr_turn == 'r' else 'r'
@@ -40,6 +62,7 @@ def read_from_file(filename):
         board = [[x for x in line.rstrip()] for line in lines]
     return board
 
+@timed('checkers.move_piece')
 def move_piece(state, move):
     new_state = state.clone()
     board = new_state.board
@@ -74,46 +97,46 @@ def move_piece(state, move):
     return new_state, update
 
 
+@timed('checkers.get_valid_moves')
 def get_valid_moves(state, player):
     moves = []
     captures = []
-
-    directions = [(-1, -1), (-1, 1)] if player == 'r' else [(1, -1), (1, 1)]  
-    king_directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)] 
+    board = state.board
+    opponent = OPPONENT[player]
+    man_kind = 'r' if player == 'r' else 'b'
 
     for i in range(state.height):
+        row = board[i]
         for j in range(state.width):
-            piece = state.board[i][j]
+            piece = row[j]
             if piece.lower() == player:
-                move_dirs = king_directions if piece.isupper() else directions
+                kind = 'king' if piece.isupper() else man_kind
 
-                for dx, dy in move_dirs:
-                    new_x, new_y = i + dx, j + dy
-                    if is_in_bounds(new_x, new_y) and state.board[new_x][new_y] == '.':
+                for new_x, new_y in STEPS[kind][i][j]:
+                    if board[new_x][new_y] == '.':
                         new_state, _ = move_piece(state, ((i, j), (new_x, new_y)))
                         moves.append(new_state)
 
-                for dx, dy in move_dirs:
-                    mid_x, mid_y = i + dx, j + dy
-                    jump_x, jump_y = i + 2 * dx, j + 2 * dy
-                    if is_in_bounds(jump_x, jump_y) and state.board[jump_x][jump_y] == '.' and \
-                            state.board[mid_x][mid_y] in get_opp_char(player):
-                        captures.append(get_jump_chain(state, (i, j), (jump_x, jump_y), (mid_x, mid_y), move_dirs))
+                for (mid_x, mid_y), (jump_x, jump_y) in JUMPS[kind][i][j]:
+                    if board[jump_x][jump_y] == '.' and board[mid_x][mid_y] in opponent:
+                        captures.append(get_jump_chain(state, (i, j), (jump_x, jump_y), (mid_x, mid_y), JUMPS[kind]))
 
     return captures if captures else moves
 
-def get_jump_chain(state, start, jump, jumped, directions):
+def get_jump_chain(state, start, jump, jumped, jumps):
+    """
+    Make the jump from start over jumped to jump, then go on jumping with the
+    moves in jumps (the JUMPS table of the piece's kind) while it can.
+    """
     new_state, update = move_piece(state, (start, jump, jumped))
     if (update):
         return new_state
     piece = new_state.board[jump[0]][jump[1]]
+    opponent = get_opp_char(piece)
 
-    for dx, dy in directions:
-        mid_x, mid_y = jump[0] + dx, jump[1] + dy
-        jump_x, jump_y = jump[0] + 2 * dx, jump[1] + 2 * dy
-        if is_in_bounds(jump_x, jump_y) and new_state.board[jump_x][jump_y] == '.' and \
-                new_state.board[mid_x][mid_y] in get_opp_char(piece):
-            additional_jumps = get_jump_chain(new_state, jump, (jump_x, jump_y), (mid_x, mid_y), directions)
+    for (mid_x, mid_y), (jump_x, jump_y) in jumps[jump[0]][jump[1]]:
+        if new_state.board[jump_x][jump_y] == '.' and new_state.board[mid_x][mid_y] in opponent:
+            additional_jumps = get_jump_chain(new_state, jump, (jump_x, jump_y), (mid_x, mid_y), jumps)
             new_state = additional_jumps
 
     return new_state
@@ -121,11 +144,41 @@ def get_jump_chain(state, start, jump, jumped, directions):
 def is_in_bounds(x, y):
     return 0 <= x < 8 and 0 <= y < 8
 
+# Move directions of red men, black men and kings.
+DIRECTIONS = {
+    'r': [(-1, -1), (-1, 1)],
+    'b': [(1, -1), (1, 1)],
+    'king': [(-1, -1), (-1, 1), (1, -1), (1, 1)],
+}
+
+def build_move_tables():
+    """
+    For each kind of piece in DIRECTIONS and each square (i, j), the squares
+    a step away and the (jumped, landing) squares of the jumps, in the order
+    of DIRECTIONS and without those that leave the board.
+
+    :return: Two dicts, kind -> 8x8 nested lists of those lists.
+    """
+    steps = {}
+    jumps = {}
+    for kind, dirs in DIRECTIONS.items():
+        steps[kind] = [[[(i + dx, j + dy) for dx, dy in dirs if is_in_bounds(i + dx, j + dy)]
+                        for j in range(8)] for i in range(8)]
+        jumps[kind] = [[[((i + dx, j + dy), (i + 2 * dx, j + 2 * dy)) for dx, dy in dirs
+                         if is_in_bounds(i + 2 * dx, j + 2 * dy)]
+                        for j in range(8)] for i in range(8)]
+    return steps, jumps
+
+STEPS, JUMPS = build_move_tables()
+
 def alpha_beta(state, depth, alpha, beta, maximizing_player, player, current_depth=0):
-    if depth == 0 or is_game_over(state, player):
+    alpha_beta.nodesExplored += 1
+    if depth == 0:
         return evaluate(state, current_depth), None
 
     valid_moves = get_valid_moves(state, player)
+    if is_game_over(state, player, valid_moves):
+        return evaluate(state, current_depth), None
 
     if maximizing_player:
         max_eval = -float('inf')
@@ -152,6 +205,270 @@ def alpha_beta(state, depth, alpha, beta, maximizing_player, player, current_dep
                 break
         return min_eval, best_move
 
+alpha_beta.nodesExplored = 0
+
+# Width of a null window. Scores are sums of multiples of 0.5 and 0.2, so no
+# two distinct scores are closer than this.
+NULL_WINDOW = 1e-6
+# Half width of the aspiration window around the previous iteration's score:
+# two men.
+ASPIRATION = 2.0
+
+def _ordered_moves(state, player, color, table):
+    """
+    The valid moves of state, and the order to search their indices in: the
+    best move table recorded for the position (if any) first.
+    """
+    valid_moves = get_valid_moves(state, player)
+    key = position_key(state, player, color == 1)
+    order = list(range(len(valid_moves)))
+    hint = table.get(key)
+    if hint is not None and hint < len(order):
+        order.remove(hint)
+        order.insert(0, hint)
+    return valid_moves, order, key
+
+def pvs(state, depth, alpha, beta, color, player, table, current_depth=0):
+    """
+    Negamax principal variation search. Returns the score of state for the
+    player to move: color (1 if alpha_beta would maximize here, -1 if it would
+    minimize) times evaluate, so the scores are those of alpha_beta.
+
+    The first child, the best move of the previous iteration if table holds
+    one, is searched with the full window. The others are searched with a null
+    window around alpha to prove they are no better, and only searched again
+    with the full window if that fails. table maps a position_key to the index
+    of its best move in get_valid_moves.
+    """
+    pvs.nodesExplored += 1
+    if depth == 0 or is_game_over(state, player):
+        return color * evaluate(state, current_depth)
+
+    valid_moves, order, key = _ordered_moves(state, player, color, table)
+    next_turn = get_next_turn(player)
+    best_score = -float('inf')
+    best_index = None
+    for n, index in enumerate(order):
+        child = valid_moves[index]
+        if n == 0:
+            score = -pvs(child, depth - 1, -beta, -alpha, -color, next_turn, table, current_depth + 1)
+        else:
+            score = -pvs(child, depth - 1, -alpha - NULL_WINDOW, -alpha, -color, next_turn, table, current_depth + 1)
+            if alpha < score < beta:
+                score = -pvs(child, depth - 1, -beta, -alpha, -color, next_turn, table, current_depth + 1)
+        if score > best_score:
+            best_score = score
+            best_index = index
+        alpha = max(alpha, score)
+        if alpha >= beta:
+            break
+    table[key] = best_index
+    return best_score
+
+pvs.nodesExplored = 0
+
+def _pvs_root(state, depth, alpha, beta, color, player, table):
+    """
+    The root of pvs, returning (score, index of the best move). Like
+    alpha_beta, it picks the move that comes first in get_valid_moves among
+    those with the best score, whatever order it searches them in.
+    """
+    pvs.nodesExplored += 1
+    valid_moves, order, key = _ordered_moves(state, player, color, table)
+    next_turn = get_next_turn(player)
+    best_score = -float('inf')
+    best_index = None
+    for n, index in enumerate(order):
+        child = valid_moves[index]
+        if n == 0:
+            score = -pvs(child, depth - 1, -beta, -alpha, -color, next_turn, table, 1)
+        else:
+            # an earlier move also wins by tying
+            bound = alpha - NULL_WINDOW if index < best_index else alpha
+            score = -pvs(child, depth - 1, -bound - NULL_WINDOW, -bound, -color, next_turn, table, 1)
+            if bound < score < beta:
+                score = -pvs(child, depth - 1, -beta, -bound, -color, next_turn, table, 1)
+            if score <= bound:
+                continue
+        if score > best_score or (score == best_score and index < best_index):
+            best_score = score
+            best_index = index
+        alpha = max(alpha, score)
+        if alpha >= beta:
+            break
+    table[key] = best_index
+    return best_score, best_index
+
+def pvs_search(state, depth, maximizing_player, player, table=None):
+    """
+    Iterative deepening PVS from state to depth, two plies at a time so that
+    every iteration ends on the same side to move as the last one (scores
+    swing between odd and even depths). Each iteration after the first
+    searches an aspiration window of ASPIRATION around the previous score,
+    widened to the failing side whenever the score falls outside it, and
+    searches first the best moves the previous iterations found.
+
+    :param table: The best move table (see pvs) to start from and add to;
+        solve_checkers keeps one for the whole game.
+    :return: (score, best move) as alpha_beta would return them;
+        pvs.nodesExplored counts the nodes of all iterations.
+    """
+    if depth == 0 or is_game_over(state, player):
+        pvs.nodesExplored += 1
+        return evaluate(state, 0), None
+    color = 1 if maximizing_player else -1
+    if table is None:
+        table = {}
+    score = None
+    for iteration in range(depth % 2 or 2, depth + 1, 2):
+        if score is None:
+            alpha, beta = -float('inf'), float('inf')
+        else:
+            alpha, beta = score - ASPIRATION, score + ASPIRATION
+        while True:
+            result, index = _pvs_root(state, iteration, alpha, beta, color, player, table)
+            if result <= alpha:
+                alpha = -float('inf')
+            elif result >= beta:
+                beta = float('inf')
+            else:
+                break
+        score = result
+    return color * score, get_valid_moves(state, player)[index]
+
+# Weights of the rich evaluation (evaluate_batch(rich=True)), in men.
+# Men gain as they advance (index 0 is their own back rank), kings gain
+# towards the centre.
+MAN_ADVANCE = [0.0, 0.0, 0.02, 0.04, 0.06, 0.08, 0.1, 0.0]
+KING_CENTRE = [0.0, 0.02, 0.04, 0.06, 0.06, 0.04, 0.02, 0.0]
+BACK_RANK = 0.05     # per man still guarding its own back rank
+MOBILITY = 0.02      # per simple move available
+
+def board_planes(states):
+    """
+    The boards of states as an array of shape (len(states), 4, 8, 8) of
+    booleans, one plane each for 'r', 'R', 'b' and 'B'.
+    """
+    text = ''.join(''.join(''.join(row) for row in state.board) for state in states)
+    codes = np.frombuffer(text.encode('ascii'), dtype=np.uint8).reshape(len(states), 1, 8, 8)
+    return codes == np.array([ord(piece) for piece in 'rRbB'], dtype=np.uint8).reshape(1, 4, 1, 1)
+
+def _square_tables():
+    man = np.array(MAN_ADVANCE)
+    king = np.array(KING_CENTRE)
+    red_man = np.repeat(man[::-1].reshape(8, 1), 8, axis=1)
+    black_man = np.repeat(man.reshape(8, 1), 8, axis=1)
+    kings = np.add.outer(king, king)
+    return np.stack([red_man, kings, black_man, kings])
+
+def _simple_moves(planes, empty):
+    """
+    The number of simple moves of each side's pieces in each board: red men
+    and kings one row up, black men and kings one row down.
+    """
+    red_up = planes[:, 0] | planes[:, 1]
+    black_down = planes[:, 2] | planes[:, 3]
+    red_down = planes[:, 1]
+    black_up = planes[:, 3]
+
+    def up(pieces):
+        return (pieces[:, 1:, 1:] & empty[:, :-1, :-1]).sum(axis=(1, 2)) + \
+            (pieces[:, 1:, :-1] & empty[:, :-1, 1:]).sum(axis=(1, 2))
+
+    def down(pieces):
+        return (pieces[:, :-1, 1:] & empty[:, 1:, :-1]).sum(axis=(1, 2)) + \
+            (pieces[:, :-1, :-1] & empty[:, 1:, 1:]).sum(axis=(1, 2))
+
+    return up(red_up) + down(red_down), down(black_down) + up(black_up)
+
+@timed('checkers.evaluate_batch')
+def evaluate_batch(states, current_depth, rich=False):
+    """
+    evaluate for many boards at once with NumPy, returning an array of the
+    scores. Without rich the scores are exactly those of evaluate. With rich
+    they also count piece-square tables, men on their own back rank and
+    mobility.
+    """
+    if np is None:
+        raise ImportError("evaluate_batch needs NumPy")
+    planes = board_planes(states)
+    counts = planes.sum(axis=(2, 3))
+    r_piece = counts[:, 0] + 1.5 * counts[:, 1]
+    b_piece = counts[:, 2] + 1.5 * counts[:, 3]
+    scores = r_piece - b_piece - 0.2 * current_depth
+    if rich:
+        squares = (planes * _SQUARE_TABLES).sum(axis=(2, 3))
+        scores = scores + squares[:, 0] + squares[:, 1] - squares[:, 2] - squares[:, 3]
+        scores = scores + BACK_RANK * (planes[:, 0, 7].sum(axis=1) - planes[:, 2, 0].sum(axis=1))
+        red_moves, black_moves = _simple_moves(planes, ~planes.any(axis=1))
+        scores = scores + MOBILITY * (red_moves - black_moves)
+    return scores
+
+_SQUARE_TABLES = _square_tables() if np is not None else None
+
+def _leaf_loop(scores, alpha, beta, maximizing_player):
+    """
+    The loop of alpha_beta over leaves with these scores, counting them as
+    nodes. Returns (best score, index of its leaf).
+    """
+    best_eval = -float('inf') if maximizing_player else float('inf')
+    best_index = None
+    for k, eval in enumerate(scores):
+        alpha_beta.nodesExplored += 1
+        if maximizing_player:
+            if eval > best_eval:
+                best_eval = eval
+                best_index = k
+            alpha = max(alpha, eval)
+        else:
+            if eval < best_eval:
+                best_eval = eval
+                best_index = k
+            beta = min(beta, eval)
+        if beta <= alpha:
+            break
+    return best_eval, best_index
+
+def alpha_beta_batched(state, depth, alpha, beta, maximizing_player, player, current_depth=0, rich=False):
+    """
+    alpha_beta with the leaves scored by evaluate_batch, one batch per depth 1
+    node: its replies, or the node alone if it ends the game. Nodes are
+    counted in alpha_beta.nodesExplored as alpha_beta counts them, and
+    without rich the result is the same. The batches are small (the replies
+    to one move), so NumPy's call overhead is not amortized.
+    """
+    alpha_beta.nodesExplored += 1
+    if depth == 0:
+        return evaluate_batch([state], current_depth, rich)[0], None
+
+    valid_moves = get_valid_moves(state, player)
+    if is_game_over(state, player, valid_moves):
+        return evaluate_batch([state], current_depth, rich)[0], None
+    if depth == 1:
+        best_eval, index = _leaf_loop(evaluate_batch(valid_moves, current_depth + 1, rich).tolist(),
+                                      alpha, beta, maximizing_player)
+        return best_eval, valid_moves[index]
+
+    next_turn = get_next_turn(player)
+    best_eval = -float('inf') if maximizing_player else float('inf')
+    best_move = None
+    for new_state in valid_moves:
+        eval, _ = alpha_beta_batched(new_state, depth - 1, alpha, beta, not maximizing_player,
+                                     next_turn, current_depth + 1, rich)
+        if maximizing_player:
+            if eval > best_eval:
+                best_eval = eval
+                best_move = new_state
+            alpha = max(alpha, eval)
+        else:
+            if eval < best_eval:
+                best_eval = eval
+                best_move = new_state
+            beta = min(beta, eval)
+        if beta <= alpha:
+            break
+    return best_eval, best_move
+
 def write_to_file(best_moves, output_file):
     with open(output_file, 'w') as f:
         for state in best_moves:
@@ -160,12 +477,39 @@ def write_to_file(best_moves, output_file):
             f.write('\n')
     return None
 
-def solve_checkers(state, turn, max_depth=7):
+def solve_checkers(state, turn, max_depth=7, book=None, search='alphabeta', evaluation='python', table=None):
+    """
+    Play the game out from state with turn to move, each side choosing its move
+    with a depth max_depth alpha-beta search, and return the list of states.
+
+    :param book: An OpeningBook; positions it holds at max_depth or deeper are
+        looked up instead of searched. solve_checkers.bookHits counts them.
+    :param search: 'alphabeta' for alpha_beta, 'pvs' for pvs_search (nodes
+        counted in pvs.nodesExplored).
+    :param evaluation: With search 'alphabeta', 'python' for evaluate, or
+        'numpy' or 'numpy-rich' for alpha_beta_batched without and with
+        rich evaluate_batch scores.
+    :param table: The move table of pvs_search, which can be kept from game to
+        game; by default a new one for this game.
+    """
     best_moves = [state]
     max_player = True
+    alpha_beta.nodesExplored = 0
+    pvs.nodesExplored = 0
+    pvs_table = {} if table is None else table
+    solve_checkers.bookHits = 0
     while (not is_game_over(state, turn)):
 
-        _, best_move = alpha_beta(state, max_depth, -float('inf'), float('inf'), max_player, turn)
+        best_move = book.best_move(state, turn, max_player, max_depth) if book is not None else None
+        if best_move is not None:
+            solve_checkers.bookHits += 1
+        elif search == 'pvs':
+            _, best_move = pvs_search(state, max_depth, max_player, turn, pvs_table)
+        elif evaluation != 'python':
+            _, best_move = alpha_beta_batched(state, max_depth, -float('inf'), float('inf'), max_player, turn,
+                                              rich=evaluation == 'numpy-rich')
+        else:
+            _, best_move = alpha_beta(state, max_depth, -float('inf'), float('inf'), max_player, turn)
         best_moves.append(best_move)
         state = best_move
 
@@ -173,24 +517,237 @@ def solve_checkers(state, turn, max_depth=7):
         max_player = not max_player
     return best_moves
 
+solve_checkers.bookHits = 0
+
+
+def initial_board():
+    """
+    The standard starting position: black men on the dark squares of the top
+    three rows, red men on those of the bottom three.
+    """
+    board = [['.'] * 8 for _ in range(8)]
+    for i in list(range(3)) + list(range(5, 8)):
+        for j in range(8):
+            if (i + j) % 2 == 1:
+                board[i][j] = 'b' if i < 3 else 'r'
+    return board
+
+
+def _zobrist_keys():
+    rng = random.Random(0x5eed)
+    pieces = dict(((i, j, piece), rng.getrandbits(64))
+                  for i in range(8) for j in range(8) for piece in 'rRbB')
+    sides = dict(((player, maximizing), rng.getrandbits(64))
+                 for player in 'rb' for maximizing in (True, False))
+    return pieces, sides
+
+ZOBRIST_PIECES, ZOBRIST_SIDES = _zobrist_keys()
+
+
+def position_key(state, player, maximizing_player):
+    """
+    The 64-bit Zobrist hash of a position: the pieces on the board, the
+    player to move and whether alpha_beta maximizes for them.
+    """
+    key = ZOBRIST_SIDES[(player, maximizing_player)]
+    for i, row in enumerate(state.board):
+        for j, piece in enumerate(row):
+            if piece != '.':
+                key ^= ZOBRIST_PIECES[(i, j, piece)]
+    return key
+
+
+class OpeningBook(RecordFile):
+    """
+    A book of searched positions: a RecordFile of (position_key, search
+    depth, index of the best move in get_valid_moves) records after the
+    magic CKBOOK01. Raises ValueError if filename is not a book.
+    """
+    MAGIC = b'CKBOOK01'
+    RECORD = struct.Struct('<QBB')
+
+    def __init__(self, filename):
+        RecordFile.__init__(self, filename, self.MAGIC, self.RECORD, kind='an opening book')
+
+    def lookup(self, key):
+        """
+        :return: (depth, move index) stored for key, or None.
+        """
+        record = self.find(key)
+        return None if record is None else record[1:]
+
+    def best_move(self, state, player, maximizing_player, depth):
+        """
+        :return: The book move of the position if it was searched to at least
+            depth, otherwise None.
+        """
+        entry = self.lookup(position_key(state, player, maximizing_player))
+        if entry is None or entry[0] < depth:
+            return None
+        moves = get_valid_moves(state, player)
+        return moves[entry[1]] if entry[1] < len(moves) else None
+
+    def entries(self):
+        return dict((key, (depth, index)) for key, depth, index in
+                    (self.record(k) for k in range(self.size)))
+
+    @staticmethod
+    def write(filename, entries):
+        """
+        Write entries, a dict position_key -> (depth, move index), as a book.
+        """
+        RecordFile.write(filename, OpeningBook.MAGIC, OpeningBook.RECORD,
+                         ((key, depth, index) for key, (depth, index) in entries.items()))
+
+
+def book_positions(start, turn, plies):
+    """
+    The distinct positions reachable from start in at most plies moves, as
+    (state, player, maximizing_player) with the players alternating the way
+    solve_checkers does, leaving out finished games.
+    """
+    seen = set()
+    frontier = [(start, turn, True)]
+    positions = []
+    for ply in range(plies + 1):
+        next_frontier = []
+        for state, player, maximizing in frontier:
+            key = position_key(state, player, maximizing)
+            if key in seen or is_game_over(state, player):
+                continue
+            seen.add(key)
+            positions.append((state, player, maximizing))
+            if ply < plies:
+                for new_state in get_valid_moves(state, player):
+                    next_frontier.append((new_state, get_next_turn(player), not maximizing))
+        frontier = next_frontier
+    return positions
+
+
+def _book_entry(job):
+    board, player, maximizing, depth = job
+    state = State(board)
+    _, best_move = alpha_beta(state, depth, -float('inf'), float('inf'), maximizing, player)
+    moves = get_valid_moves(state, player)
+    index = next(k for k, move in enumerate(moves) if move.board == best_move.board)
+    return position_key(state, player, maximizing), depth, index
+
+
+def build_book(filename, starts, depth=9, plies=2, workers=None):
+    """
+    Search every position within plies moves of the (state, turn) pairs in
+    starts to depth on a pool of worker processes, and add the best moves to
+    the book in filename (created if missing; deeper entries already there
+    are kept).
+
+    :return: The number of positions searched.
+    """
+    entries = {}
+    if os.path.exists(filename):
+        book = OpeningBook(filename)
+        entries = book.entries()
+        book.close()
+    jobs = []
+    for state, turn in starts:
+        for position, player, maximizing in book_positions(state, turn, plies):
+            known = entries.get(position_key(position, player, maximizing))
+            if known is None or known[0] < depth:
+                jobs.append((position.board, player, maximizing, depth))
+    import multiprocessing
+    with multiprocessing.Pool(workers) as pool:
+        for key, searched, index in pool.imap_unordered(_book_entry, jobs):
+            entries[key] = (searched, index)
+    OpeningBook.write(filename, entries)
+    return len(jobs)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--inputfile",
         type=str,
-        required=True,
         help="The input file that contains the puzzle."
     )
     parser.add_argument(
         "--outputfile",
         type=str,
-        required=True,
         help="The output file that contains the solution."
     )
+    parser.add_argument(
+        "--search",
+        type=str,
+        default='alphabeta',
+        choices=['alphabeta', 'pvs'],
+        help="Minimax alpha-beta, or negamax PVS with iterative deepening and aspiration windows."
+    )
+    parser.add_argument(
+        "--eval",
+        type=str,
+        default='python',
+        choices=['python', 'numpy', 'numpy-rich'],
+        help="Score the leaves one by one in Python, or in NumPy batches of the replies to a move, "
+             "optionally with piece-square, back rank and mobility terms, which change the moves "
+             "played (alpha-beta only)."
+    )
+    parser.add_argument(
+        "--book",
+        type=str,
+        help="An opening book (see --build-book) to look positions up in before searching."
+    )
+    parser.add_argument(
+        "--build-book",
+        type=str,
+        metavar="BOOK",
+        help="Search the positions near --inputfile (or the standard start) and add them to BOOK."
+    )
+    parser.add_argument(
+        "--book-depth",
+        type=int,
+        default=9,
+        help="Search depth of the positions added by --build-book."
+    )
+    parser.add_argument(
+        "--book-plies",
+        type=int,
+        default=2,
+        help="With --build-book, add the positions up to this many moves from the start."
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        metavar="PREFIX",
+        help="Profile the search and write PREFIX.pstats and PREFIX.collapsed."
+    )
     args = parser.parse_args()
 
+    if args.build_book:
+        start = read_from_file(args.inputfile) if args.inputfile else initial_board()
+        try:
+            searched = build_book(args.build_book, [(State(start), 'r')], args.book_depth, args.book_plies)
+        except ValueError as e:
+            parser.error(str(e))
+        print("Searched {} positions to depth {} into {}".format(searched, args.book_depth, args.build_book))
+        sys.exit(0)
+    if not args.inputfile or not args.outputfile:
+        parser.error("--inputfile and --outputfile are required unless --build-book is given")
+    if args.eval != 'python':
+        if args.search != 'alphabeta':
+            parser.error("--eval {} needs --search alphabeta".format(args.eval))
+        if np is None:
+            parser.error("--eval {} needs NumPy".format(args.eval))
+
     initial_board = read_from_file(args.inputfile)
     state = State(initial_board)
     turn = 'r'
-    best_moves = solve_checkers(state, turn)
+    try:
+        book = OpeningBook(args.book) if args.book else None
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.profile:
+        best_moves = profile_call(args.profile, solve_checkers, state, turn, book=book, search=args.search,
+                                  evaluation=args.eval)
+    else:
+        best_moves = solve_checkers(state, turn, book=book, search=args.search, evaluation=args.eval)
     write_to_file(best_moves, args.outputfile)
+    if book is not None:
+        print("Book moves: {}".format(solve_checkers.bookHits), file=sys.stderr)
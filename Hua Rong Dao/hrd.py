@@ -1,5 +1,12 @@
 import argparse
 import heapq
+import os
+import struct
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from profiling import timed, profile_call
+from recordfile import RecordFile
 #====================================================================================
 
 char_single = '2'
@@ -75,6 +82,7 @@ class Board:
         return False
 
 
+    @timed('hrd.Board.__construct_grid')
     def __construct_grid(self):
         """
         Called in __init__ to set up a 2-d grid based on the piece location information.
@@ -205,6 +213,7 @@ def clear_piece_from_grid(grid, piece):
             grid[y + 1][x] = '.'
 
 
+@timed('hrd.manhattan_distance')
 def manhattan_distance(board, goal_board):
     """
     Calculate the Manhattan distance heuristic between the current state and the goal state.
@@ -328,6 +337,7 @@ def move_piece(board, piece, new_x, new_y):
     new_board.grid = new_grid
     return new_board
 
+@timed('hrd.generate_successors')
 def generate_successors(current_state, goal_board):
     """
     Generate valid successor states by moving pieces to adjacent empty spaces.
@@ -369,6 +379,7 @@ def dfs(initial_state, goal_board):
     """
     stack = [initial_state]
     explored = set()
+    dfs.nodesExplored = 0
 
     while stack:
         current_state = stack.pop()
@@ -377,6 +388,7 @@ def dfs(initial_state, goal_board):
             return backtrack_solution(current_state)
 
         explored.add(str(current_state.board.grid))
+        dfs.nodesExplored += 1
 
         successors = generate_successors(current_state, goal_board)
 
@@ -397,6 +409,7 @@ def a_star(initial_state, goal_board):
     frontier = []
     heapq.heappush(frontier, (initial_state.f, initial_state))
     explored = set()
+    a_star.nodesExplored = 0
 
     while frontier:
         _, current_state = heapq.heappop(frontier)
@@ -405,6 +418,7 @@ def a_star(initial_state, goal_board):
             return backtrack_solution(current_state)
 
         explored.add(str(current_state.board.grid))
+        a_star.nodesExplored += 1
 
         successors = generate_successors(current_state, goal_board)
 
@@ -455,7 +469,19 @@ def read_from_file(filename):
     :rtype: Board
     """
 
-    puzzle_file = open(filename, "r")
+    with open(filename, "r") as puzzle_file:
+        return parse_puzzle(puzzle_file)
+
+
+def parse_puzzle(lines):
+    """
+    Load the initial and goal boards from the lines of a puzzle file.
+
+    :param lines: The lines, each ending in a newline, e.g. an open file or
+        text.splitlines(True).
+    :return: The initial board and the goal board
+    :rtype: (Board, Board)
+    """
 
     line_index = 0
     pieces = []
@@ -465,7 +491,7 @@ def read_from_file(filename):
     finalfound_2by2 = False
     height_ = 0
 
-    for line in puzzle_file:
+    for line in lines:
         height_ += 1
         if line == '\n':
             if not final:
@@ -498,8 +524,7 @@ def read_from_file(filename):
                         final_pieces.append(Piece(True, False, x, line_index, None))
                         finalfound_2by2 = True
         line_index += 1
-        
-    puzzle_file.close()
+
     board = Board(height_, pieces)
     goal_board = Board(height_, final_pieces)
     return board, goal_board
@@ -514,6 +539,158 @@ def grid_to_string(grid):
     return string
 
 
+# The cells each kind of piece covers from its top left corner, and the
+# symbols it draws there.
+PIECE_SHAPES = {
+    '1': ([(0, 0), (1, 0), (0, 1), (1, 1)], '1111'),
+    char_single: ([(0, 0)], char_single),
+    '<': ([(0, 0), (1, 0)], '<>'),
+    '^': ([(0, 0), (0, 1)], '^v'),
+}
+# Directions of the moves of DistanceTable, in the order of generate_successors.
+# Reversing a move flips the lowest bit of its direction.
+DIRECTIONS = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+# The symbols of a grid as 3-bit codes, for grid_key.
+SYMBOL_CODES = {'.': 0, '1': 1, char_single: 2, '<': 3, '>': 4, '^': 5, 'v': 6}
+
+
+def grid_key(cells):
+    """
+    The key of a board in a DistanceTable: its symbols, row by row, packed 3
+    bits each into an int.
+
+    :param cells: The symbols of the grid, row by row (a string or a list).
+    :rtype: int
+    """
+    key = 0
+    for ch in reversed(cells):
+        key = (key << 3) | SYMBOL_CODES[ch]
+    return key
+
+
+def slide_piece(cells, width, index, direction):
+    """
+    Move a piece one cell.
+
+    :param cells: The symbols of the grid, row by row, as a string.
+    :param index: The index in cells of the top left cell of the piece.
+    :param direction: The index of the move in DIRECTIONS.
+    :return: cells after the move, or None if the piece cannot move there.
+    """
+    shape, symbols = PIECE_SHAPES[cells[index]]
+    height = len(cells) // width
+    x, y = index % width, index // width
+    mx, my = DIRECTIONS[direction]
+    covered = [(x + dx, y + dy) for dx, dy in shape]
+    target = [(cx + mx, cy + my) for cx, cy in covered]
+    for tx, ty in target:
+        if not (0 <= tx < width and 0 <= ty < height) or \
+                ((tx, ty) not in covered and cells[ty * width + tx] != '.'):
+            return None
+    new_cells = list(cells)
+    for cx, cy in covered:
+        new_cells[cy * width + cx] = '.'
+    for (tx, ty), symbol in zip(target, symbols):
+        new_cells[ty * width + tx] = symbol
+    return ''.join(new_cells)
+
+
+def grid_moves(cells, width):
+    """
+    Generate the moves of the board in cells, a string of its symbols row by
+    row, as (index of the moved piece's top left cell, index in DIRECTIONS,
+    cells after the move).
+    """
+    big = cells.find('1')
+    for index, ch in enumerate(cells):
+        if ch not in PIECE_SHAPES or (ch == '1' and index != big):
+            continue
+        for direction in range(len(DIRECTIONS)):
+            new_cells = slide_piece(cells, width, index, direction)
+            if new_cells is not None:
+                yield index, direction, new_cells
+
+
+class DistanceTable(RecordFile):
+    """
+    The distance to one goal board of every board it can be reached from: a
+    RecordFile of (grid_key, number of moves to the goal, next move on a
+    shortest path) records, whose header holds the board size and the key of
+    the goal. A move is 4 * the index of the moved piece's top left cell +
+    its index in DIRECTIONS, and NO_MOVE at the goal. A path costs one
+    lookup per move. Raises ValueError if filename is not a distance table.
+    """
+    MAGIC = b'HRDTAB01'
+    HEADER = struct.Struct('<BBQ')
+    RECORD = struct.Struct('<QHB')
+    NO_MOVE = 255
+
+    def __init__(self, filename):
+        RecordFile.__init__(self, filename, self.MAGIC, self.RECORD, self.HEADER, kind='a distance table')
+        self.height, self.width, self.goal_key = self.header
+
+    def lookup(self, key):
+        """
+        :return: (distance, next move) stored for key, or None.
+        """
+        record = self.find(key)
+        return None if record is None else record[1:]
+
+    def solve(self, board, goal_board):
+        """
+        Look up a shortest path from board to goal_board.
+
+        :return: The grids of the path (strings of their rows), "No solution"
+            if board cannot reach the goal, or None if the table is for
+            another goal or board size.
+        """
+        if (board.height, board.width) != (self.height, self.width) or \
+                grid_key(sum(goal_board.grid, [])) != self.goal_key:
+            return None
+        cells = ''.join(sum(board.grid, []))
+        entry = self.lookup(grid_key(cells))
+        if entry is None:
+            return "No solution"
+        path = [cells]
+        while entry[1] != self.NO_MOVE:
+            cells = slide_piece(cells, self.width, entry[1] >> 2, entry[1] & 3)
+            path.append(cells)
+            entry = self.lookup(grid_key(cells))
+        return [[cells[y * self.width:(y + 1) * self.width] for y in range(self.height)] for cells in path]
+
+    @staticmethod
+    def build(filename, goal_board):
+        """
+        Breadth-first search every board that can reach goal_board and write
+        their distances as a table. Moves can be undone, so this is a search
+        from the goal.
+
+        :return: The number of boards in the table.
+        """
+        width = goal_board.width
+        if goal_board.height * width * 3 > 64:
+            raise ValueError('boards of more than 21 cells do not fit a table key')
+        goal = ''.join(sum(goal_board.grid, []))
+        entries = {goal: (0, DistanceTable.NO_MOVE)}
+        frontier = [goal]
+        distance = 0
+        while frontier:
+            distance += 1
+            next_frontier = []
+            for cells in frontier:
+                for index, direction, new_cells in grid_moves(cells, width):
+                    if new_cells not in entries:
+                        mx, my = DIRECTIONS[direction]
+                        entries[new_cells] = (distance, 4 * (index + mx + my * width) + (direction ^ 1))
+                        next_frontier.append(new_cells)
+            frontier = next_frontier
+
+        RecordFile.write(filename, DistanceTable.MAGIC, DistanceTable.RECORD,
+                         ((grid_key(cells), distance, move) for cells, (distance, move) in entries.items()),
+                         DistanceTable.HEADER, (goal_board.height, width, grid_key(goal)))
+        return len(entries)
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
@@ -526,27 +703,74 @@ if __name__ == "__main__":
     parser.add_argument(
         "--outputfile",
         type=str,
-        required=True,
         help="The output file that contains the solution."
     )
     parser.add_argument(
         "--algo",
         type=str,
-        required=True,
         choices=['astar', 'dfs'],
         help="The searching algorithm."
     )
+    parser.add_argument(
+        "--table",
+        type=str,
+        help="A distance table (see --build-table) to look the solution up in; "
+             "--algo is used if the table is for another goal."
+    )
+    parser.add_argument(
+        "--build-table",
+        type=str,
+        metavar="TABLE",
+        help="Write the distance table of the goal board of --inputfile to TABLE."
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        metavar="PREFIX",
+        help="Profile the search and write PREFIX.pstats and PREFIX.collapsed."
+    )
     args = parser.parse_args()
 
     # read the board from the file
     board, goal_board = read_from_file(args.inputfile)
 
-    initial_state = State(board, h=manhattan_distance(board, goal_board))
-
-    if args.algo == 'dfs':
-        solution = dfs(initial_state, goal_board)
-    elif args.algo == 'astar':
-        solution = a_star(initial_state, goal_board)
+    if args.build_table:
+        try:
+            size = DistanceTable.build(args.build_table, goal_board)
+        except ValueError as e:
+            parser.error(str(e))
+        print("Wrote the distances of {} boards to {}".format(size, args.build_table))
+        sys.exit(0)
+    if not args.outputfile or not (args.algo or args.table):
+        parser.error("--outputfile and --algo or --table are required unless --build-table is given")
+
+    solution = None
+    if args.table:
+        try:
+            table = DistanceTable(args.table)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        solution = table.solve(board, goal_board)
+        table.close()
+        if solution is None:
+            if not args.algo:
+                parser.error("{} is for another goal; give --algo to search instead".format(args.table))
+            print("{} is for another goal; searching".format(args.table), file=sys.stderr)
+        elif solution != "No solution":
+            with open(args.outputfile, 'w') as f:
+                for grid in solution:
+                    f.write(grid_to_string(grid))
+                    f.write("\n")
+            sys.exit(0)
+
+    if solution is None:
+        initial_state = State(board, h=manhattan_distance(board, goal_board))
+
+        search = dfs if args.algo == 'dfs' else a_star
+        if args.profile:
+            solution = profile_call(args.profile, search, initial_state, goal_board)
+        else:
+            solution = search(initial_state, goal_board)
 
     if solution != "No solution":
         write_solution_to_file(solution, args.outputfile)
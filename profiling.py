@@ -0,0 +1,138 @@
+"""
+Profiling support shared by the three solvers.
+
+Two tools live here:
+
+* ``timed`` wraps a hot function in a wall-clock timer. The timers are only
+  installed when the ``SOLVER_TIMERS`` environment variable is set when the
+  solver is imported; otherwise ``timed`` hands back the undecorated function,
+  so a disabled timer costs nothing at all. Enabled timers print a summary to
+  stderr when the interpreter exits.
+
+* ``profile_call`` runs a function under cProfile while a background thread
+  samples the main thread's stack. It writes ``<prefix>.pstats`` (load it with
+  ``python -m pstats``) and ``<prefix>.collapsed``, one ``frame;frame;frame
+  count`` line per distinct stack, which flamegraph.pl, speedscope or inferno
+  read directly.
+"""
+import atexit
+import cProfile
+import collections
+import os
+import pstats
+import sys
+import threading
+import time
+
+TIMERS_ENABLED = bool(os.environ.get('SOLVER_TIMERS'))
+
+# name -> [calls, total seconds]
+_timers = collections.OrderedDict()
+
+
+def timed(name):
+    """
+    Decorator timing every call of the decorated function under ``name``.
+
+    :param name: The label the timer is reported under.
+    :type name: str
+    """
+    def decorate(func):
+        if not TIMERS_ENABLED:
+            return func
+        stats = _timers.setdefault(name, [0, 0.0])
+        clock = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats[0] += 1
+                stats[1] += clock() - start
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.__wrapped__ = func
+        return wrapper
+    return decorate
+
+
+def timer_report():
+    """
+    Return the collected timers as a list of (name, calls, seconds), slowest first.
+    """
+    return sorted(((name, calls, total) for name, (calls, total) in _timers.items()),
+                  key=lambda row: -row[2])
+
+
+def print_timer_report(out=None):
+    out = out or sys.stderr
+    rows = timer_report()
+    if not rows:
+        return
+    print("{:<36} {:>10} {:>12} {:>12}".format("timer", "calls", "total (s)", "per call (us)"), file=out)
+    for name, calls, total in rows:
+        print("{:<36} {:>10} {:>12.4f} {:>12.2f}".format(
+            name, calls, total, 1e6 * total / calls if calls else 0.0), file=out)
+
+
+if TIMERS_ENABLED:
+    atexit.register(print_timer_report)
+
+
+class StackSampler(threading.Thread):
+    """
+    Background thread recording the stack of another thread at a fixed
+    interval, aggregated into collapsed-stack counts.
+    """
+
+    def __init__(self, thread_id, interval=0.001):
+        threading.Thread.__init__(self, daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write("{} {}\n".format(stack, count))
+
+
+def profile_call(prefix, func, *args, **kwargs):
+    """
+    Call ``func(*args, **kwargs)`` under cProfile and the stack sampler, write
+    ``<prefix>.pstats`` and ``<prefix>.collapsed``, print the top of the
+    cumulative-time table to stderr and return whatever ``func`` returned.
+
+    :param prefix: Path prefix of the two output files.
+    :type prefix: str
+    """
+    sampler = StackSampler(threading.get_ident())
+    profiler = cProfile.Profile()
+    sampler.start()
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        sampler.stop()
+        profiler.dump_stats(prefix + '.pstats')
+        sampler.write(prefix + '.collapsed')
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(20)
+        print("Profile written to {0}.pstats and {0}.collapsed".format(prefix), file=sys.stderr)
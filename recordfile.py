@@ -0,0 +1,76 @@
+"""
+Memory-mapped files of fixed-size records sorted by key, shared by the
+checkers opening book and the Hua Rong Dao distance table.
+
+A file is a magic string, an optional fixed-size header and then the records,
+each a ``struct.Struct`` whose first field is the unsigned integer key, in
+increasing key order. Opening one maps it read-only and costs nothing whatever
+its size; a lookup is a binary search that reads only the pages it touches.
+"""
+import mmap
+
+
+class RecordFile:
+    """
+    An open record file.
+
+    :param filename: The file to open.
+    :param magic: The bytes the file must start with.
+    :param record: The ``struct.Struct`` of a record.
+    :param header: The ``struct.Struct`` of the header, or None for none; its
+        values are in ``self.header``.
+    :param kind: What the file is, for the error message, e.g. "an opening
+        book".
+    :raises ValueError: If the file is empty, too short or has the wrong
+        magic. The file is closed first.
+    """
+    def __init__(self, filename, magic, record, header=None, kind='a record file'):
+        self._record_struct = record
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:   # mmap refuses empty files
+            self._file.close()
+            raise ValueError('{} is empty, not {}'.format(filename, kind))
+        self._start = len(magic) + (header.size if header is not None else 0)
+        if self._map[:len(magic)] != magic or len(self._map) < self._start:
+            self.close()
+            raise ValueError('{} is not {}'.format(filename, kind))
+        self.header = header.unpack_from(self._map, len(magic)) if header is not None else ()
+        self.size = (len(self._map) - self._start) // record.size
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def record(self, index):
+        return self._record_struct.unpack_from(self._map, self._start + index * self._record_struct.size)
+
+    def find(self, key):
+        """
+        :return: The record with key, or None.
+        """
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = self.record(mid)
+            if record[0] < key:
+                lo = mid + 1
+            elif record[0] > key:
+                hi = mid
+            else:
+                return record
+        return None
+
+    @staticmethod
+    def write(filename, magic, record, records, header=None, header_values=()):
+        """
+        Write records, tuples of the fields of record with the key first, as a
+        record file, sorting them by key.
+        """
+        with open(filename, 'wb') as f:
+            f.write(magic)
+            if header is not None:
+                f.write(header.pack(*header_values))
+            for values in sorted(records):
+                f.write(record.pack(*values))
@@ -0,0 +1,534 @@
+"""
+A long-running daemon serving the Checkers, Hua Rong Dao and Battle Solitaire
+solvers over a Unix socket.
+
+Each job run through a solver's CLI pays for starting the interpreter and
+importing the solver, and throws its tables away when it exits. The daemon
+keeps a pool of worker processes with the three solvers imported, so a job
+only costs its search, and keeps what is worth keeping between jobs:
+
+* each worker keeps the Checkers PVS move table (see ``pvs_search``) and the
+  opening book given with ``--book``, so later games start with the move
+  ordering of earlier ones, and the Hua Rong Dao distance tables its jobs
+  have named, open;
+* the daemon keeps the results of the last ``--cache`` distinct jobs, and
+  answers a repeated job without running it again.
+
+The protocol is JSON lines: a client writes one request object per line and
+gets exactly one response line per request, each with the ``op`` and ``id``
+of its request. Solve responses come in the order the jobs finish.
+
+    {"op": "solve", "id": 1, "solver": "hrd", "puzzle": "...", "options": {"algo": "astar"}, "deadline": 5}
+    {"op": "cancel", "id": 1}
+    {"op": "stats"}
+
+``solver`` is one of ``checkers``, ``hrd`` or ``battle``, ``puzzle`` the text
+of an input file and ``options`` the keyword arguments of the solver's entry
+below (``_checkers_job``, ``_hrd_job``, ``_battle_job``). A solve response
+holds the ``solution`` text (None if there is none), ``nodes`` and ``time``
+(seconds in the worker), or an ``error``. ``deadline`` is in seconds from the
+request, queueing included (default ``--timeout``). A job cancelled or past
+its deadline while running has its worker killed and replaced, which loses
+that worker's tables. Job ids are strings, integers or null, per connection,
+and the jobs of a connection that closes are cancelled.
+
+    python solverd.py --socket /tmp/solverd.sock --workers 2
+    python solverd.py --socket /tmp/solverd.sock --client < requests.jsonl
+"""
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOLVER_DIRS = [os.path.join(ROOT, 'Checkers'), os.path.join(ROOT, 'Hua Rong Dao'),
+               os.path.join(ROOT, 'Battle Solitaire')]
+
+CACHE_SIZE = 1000         # results kept by default
+LATENCY_WINDOW = 1000     # latencies the stats percentiles are taken over
+TABLE_LIMIT = 1000000     # entries of the PVS table before a worker clears it
+LINE_LIMIT = 1 << 20      # longest request line, in bytes
+
+
+# Worker side. The solvers are imported in the worker processes only.
+
+_book = None
+_pvs_table = {}
+_distance_tables = {}     # file name -> hrd.DistanceTable
+
+
+def _checkers_job(puzzle, search='alphabeta', depth=7, evaluation='python'):
+    """
+    Play the game out from the board in puzzle, red to move, as the checkers
+    CLI does.
+    """
+    import checkers
+    if len(_pvs_table) > TABLE_LIMIT:
+        _pvs_table.clear()
+    state = checkers.State([list(line.rstrip()) for line in puzzle.splitlines() if line.strip()])
+    best_moves = checkers.solve_checkers(state, 'r', depth, _book, search, evaluation, _pvs_table)
+    nodes = checkers.pvs.nodesExplored if search == 'pvs' else checkers.alpha_beta.nodesExplored
+    solution = ''.join(''.join(''.join(row) + '\n' for row in s.board) + '\n' for s in best_moves)
+    return solution, nodes
+
+
+def _hrd_job(puzzle, algo='astar', table=None):
+    """
+    Solve the Hua Rong Dao puzzle (initial and goal board) in puzzle with
+    algo, 'astar' or 'dfs', or look it up in the distance table file table
+    if that is for its goal (nodes is then 0).
+    """
+    import hrd
+    board, goal_board = hrd.parse_puzzle(puzzle.splitlines(True))
+    if table is not None:
+        if table not in _distance_tables:
+            _distance_tables[table] = hrd.DistanceTable(table)
+        path = _distance_tables[table].solve(board, goal_board)
+        if path == "No solution":
+            return None, 0
+        if path is not None:
+            return ''.join(hrd.grid_to_string(grid) + '\n' for grid in path), 0
+    initial_state = hrd.State(board, h=hrd.manhattan_distance(board, goal_board))
+    search = hrd.dfs if algo == 'dfs' else hrd.a_star
+    path = search(initial_state, goal_board)
+    if path == "No solution":
+        return None, search.nodesExplored
+    return ''.join(hrd.grid_to_string(board.grid) + '\n' for board in path), search.nodesExplored
+
+
+def _battle_job(puzzle, model='cells', heuristic='mrv', values='fixed', backjump=False, engine='csp'):
+    """
+    Solve the Battle Solitaire puzzle with battle.solve.
+    """
+    import battle
+    solution = battle.solve(puzzle, model, heuristic, values, backjump=backjump, engine=engine)
+    return solution, battle.bt_search.nodesExplored
+
+
+JOBS = {'checkers': _checkers_job, 'hrd': _hrd_job, 'battle': _battle_job}
+
+
+def _work(conn, book):
+    """
+    Worker process: run each (solver, puzzle, options) received on conn and
+    send back its result dict until None is received.
+    """
+    global _book
+    sys.path[:0] = [ROOT] + SOLVER_DIRS
+    import checkers, hrd, battle     # now rather than in the first job of each
+    if book:
+        _book = checkers.OpeningBook(book)
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        solver, puzzle, options = job
+        start = time.perf_counter()
+        try:
+            solution, nodes = JOBS[solver](puzzle, **options)
+            result = {'solution': solution, 'nodes': nodes}
+        except Exception as e:
+            result = {'error': '{}: {}'.format(type(e).__name__, e)}
+        result['time'] = round(time.perf_counter() - start, 4)
+        conn.send(result)
+
+
+# Daemon side.
+
+class _Worker:
+    """
+    One worker process and the parent's end of its pipe.
+    """
+    def __init__(self, book):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_work, args=(child, book), daemon=True)
+        self.process.start()
+        child.close()
+
+    async def run(self, job):
+        """
+        Send job to the worker and wait for its result without blocking the
+        event loop. Raises EOFError if the worker dies while running it, and
+        OSError (BrokenPipeError) if it was already dead.
+        """
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = self.conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            self.conn.send(job)
+            await ready
+        finally:
+            loop.remove_reader(fd)
+        return self.conn.recv()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class _Job:
+    __slots__ = ('client', 'id', 'solver', 'puzzle', 'options', 'key', 'submitted', 'expiry', 'queued',
+                 'running', 'finished')
+
+    def __init__(self, client, id, solver, puzzle, options):
+        self.client = client
+        self.id = id
+        self.solver = solver
+        self.puzzle = puzzle
+        self.options = options
+        self.key = json.dumps([solver, puzzle, options], sort_keys=True)
+        self.submitted = time.monotonic()
+        self.expiry = None       # the TimerHandle of its deadline
+        self.queued = False      # waiting in the queue for a worker
+        self.running = None      # the task waiting for its worker
+        self.finished = False
+
+
+class _Client:
+    """
+    One connection: its writer and its jobs not finished yet, by id.
+    """
+    def __init__(self, writer):
+        self.writer = writer
+        self.jobs = {}
+
+    def send(self, response):
+        if not self.writer.is_closing():
+            self.writer.write(json.dumps(response, sort_keys=True).encode() + b'\n')
+
+
+class SolverDaemon:
+    """
+    The daemon: a Unix socket server at path, workers worker processes
+    (default: one per CPU) and the result cache.
+
+    :param timeout: Default deadline of a job in seconds, None for none.
+    :param cache_size: Number of results kept, 0 to keep none.
+    :param book: A checkers opening book for the workers to look moves up in.
+    :raises ValueError: If book is not an opening book (OSError if it cannot
+        be opened).
+    """
+    def __init__(self, path, workers=None, timeout=None, cache_size=CACHE_SIZE, book=None):
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.book = book
+        if book:
+            # open it here once, so that a bad book stops the daemon rather
+            # than every worker
+            sys.path.insert(0, SOLVER_DIRS[0])
+            import checkers
+            checkers.OpeningBook(book).close()
+        self._cache = collections.OrderedDict()    # job key -> result
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._counters = collections.Counter()
+        self._solvers = collections.Counter()
+        self._started = None
+        self._busy = 0
+        self._queued = 0         # jobs queued and not started, cancelled or timed out
+        self._pool = []
+        self._queue = None
+
+    async def serve(self):
+        """
+        Serve until SIGINT or SIGTERM.
+        """
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        self._started = time.monotonic()
+        self._queue = asyncio.Queue()
+        self._pool = [_Worker(self.book) for i in range(self.workers)]
+        dispatchers = [asyncio.ensure_future(self._dispatch(slot)) for slot in range(self.workers)]
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._serve_client, path=self.path, limit=LINE_LIMIT)
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            for dispatcher in dispatchers:
+                dispatcher.cancel()
+            await asyncio.gather(*dispatchers, return_exceptions=True)
+            for worker in self._pool:
+                worker.stop()
+            os.unlink(self.path)
+
+    async def _serve_client(self, reader, writer):
+        client = _Client(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("not an object")
+                except ValueError as e:
+                    client.send({'error': 'bad request: {}'.format(e)})
+                    continue
+                self._handle(client, request)
+                await writer.drain()
+        finally:
+            for job in list(client.jobs.values()):
+                self._abort(job, 'cancelled', 'cancelled')
+            writer.close()
+
+    def _handle(self, client, request):
+        op = request.get('op')
+        id = request.get('id')
+        if not (id is None or isinstance(id, (str, int))):
+            # ids are keys of client.jobs, so lists and objects cannot be
+            if op == 'solve':
+                self._counters['rejected'] += 1
+            client.send({'op': op, 'id': None, 'error': 'id must be a string, an integer or null'})
+        elif op == 'solve':
+            self._submit(client, request)
+        elif op == 'cancel':
+            job = client.jobs.get(id)
+            if job is not None:
+                self._abort(job, 'cancelled', 'cancelled')
+            client.send({'op': op, 'id': id, 'cancelled': job is not None})
+        elif op == 'stats':
+            client.send(dict(self.stats(), op=op, id=id))
+        else:
+            client.send({'op': op, 'id': id, 'error': 'unknown op {!r}'.format(op)})
+
+    def _submit(self, client, request):
+        id = request.get('id')
+        solver = request.get('solver')
+        puzzle = request.get('puzzle')
+        options = request.get('options') or {}
+        deadline = request.get('deadline', self.timeout)
+        error = None
+        if id in client.jobs:
+            error = 'job {!r} is already running'.format(id)
+        elif solver not in JOBS:
+            error = 'unknown solver {!r}'.format(solver)
+        elif not isinstance(puzzle, str):
+            error = 'puzzle must be a string'
+        elif not isinstance(options, dict):
+            error = 'options must be an object'
+        elif deadline is not None and (isinstance(deadline, bool) or not isinstance(deadline, (int, float))
+                                       or deadline <= 0):
+            error = 'deadline must be a number of seconds'
+        if error is not None:
+            self._counters['rejected'] += 1
+            client.send({'op': 'solve', 'id': id, 'error': error})
+            return
+
+        job = _Job(client, id, solver, puzzle, options)
+        self._counters['submitted'] += 1
+        self._solvers[solver] += 1
+        if job.key in self._cache:
+            self._cache.move_to_end(job.key)
+            self._counters['cache_hits'] += 1
+            self._finish(job, dict(self._cache[job.key], cached=True))
+            return
+        client.jobs[id] = job
+        if deadline is not None:
+            job.expiry = asyncio.get_running_loop().call_later(
+                deadline, self._abort, job, 'deadline of {}s exceeded'.format(deadline), 'timed_out')
+        job.queued = True
+        self._queued += 1
+        self._queue.put_nowait(job)
+
+    async def _dispatch(self, slot):
+        """
+        Run the queued jobs on worker slot, one at a time.
+        """
+        while True:
+            job = await self._queue.get()
+            if job.finished:
+                continue
+            self._dequeue(job)
+            job.running = asyncio.ensure_future(self._pool[slot].run((job.solver, job.puzzle, job.options)))
+            self._busy += 1
+            try:
+                result = await job.running
+            except asyncio.CancelledError:
+                if not job.finished:
+                    raise        # the daemon is stopping
+                self._replace(slot)
+                continue
+            except (EOFError, OSError):
+                self._pool[slot].process.join(1)
+                result = {'error': 'worker exited with code {}'.format(self._pool[slot].process.exitcode)}
+                self._replace(slot)
+            finally:
+                self._busy -= 1
+            if 'error' not in result and self.cache_size:
+                self._cache[job.key] = result
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            self._finish(job, result)
+
+    def _dequeue(self, job):
+        if job.queued:
+            job.queued = False
+            self._queued -= 1
+
+    def _replace(self, slot):
+        self._pool[slot].kill()
+        self._pool[slot] = _Worker(self.book)
+
+    def _finish(self, job, result):
+        if job.finished:
+            return
+        job.finished = True
+        self._dequeue(job)
+        if job.expiry is not None:
+            job.expiry.cancel()
+        job.client.jobs.pop(job.id, None)
+        self._counters['failed' if 'error' in result else 'completed'] += 1
+        self._latencies.append(time.monotonic() - job.submitted)
+        job.client.send(dict(result, op='solve', id=job.id))
+
+    def _abort(self, job, error, counter):
+        """
+        Finish job with error, counted under counter, killing its worker if
+        it is running.
+        """
+        if job.finished:
+            return
+        job.finished = True
+        self._dequeue(job)
+        if job.expiry is not None:
+            job.expiry.cancel()
+        job.client.jobs.pop(job.id, None)
+        self._counters[counter] += 1
+        if job.running is not None:
+            job.running.cancel()
+        job.client.send({'op': 'solve', 'id': job.id, 'error': error})
+
+    def stats(self):
+        """
+        The counters: jobs by outcome and by solver, the queue, throughput
+        (finished jobs per second of uptime) and the latency (seconds from
+        request to response) of the last LATENCY_WINDOW jobs.
+        """
+        uptime = time.monotonic() - self._started
+        counters = self._counters
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 6) if latencies else None
+
+        finished = counters['completed'] + counters['failed'] + counters['cancelled'] + counters['timed_out']
+        return {
+            'uptime': round(uptime, 3),
+            'workers': len(self._pool),
+            'busy': self._busy,
+            'queued': self._queued,
+            'submitted': counters['submitted'],
+            'completed': counters['completed'],
+            'failed': counters['failed'],
+            'cancelled': counters['cancelled'],
+            'timed_out': counters['timed_out'],
+            'rejected': counters['rejected'],
+            'cache_hits': counters['cache_hits'],
+            'cached': len(self._cache),
+            'solvers': dict(self._solvers),
+            'throughput': round(finished / uptime, 3) if uptime else None,
+            'latency': {
+                'mean': round(sum(latencies) / len(latencies), 6) if latencies else None,
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': round(latencies[-1], 6) if latencies else None,
+            },
+        }
+
+
+def run_client(path, requests, out):
+    """
+    Send each request line of requests to the daemon at path and write the
+    responses to out as they come, until every request has its response.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    lines = [line.strip() for line in requests if line.strip()]
+    sock.sendall(''.join(line + '\n' for line in lines).encode())
+    with sock.makefile('r') as responses:
+        for i in range(len(lines)):
+            response = responses.readline()
+            if not response:
+                break
+            out.write(response)
+            out.flush()
+    sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--socket",
+        type=str,
+        required=True,
+        help="The Unix socket to listen on (or with --client, to connect to)."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: one per CPU)."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Deadline in seconds of the jobs that do not give one."
+    )
+    parser.add_argument(
+        "--cache",
+        type=int,
+        default=CACHE_SIZE,
+        help="Number of job results to keep and answer repeated jobs from (0: none)."
+    )
+    parser.add_argument(
+        "--book",
+        type=str,
+        help="A checkers opening book (see checkers.py --build-book) for the workers."
+    )
+    parser.add_argument(
+        "--client",
+        action='store_true',
+        help="Send the JSON-lines requests on stdin to a running daemon and print its responses."
+    )
+    args = parser.parse_args()
+
+    if args.client:
+        run_client(args.socket, sys.stdin, sys.stdout)
+    else:
+        try:
+            daemon = SolverDaemon(args.socket, args.workers, args.timeout, args.cache, args.book)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        asyncio.run(daemon.serve())